@@ -0,0 +1,95 @@
+import argparse
+import json
+import random
+import time
+from typing import List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from extraction.ocr_engine import OcrEngine
+from services.model_registry import model_registry
+
+WORDS = ("experience", "manager", "engineer", "university", "python", "budget", "team", "project", "sales",
+         "certified", "analyst", "hospital", "platform", "delivered", "languages", "education", "skills")
+PAGE_SIZES = ((2480, 3508), (3024, 4032), (1700, 2200))
+
+def load_font(size: int):
+    """Load PIL's default font at a size, or at its fixed size on Pillow < 10.1."""
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+def make_images(count: int, seed: int = 0) -> List[Tuple[np.ndarray, List[str]]]:
+    """Render a deterministic set of scanned-page-like text images.
+
+    Args:
+        count (int): Number of images.
+        seed (int): Random seed; the same seed gives the same set.
+
+    Returns:
+        List[Tuple[np.ndarray, List[str]]]: Grayscale image and the words drawn on it.
+    """
+    rng = random.Random(seed)
+    images = []
+    for number in range(count):
+        width, height = PAGE_SIZES[number % len(PAGE_SIZES)]
+        font_size = rng.choice((36, 48, 64))
+        font = load_font(font_size)
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        words = []
+        for top in range(font_size * 2, height - font_size * 2, font_size * 3):
+            line = [rng.choice(WORDS) for _ in range(rng.randint(3, 6))]
+            draw.text((font_size * 2, top), " ".join(line), fill=0, font=font)
+            words.extend(line)
+        images.append((np.array(image), words))
+    return images
+
+def _recall(texts: List[str], expected: List[List[str]]) -> float:
+    found = total = 0
+    for text, words in zip(texts, expected):
+        recognized = set(text.lower().split())
+        found += sum(word in recognized for word in words)
+        total += len(words)
+    return found / total if total else 0.0
+
+def run(count: int, seed: int) -> dict:
+    """Compare per-image full-resolution OCR with the batched OcrEngine.
+
+    Args:
+        count (int): Number of benchmark images.
+        seed (int): Random seed of the image set.
+
+    Returns:
+        dict: Images/sec and word recall of the 'baseline' and 'engine' paths, and the 'speedup'.
+    """
+    samples = make_images(count, seed)
+    images = [image for image, _ in samples]
+    expected = [words for _, words in samples]
+    reader = model_registry.get("ocr")
+    reader.readtext(images[0][:512, :512], detail=0)
+
+    started = time.perf_counter()
+    baseline = [" ".join(reader.readtext(image, detail=0)) for image in images]
+    baseline_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = OcrEngine(model_registry).recognize(images)
+    engine_time = time.perf_counter() - started
+    return {
+        "images": count,
+        "baseline": {"images_per_sec": count / baseline_time, "word_recall": _recall(baseline, expected)},
+        "engine": {"images_per_sec": count / engine_time, "word_recall": _recall(batched, expected)},
+        "speedup": baseline_time / engine_time
+    }
+
+def main():
+    """Run the OCR benchmark and print a JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark batched OCR against per-image OCR.")
+    parser.add_argument("--images", type=int, default=24, help="Number of generated images")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the image set")
+    args = parser.parse_args()
+    print(json.dumps(run(args.images, args.seed), indent=2))
+
+if __name__ == "__main__":
+    main()
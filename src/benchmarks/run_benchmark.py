@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+import fitz
+import numpy as np
+from PIL import Image, ImageDraw
+from benchmarks.ocr_benchmark import load_font
+from services.collection_service import CollectionService
+from services.document_service import build_strategies
+from services.model_registry import model_registry
+from services.qa_service import QAService
+from services.redis_service import RedisService
+
+try:
+    import fakeredis
+    import fakeredis.aioredis
+except ImportError:
+    fakeredis = None
+
+COMPANIES = ("Northwind Traders", "Contoso Ltd", "Globex Corporation", "Initech", "Umbrella Logistics",
+             "Stark Industries", "Wayne Enterprises", "Acme Supplies", "Hooli Systems", "Vandelay Imports")
+CITIES = ("Berlin", "Chicago", "Lisbon", "Toronto", "Osaka", "Nairobi", "Madrid", "Oslo", "Denver", "Seoul")
+FILLER = ("The review covered delivery schedules, payment terms and the quality of the supplied goods.",
+          "All amounts are stated before taxes and include shipping to the listed address.",
+          "Questions about this document should be sent to the accounts department within thirty days.",
+          "The parties agreed to revisit the pricing model at the end of the current quarter.",
+          "Records were reconciled against the warehouse inventory and no discrepancies were found.")
+
+def make_document(number: int, facts: int, rng: random.Random) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Generate the text of one synthetic invoice summary.
+
+    Args:
+        number (int): Document number, part of every invoice id.
+        facts (int): Invoices described in the document.
+        rng (random.Random): Source of randomness.
+
+    Returns:
+        Tuple[List[str], List[Tuple[str, str]]]: Paragraphs of text, and a question
+            with its expected answer for each invoice.
+    """
+    paragraphs, questions = [], []
+    for fact in range(facts):
+        invoice = f"INV-{number:04d}-{fact}"
+        company, city = rng.choice(COMPANIES), rng.choice(CITIES)
+        paragraphs.append(f"Invoice {invoice} was issued by {company} in {city} on "
+                          f"{rng.randint(1, 28)} March 2024 for {rng.randint(100, 99999)} USD. "
+                          + " ".join(rng.sample(FILLER, 2)))
+        questions.append((f"Which company issued invoice {invoice}?", company))
+    return paragraphs, questions
+
+def write_pdf(path: str, paragraphs: List[str], pages: int):
+    """Write paragraphs to a PDF with a text layer.
+
+    Args:
+        path (str): Destination file.
+        paragraphs (List[str]): Text to write.
+        pages (int): Number of pages the paragraphs are spread over.
+    """
+    document = fitz.open()
+    per_page = max(1, -(-len(paragraphs) // pages))
+    for start in range(0, len(paragraphs), per_page):
+        page = document.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, page.rect.width - 50, page.rect.height - 50),
+                            "\n\n".join(paragraphs[start:start + per_page]), fontsize=11)
+    document.save(path)
+    document.close()
+
+def write_image(path: str, paragraphs: List[str], width: int = 1700, font_size: int = 32):
+    """Render paragraphs as a scanned-page-like image without a text layer.
+
+    Args:
+        path (str): Destination file; the extension selects the format.
+        paragraphs (List[str]): Text to render.
+        width (int): Image width in pixels.
+        font_size (int): Font size in pixels.
+    """
+    font = load_font(font_size)
+    lines = []
+    for paragraph in paragraphs:
+        line = ""
+        for word in paragraph.split():
+            if len(line) + len(word) + 1 > width // (font_size // 2 + 2):
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}".strip()
+        lines.extend((line, ""))
+    image = Image.new("L", (width, font_size * 2 * (len(lines) + 2)), 255)
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(lines):
+        draw.text((font_size * 2, font_size * 2 * (row + 1)), line, fill=0, font=font)
+    image.save(path)
+
+def make_corpus(directory: str, pdfs: int, images: int, pages: int, facts: int,
+                seed: int = 0) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Generate a deterministic corpus of PDFs and images.
+
+    Args:
+        directory (str): Directory the files are written to.
+        pdfs (int): Number of PDFs.
+        images (int): Number of PNG images.
+        pages (int): Pages per PDF.
+        facts (int): Invoices described per PDF page; images describe 'facts' invoices.
+        seed (int): Random seed; the same seed gives the same corpus.
+
+    Returns:
+        Tuple[List[str], List[Tuple[str, str]]]: File paths, and every question with its expected answer.
+    """
+    rng = random.Random(seed)
+    paths, questions = [], []
+    for number in range(pdfs + images):
+        is_pdf = number < pdfs
+        paragraphs, document_questions = make_document(number, facts * pages if is_pdf else facts, rng)
+        path = os.path.join(directory, f"doc-{number:04d}.{'pdf' if is_pdf else 'png'}")
+        if is_pdf:
+            write_pdf(path, paragraphs, pages)
+        else:
+            write_image(path, paragraphs)
+        paths.append(path)
+        questions.extend(document_questions)
+    return paths, questions
+
+def peak_rss() -> dict:
+    """Report the peak resident set size of this process and its finished child processes.
+
+    Returns:
+        dict: 'self_bytes' and 'children_bytes'.
+    """
+    scale = 1 if sys.platform == "darwin" else 1024
+    return {"self_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            "children_bytes": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+def latency_summary(latencies: List[float], elapsed: float) -> dict:
+    """Summarize request latencies in milliseconds.
+
+    Args:
+        latencies (List[float]): Seconds each request took.
+        elapsed (float): Wall-clock seconds of the whole run.
+
+    Returns:
+        dict: 'requests', 'requests_per_sec' and 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'.
+    """
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, (50, 95, 99))
+    return {"requests": len(latencies), "requests_per_sec": len(latencies) / elapsed, "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": max(latencies) * 1000}
+
+def run_questions(ask: Callable[[str], str], questions: List[Tuple[str, str]], requests: int,
+                  concurrency: int) -> dict:
+    """Send questions concurrently and measure latency and answer accuracy.
+
+    Args:
+        ask (Callable[[str], str]): Answers one question, returning the best answer text.
+        questions (List[Tuple[str, str]]): Questions with their expected answers, cycled as needed.
+        requests (int): Number of questions sent.
+        concurrency (int): Questions in flight at once.
+
+    Returns:
+        dict: latency_summary of the run, plus 'accuracy', the share of answers
+            containing the expected company name.
+    """
+    sample = [questions[position % len(questions)] for position in range(requests)]
+
+    def timed_ask(item):
+        started = time.perf_counter()
+        answer = ask(item[0])
+        return time.perf_counter() - started, item[1].lower() in answer.lower()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(timed_ask, sample))
+    summary = latency_summary([latency for latency, _ in outcomes], time.perf_counter() - started)
+    summary["accuracy"] = sum(correct for _, correct in outcomes) / len(outcomes)
+    return summary
+
+def make_redis_service() -> RedisService:
+    """Create a RedisService backed by a fresh in-memory fakeredis server.
+
+    Returns:
+        RedisService: Service whose sync and asyncio clients share one fake server.
+
+    Raises:
+        RuntimeError: If fakeredis is not installed.
+    """
+    if fakeredis is None:
+        raise RuntimeError("The benchmark needs fakeredis: pip install -r requirements-dev.txt")
+    server = fakeredis.FakeServer()
+    return RedisService(client=fakeredis.FakeRedis(server=server),
+                        async_client=fakeredis.aioredis.FakeRedis(server=server))
+
+def disable_answer_cache(qa_service: QAService):
+    """Turn off both answer cache tiers, so every question is answered by the model."""
+    qa_service.answer_cache.max_entries = 0
+    qa_service.answer_cache.ttl = 0
+
+def bench_services(paths: List[str], questions: List[Tuple[str, str]], workdir: str, requests: int,
+                   concurrency: int, answer_cache: bool) -> dict:
+    """Ingest through DocumentService.process_document and ask through QAService in-process.
+
+    Args:
+        paths (List[str]): Corpus files.
+        questions (List[Tuple[str, str]]): Questions with expected answers.
+        workdir (str): Directory for the index.
+        requests (int): Questions sent.
+        concurrency (int): Questions in flight at once.
+        answer_cache (bool): Whether repeated questions may be served from the answer cache.
+
+    Returns:
+        dict: 'ingest', 'ask', 'index' and 'peak_rss' results.
+    """
+    redis_service = make_redis_service()
+    collections = CollectionService(redis_service=redis_service, index_dir=os.path.join(workdir, "services-index"),
+                                    strategies=build_strategies(model_registry), snapshot_interval=0)
+    collection = collections.get(collections.default)
+    qa_service = QAService(collections=collections)
+    if not answer_cache:
+        disable_answer_cache(qa_service)
+    model_registry.preload(background=False)
+    try:
+        started = time.perf_counter()
+        for path in paths:
+            with open(path, "rb") as f:
+                collection.document_service.process_document(os.path.basename(path), f.read())
+        elapsed = time.perf_counter() - started
+        ask = run_questions(lambda question: qa_service.answer_question(question)["answer"], questions, requests,
+                            concurrency)
+        return {"ingest": {"documents": len(paths), "seconds": elapsed, "docs_per_sec": len(paths) / elapsed},
+                "ask": ask, "index": collection.rag_service.index_stats(), "peak_rss": peak_rss()}
+    finally:
+        collections.close()
+        redis_service.close()
+
+def bench_app(paths: List[str], questions: List[Tuple[str, str]], workdir: str, requests: int, concurrency: int,
+              answer_cache: bool, upload_batch: int) -> dict:
+    """Ingest through POST /upload and ask through POST /ask with an in-process client.
+
+    The rate limiter is disabled so it does not cap the measured throughput.
+    Uploads go through the ingestion worker processes like in production;
+    one warm-up upload loads their models before timing starts.
+
+    Args:
+        paths (List[str]): Corpus files; the first one is also used for the warm-up.
+        questions (List[Tuple[str, str]]): Questions with expected answers.
+        workdir (str): Directory for the index and spooled uploads.
+        requests (int): Questions sent.
+        concurrency (int): Questions in flight at once.
+        answer_cache (bool): Whether repeated questions may be served from the answer cache.
+        upload_batch (int): Files per /upload request.
+
+    Returns:
+        dict: 'ingest', 'ask', 'index' and 'peak_rss' results.
+    """
+    from fastapi.testclient import TestClient
+    from main import APIServer
+
+    server = APIServer(preload="eager", redis_service=make_redis_service(),
+                       index_dir=os.path.join(workdir, "app-index"), spool_dir=os.path.join(workdir, "spool"))
+    server.limiter.enabled = False
+    if not answer_cache:
+        disable_answer_cache(server.qa_service)
+
+    def upload(client, batch):
+        files = []
+        try:
+            files = [("files", (os.path.basename(path), open(path, "rb"))) for path in batch]
+            response = client.post("/upload", params={"stream": "true"}, files=files, headers=headers)
+            response.raise_for_status()
+            return [json.loads(line) for line in response.text.splitlines() if line]
+        finally:
+            for _, (_, f) in files:
+                f.close()
+
+    with TestClient(server.get_app()) as client:
+        token = client.post("/token", json={"username": "admin", "password": "secret"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        warmup = os.path.join(workdir, "warmup-" + os.path.basename(paths[0]))
+        with open(paths[0], "rb") as source, open(warmup, "wb") as target:
+            target.write(source.read() + b"\n")
+        upload(client, [warmup])
+        started = time.perf_counter()
+        jobs = [job for start in range(0, len(paths), upload_batch)
+                for job in upload(client, paths[start:start + upload_batch])]
+        elapsed = time.perf_counter() - started
+
+        def ask(question):
+            response = client.post("/ask", json={"question": question}, headers=headers)
+            response.raise_for_status()
+            return response.json()["answer"]
+
+        result = run_questions(ask, questions, requests, concurrency)
+        default = server.collection_service.get(server.collection_service.default)
+        return {"ingest": {"documents": len(paths), "failed": sum(job["status"] != "done" for job in jobs),
+                           "seconds": elapsed, "docs_per_sec": len(paths) / elapsed},
+                "ask": result, "index": default.rag_service.index_stats(), "peak_rss": peak_rss()}
+
+def git_revision() -> str:
+    """Return the current commit hash, or 'unknown' outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    """Run the ingest and /ask benchmarks and write a JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark document ingestion and question answering.")
+    parser.add_argument("--pdfs", type=int, default=20, help="Number of generated PDFs")
+    parser.add_argument("--images", type=int, default=5, help="Number of generated images")
+    parser.add_argument("--pages", type=int, default=4, help="Pages per PDF")
+    parser.add_argument("--facts", type=int, default=3, help="Invoices described per PDF page and per image")
+    parser.add_argument("--requests", type=int, default=200, help="Questions sent to /ask")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions in flight at once")
+    parser.add_argument("--upload-batch", type=int, default=8, help="Files per /upload request")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Allow repeated questions to be served from the answer cache")
+    parser.add_argument("--mode", choices=("services", "app", "both"), default="both",
+                        help="Drive the services directly, the FastAPI app, or both")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the corpus")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    report = {"timestamp": datetime.now(timezone.utc).isoformat(), "revision": git_revision(),
+              "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+              "parameters": vars(args)}
+    with tempfile.TemporaryDirectory(prefix="dis-bench-") as workdir:
+        corpus = os.path.join(workdir, "corpus")
+        os.makedirs(corpus)
+        paths, questions = make_corpus(corpus, args.pdfs, args.images, args.pages, args.facts, args.seed)
+        report["corpus"] = {"documents": len(paths), "bytes": sum(os.path.getsize(path) for path in paths),
+                            "questions": len(questions)}
+        if args.mode in ("services", "both"):
+            report["services"] = bench_services(paths, questions, workdir, args.requests, args.concurrency,
+                                                args.answer_cache)
+        if args.mode in ("app", "both"):
+            report["app"] = bench_app(paths, questions, workdir, args.requests, args.concurrency,
+                                      args.answer_cache, args.upload_batch)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
 from abc import ABC, abstractmethod
+from typing import List, Union
 
 class ExtractionStrategy(ABC):
     """Abstract base class for text extraction strategies.
 
     Defines the interface for extracting text from different file types.
     Concrete strategies (e.g., PDF, Image) must implement the extract_text method.
+    Sources are either raw bytes or a path to the file on disk; paths let the
+    underlying libraries read the file lazily instead of holding a bytes copy.
 
+    Attributes:
+        name (str): Short name of the strategy, used in metrics.
     """
+    name = "generic"
+
     @abstractmethod
-    def extract_text(self, file_content: bytes) -> str:
+    def extract_text(self, file_content: Union[bytes, str]) -> str:
         """Extract text from the given file content.
 
         Args:
-            file_content (bytes): Raw bytes of the file to extract text from.
+            file_content (Union[bytes, str]): Raw bytes of the file, or its path.
 
         Returns:
             str: Extracted text from the file.
@@ -21,4 +28,31 @@ class ExtractionStrategy(ABC):
             NotImplementedError: If not implemented by a subclass.
         """
         pass
-    
\ No newline at end of file
+
+    def extract_pages(self, file_content: Union[bytes, str]) -> List[str]:
+        """Extract text from the given file content, one entry per page.
+
+        Single-page formats return a one-element list. Strategies for paged
+        formats override this so passages can carry page numbers.
+
+        Args:
+            file_content (Union[bytes, str]): Raw bytes of the file, or its path.
+
+        Returns:
+            List[str]: Extracted text of each page, in order.
+        """
+        return [self.extract_text(file_content)]
+
+    def extract_pages_batch(self, sources: List[Union[bytes, str]]) -> List[List[str]]:
+        """Extract the pages of several files of this type.
+
+        Strategies that can process files together (e.g. batched OCR)
+        override this; the default extracts each file on its own.
+
+        Args:
+            sources (List[Union[bytes, str]]): Raw bytes or path of each file.
+
+        Returns:
+            List[List[str]]: Extracted text of each page of each file, in order.
+        """
+        return [self.extract_pages(source) for source in sources]
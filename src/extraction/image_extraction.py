@@ -1,8 +1,22 @@
 import io
-import easyocr
+from typing import List, Union
 import numpy as np
 from PIL import Image
+from services.model_registry import ModelRegistry, model_registry
 from .extraction_strategy import ExtractionStrategy
+from .ocr_engine import OcrEngine
+
+def load_grayscale(file_content: Union[bytes, str]) -> np.ndarray:
+    """Decode an image from raw bytes or a path into a grayscale array.
+
+    Args:
+        file_content (Union[bytes, str]): Raw bytes of the image file, or its path.
+
+    Returns:
+        np.ndarray: 8-bit grayscale pixels.
+    """
+    image = Image.open(file_content if isinstance(file_content, str) else io.BytesIO(file_content))
+    return np.array(image.convert("L"))
 
 class ImageExtractionStrategy(ExtractionStrategy):
     """Strategy for extracting text from image files using OCR.
@@ -11,34 +25,75 @@ class ImageExtractionStrategy(ExtractionStrategy):
     (e.g., .jpg, .jpeg, .png) by converting the raw bytes to a processable format
     and using the easyocr library for text recognition.
 
-    Attributes:
-        reader (easyocr.Reader): OCR reader instance initialized for English.
+    Images are scaled to a common text height, tiled when very large and
+    recognized in batches by an OcrEngine; extract_batch recognizes several
+    images together.
 
+    Attributes:
+        registry (ModelRegistry): Registry providing the shared OCR reader.
+        engine (OcrEngine): Batched OCR engine.
     """
-    def __init__(self):
-        """Initialize the ImageExtractionStrategy with an English OCR reader."""
-        self.reader = easyocr.Reader(["en"])
+    name = "image"
 
-    def extract_text(self, file_content: bytes) -> str:
-        """Extract text from image bytes using OCR.
+    def __init__(self, registry: ModelRegistry = model_registry, engine: OcrEngine = None):
+        """Initialize the ImageExtractionStrategy.
 
-        Converts the input bytes to a PIL Image, processes it into a numpy array,
-        and applies OCR to extract text.
+        Args:
+            registry (ModelRegistry): Registry providing the shared English OCR reader.
+            engine (OcrEngine): Batched OCR engine. Defaults to one with the configured settings.
+        """
+        self.registry = registry
+        self.engine = engine or OcrEngine(registry)
+
+    @property
+    def reader(self):
+        """easyocr.Reader: Shared English OCR reader, loaded on first use."""
+        return self.engine.reader
+
+    def extract_text(self, file_content: Union[bytes, str]) -> str:
+        """Extract text from an image using OCR.
+
+        Opens the image from raw bytes or a path as a PIL Image, processes it
+        into a numpy array, and applies OCR to extract text.
 
         Args:
-            file_content (bytes): Raw bytes of the image file.
+            file_content (Union[bytes, str]): Raw bytes of the image file, or its path.
 
         Returns:
             str: Extracted text from the image, or empty string if extraction fails.
 
+        Raises:
+            ValueError: If image processing or OCR fails, with a descriptive message.
+        """
+        return self.extract_batch([file_content])[0]
+
+    def extract_batch(self, sources: List[Union[bytes, str]]) -> List[str]:
+        """Extract text from several images with shared OCR batches.
+
+        Args:
+            sources (List[Union[bytes, str]]): Raw bytes or path of each image file.
+
+        Returns:
+            List[str]: Extracted text of each image, in order.
+
         Raises:
             ValueError: If image processing or OCR fails, with a descriptive message.
         """
         try:
-            image = Image.open(io.BytesIO(file_content))
-            image = image.convert("L")
-            image_np = np.array(image)
-            result = self.reader.readtext(image_np, detail=0)
-            return " ".join(result) if result else ""
+            return self.engine.recognize([load_grayscale(source) for source in sources])
         except Exception as e:
             raise ValueError(f"Image extraction failed: {str(e)}")
+
+    def extract_pages_batch(self, sources: List[Union[bytes, str]]) -> List[List[str]]:
+        """Extract several images with shared OCR batches, one page per image.
+
+        Args:
+            sources (List[Union[bytes, str]]): Raw bytes or path of each image file.
+
+        Returns:
+            List[List[str]]: One-element page list of each image, in order.
+
+        Raises:
+            ValueError: If image processing or OCR fails, with a descriptive message.
+        """
+        return [[text] for text in self.extract_batch(sources)]
@@ -0,0 +1,209 @@
+import threading
+from typing import List, Tuple
+import cv2
+import numpy as np
+from services.model_registry import ModelRegistry, model_registry
+from utils.config import (OCR_BATCH_SIZE, OCR_TARGET_TEXT_HEIGHT, OCR_PROBE_SIDE, OCR_MAX_SIDE, OCR_TILE_SIZE,
+                          OCR_TILE_OVERLAP, OCR_THREADS, OCR_WORKERS)
+from utils.logger import setup_logging
+
+logger = setup_logging()
+
+_threads_lock = threading.Lock()
+_threads_set = False
+
+def _set_torch_threads(threads: int):
+    global _threads_set
+    with _threads_lock:
+        if threads > 0 and not _threads_set:
+            import torch
+            torch.set_num_threads(threads)
+            _threads_set = True
+
+def _resize(image: np.ndarray, scale: float) -> np.ndarray:
+    height, width = image.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+
+class OcrEngine:
+    """Batched OCR with size normalization on top of the shared easyocr reader.
+
+    Recognition cost grows with pixel count, while accuracy depends on the
+    height of the text in pixels. Each image is therefore scaled so that its
+    text is about target_text_height pixels tall: the text height is estimated
+    by running the detector on a small thumbnail, and images are only ever
+    scaled down. Images still larger than tile_size are split into overlapping
+    tiles; neighboring tiles split their shared band down the middle and each
+    keeps only the words centered on its side, so words read in both tiles
+    are kept once. Tiles are padded to a small set of shapes, so tiles of many images
+    share readtext_batched calls.
+
+    Attributes:
+        registry (ModelRegistry): Registry providing the shared OCR reader.
+        batch_size (int): Images per readtext_batched call.
+        target_text_height (int): Text height in pixels images are scaled to; 0 disables scaling.
+        probe_side (int): Longest side of the thumbnail used to estimate the text height.
+        max_side (int): Longest side an image is scaled to when no text height can be estimated.
+        tile_size (int): Images with a longer side are split into tiles; 0 disables tiling.
+        tile_overlap (int): Pixels shared by neighboring tiles.
+        workers (int): easyocr data loader workers.
+    """
+    bucket = 128
+
+    def __init__(self, registry: ModelRegistry = model_registry, batch_size: int = OCR_BATCH_SIZE,
+                 target_text_height: int = OCR_TARGET_TEXT_HEIGHT, probe_side: int = OCR_PROBE_SIDE,
+                 max_side: int = OCR_MAX_SIDE, tile_size: int = OCR_TILE_SIZE,
+                 tile_overlap: int = OCR_TILE_OVERLAP, threads: int = OCR_THREADS, workers: int = OCR_WORKERS):
+        """Initialize OcrEngine.
+
+        Args:
+            registry (ModelRegistry): Registry providing the shared OCR reader.
+            batch_size (int): Images per readtext_batched call.
+            target_text_height (int): Text height in pixels images are scaled to; 0 disables scaling.
+            probe_side (int): Longest side of the thumbnail used to estimate the text height.
+            max_side (int): Longest side an image is scaled to when no text height can be estimated.
+            tile_size (int): Images with a longer side are split into tiles; 0 disables tiling.
+            tile_overlap (int): Pixels shared by neighboring tiles.
+            threads (int): PyTorch intra-op threads of this process; 0 keeps the default.
+            workers (int): easyocr data loader workers.
+        """
+        self.registry = registry
+        self.batch_size = batch_size
+        self.target_text_height = target_text_height
+        self.probe_side = probe_side
+        self.max_side = max_side
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.threads = threads
+        self.workers = workers
+
+    @property
+    def reader(self):
+        """easyocr.Reader: Shared English OCR reader, loaded on first use."""
+        _set_torch_threads(self.threads)
+        return self.registry.get("ocr")
+
+    def _text_height(self, image: np.ndarray) -> float:
+        """Estimate the median text line height of an image from a thumbnail.
+
+        Args:
+            image (np.ndarray): Grayscale image.
+
+        Returns:
+            float: Median text height in pixels of the full image, or 0 if no text was detected.
+        """
+        scale = min(1.0, self.probe_side / max(image.shape[:2]))
+        probe = _resize(image, scale) if scale < 1 else image
+        horizontal, _ = self.reader.detect(probe)
+        boxes = horizontal[0] if horizontal else []
+        if not boxes:
+            return 0.0
+        return float(np.median([box[3] - box[2] for box in boxes])) / scale
+
+    def normalize(self, image: np.ndarray) -> np.ndarray:
+        """Scale an image down so its text is about target_text_height pixels tall.
+
+        Args:
+            image (np.ndarray): Grayscale image.
+
+        Returns:
+            np.ndarray: The scaled image, or the input if it needs no scaling.
+        """
+        if not self.target_text_height:
+            return image
+        text_height = self._text_height(image)
+        if text_height:
+            scale = self.target_text_height / text_height
+        else:
+            scale = self.max_side / max(image.shape[:2])
+        return _resize(image, scale) if scale < 0.9 else image
+
+    def tiles(self, image: np.ndarray) -> List[Tuple[int, int, np.ndarray]]:
+        """Split an image into overlapping tiles of at most tile_size pixels per side.
+
+        Args:
+            image (np.ndarray): Grayscale image.
+
+        Returns:
+            List[Tuple[int, int, np.ndarray]]: Top and left offset of each tile in the
+                image and the tile, in reading order (rows, then columns).
+        """
+        height, width = image.shape[:2]
+        if not self.tile_size or max(height, width) <= self.tile_size:
+            return [(0, 0, image)]
+        step = self.tile_size - self.tile_overlap
+        return [(top, left, image[top:top + self.tile_size, left:left + self.tile_size])
+                for top in range(0, max(1, height - self.tile_overlap), step)
+                for left in range(0, max(1, width - self.tile_overlap), step)]
+
+    def _owns(self, top: int, left: int, shape: Tuple[int, ...], box: List[List[float]]) -> bool:
+        """Tell whether a word box found in a tile belongs to that tile.
+
+        A tile owns its area up to the middle of each band it shares with a
+        neighbor, so of the two readings of a word in an overlap only the one
+        from the tile holding the center of the word is kept.
+
+        Args:
+            top (int): Top offset of the tile in the image.
+            left (int): Left offset of the tile in the image.
+            shape (Tuple[int, ...]): Shape of the whole image.
+            box (List[List[float]]): Corner points of the word box, in tile coordinates.
+
+        Returns:
+            bool: True if the center of the box lies in the part of the image the tile owns.
+        """
+        if not self.tile_size:
+            return True
+        half = self.tile_overlap / 2
+        far = self.tile_size - half
+        center_y = sum(point[1] for point in box) / len(box)
+        center_x = sum(point[0] for point in box) / len(box)
+        return ((top == 0 or center_y >= half) and (top + self.tile_size >= shape[0] or center_y < far)
+                and (left == 0 or center_x >= half) and (left + self.tile_size >= shape[1] or center_x < far))
+
+    def _pad(self, tile: np.ndarray) -> np.ndarray:
+        height, width = tile.shape[:2]
+        padded_height = -(-height // self.bucket) * self.bucket
+        padded_width = -(-width // self.bucket) * self.bucket
+        if (padded_height, padded_width) == (height, width):
+            return tile
+        return cv2.copyMakeBorder(tile, 0, padded_height - height, 0, padded_width - width, cv2.BORDER_CONSTANT,
+                                  value=255)
+
+    def recognize(self, images: List[np.ndarray]) -> List[str]:
+        """Recognize the text of several grayscale images.
+
+        Args:
+            images (List[np.ndarray]): Grayscale images.
+
+        Returns:
+            List[str]: Recognized text of each image, words joined by spaces.
+        """
+        if not images:
+            return []
+        tiles: List[Tuple[int, int, int, np.ndarray]] = []
+        shapes = []
+        for position, image in enumerate(images):
+            image = self.normalize(image)
+            shapes.append(image.shape)
+            tiles.extend((position, top, left, self._pad(tile)) for top, left, tile in self.tiles(image))
+        groups = {}
+        for tile_position, (_, _, _, tile) in enumerate(tiles):
+            groups.setdefault(tile.shape, []).append(tile_position)
+        results = [None] * len(tiles)
+        reader = self.reader
+        for positions in groups.values():
+            for offset in range(0, len(positions), self.batch_size):
+                batch = positions[offset:offset + self.batch_size]
+                if len(batch) == 1:
+                    outputs = [reader.readtext(tiles[batch[0]][3], workers=self.workers)]
+                else:
+                    outputs = reader.readtext_batched([tiles[p][3] for p in batch], batch_size=len(batch),
+                                                      workers=self.workers)
+                for tile_position, output in zip(batch, outputs):
+                    results[tile_position] = output
+        texts = [[] for _ in images]
+        for (position, top, left, _), output in zip(tiles, results):
+            texts[position].extend(text for box, text, _ in output if self._owns(top, left, shapes[position], box))
+        logger.debug(f"OCR recognized {len(images)} images in {len(tiles)} tiles and {len(groups)} shape groups")
+        return [" ".join(words) for words in texts]
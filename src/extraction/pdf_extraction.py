@@ -1,5 +1,61 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple, Union
 import fitz
+import numpy as np
+from services.model_registry import ModelRegistry, model_registry
+from utils.config import PDF_WORKERS, PDF_PARALLEL_MIN_PAGES, PDF_OCR_DPI, OCR_BATCH_SIZE
 from .extraction_strategy import ExtractionStrategy
+from .ocr_engine import OcrEngine
+
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def _get_page_pool(workers: int) -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _page_pool
+
+def _open(file_content: Union[bytes, str]) -> fitz.Document:
+    if isinstance(file_content, str):
+        return fitz.open(file_content, filetype="pdf")
+    return fitz.open(stream=file_content, filetype="pdf")
+
+def _extract_page_range(file_content: Union[bytes, str], start: int, end: int,
+                        dpi: int) -> List[Tuple[str, Optional[np.ndarray]]]:
+    """Extract the text layer of a page range, rasterizing pages that have none.
+
+    Runs in a page pool worker; PyMuPDF documents cannot be shared across processes.
+
+    Args:
+        file_content (Union[bytes, str]): Raw bytes of the PDF file, or its path.
+        start (int): First page number (0-based).
+        end (int): Page number after the last page.
+        dpi (int): Rasterization resolution for pages without a text layer.
+
+    Returns:
+        List[Tuple[str, Optional[np.ndarray]]]: Text of each page and, for pages
+            without text, a grayscale raster for OCR.
+    """
+    doc = _open(file_content)
+    try:
+        results = []
+        for number in range(start, end):
+            page = doc[number]
+            text = page.get_text()
+            raster = None
+            if not text.strip():
+                pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+                raster = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width).copy()
+            results.append((text, raster))
+        return results
+    finally:
+        doc.close()
 
 class PDFExtractionStrategy(ExtractionStrategy):
     """Strategy for extracting text from PDF files.
@@ -7,28 +63,124 @@ class PDFExtractionStrategy(ExtractionStrategy):
     This class implements the ExtractionStrategy interface to handle PDF files
     by using the PyMuPDF (fitz) library to extract text from all pages.
 
+    Long documents are split into page ranges that are extracted in parallel
+    processes, which open the file by path; raw bytes are spooled to a
+    temporary file first rather than pickled to every range. Inside a
+    process that already extracts files in parallel (an ingest worker),
+    use workers=1 to extract in-process. Pages without a text layer (scanned pages) are rasterized and
+    sent to the shared OCR engine in batches.
+
+    Attributes:
+        registry (ModelRegistry): Registry providing the shared OCR reader.
+        workers (int): Processes used for page-parallel extraction.
+        min_parallel_pages (int): Documents shorter than this are extracted serially.
+        ocr_dpi (int): Rasterization resolution of scanned pages.
+        ocr_batch_size (int): Scanned pages per OCR batch.
+        engine (OcrEngine): Batched OCR engine for scanned pages.
     """
-    def extract_text(self, file_content: bytes) -> str:
-        """Extract text from PDF bytes.
+    name = "pdf"
 
-        Opens the PDF from raw bytes and concatenates text from all pages.
+    def __init__(self, registry: ModelRegistry = model_registry, workers: int = PDF_WORKERS,
+                 min_parallel_pages: int = PDF_PARALLEL_MIN_PAGES, ocr_dpi: int = PDF_OCR_DPI,
+                 ocr_batch_size: int = OCR_BATCH_SIZE, engine: OcrEngine = None):
+        """Initialize PDFExtractionStrategy.
 
         Args:
-            file_content (bytes): Raw bytes of the PDF file.
+            registry (ModelRegistry): Registry providing the shared OCR reader.
+            workers (int): Processes used for page-parallel extraction.
+            min_parallel_pages (int): Documents shorter than this are extracted serially.
+            ocr_dpi (int): Rasterization resolution of scanned pages.
+            ocr_batch_size (int): Scanned pages per OCR batch.
+            engine (OcrEngine): Batched OCR engine. Defaults to one with ocr_batch_size.
+        """
+        self.registry = registry
+        self.workers = workers
+        self.min_parallel_pages = min_parallel_pages
+        self.ocr_dpi = ocr_dpi
+        self.ocr_batch_size = ocr_batch_size
+        self.engine = engine or OcrEngine(registry, batch_size=ocr_batch_size)
+
+    def extract_text(self, file_content: Union[bytes, str]) -> str:
+        """Extract text from a PDF.
+
+        Opens the PDF from raw bytes or a path and concatenates text from all pages.
+
+        Args:
+            file_content (Union[bytes, str]): Raw bytes of the PDF file, or its path.
 
         Returns:
             str: Extracted text from the PDF, or empty string if extraction fails.
 
+        Raises:
+            ValueError: If PDF processing fails, with a descriptive message.
+        """
+        return "".join(self.extract_pages(file_content))
+
+    def extract_pages(self, file_content: Union[bytes, str]) -> List[str]:
+        """Extract text from a PDF, one entry per page.
+
+        A path is opened directly, so PyMuPDF reads pages from disk as needed.
+        Scanned pages are OCRed; their text takes the place of the empty text layer.
+
+        Args:
+            file_content (Union[bytes, str]): Raw bytes of the PDF file, or its path.
+
+        Returns:
+            List[str]: Extracted text of each page, in order.
+
         Raises:
             ValueError: If PDF processing fails, with a descriptive message.
         """
         try:
-            doc = fitz.open(stream=file_content, filetype="pdf")
-            text = ""
-            for page in doc:
-                text += page.get_text()
+            doc = _open(file_content)
+            page_count = doc.page_count
             doc.close()
-            return text
+            if self.workers > 1 and page_count >= self.min_parallel_pages:
+                results = self._extract_parallel(file_content, page_count)
+            else:
+                results = _extract_page_range(file_content, 0, page_count, self.ocr_dpi)
+            pages = [text for text, _ in results]
+            scanned = [(number, raster) for number, (_, raster) in enumerate(results) if raster is not None]
+            for number, text in zip([number for number, _ in scanned], self._ocr([raster for _, raster in scanned])):
+                pages[number] = text
+            return pages
         except Exception as e:
             raise ValueError(f"PDF extraction failed: {str(e)}")
- 
\ No newline at end of file
+
+    def _extract_parallel(self, file_content: Union[bytes, str],
+                          page_count: int) -> List[Tuple[str, Optional[np.ndarray]]]:
+        """Extract page ranges in the page pool, handing each range the path of the PDF.
+
+        Args:
+            file_content (Union[bytes, str]): Raw bytes of the PDF file, or its path.
+            page_count (int): Number of pages of the document.
+
+        Returns:
+            List[Tuple[str, Optional[np.ndarray]]]: Text and optional raster of each page, in order.
+        """
+        spooled = None
+        if not isinstance(file_content, str):
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as handle:
+                handle.write(file_content)
+            spooled = file_content = handle.name
+        try:
+            step = -(-page_count // self.workers)
+            pool = _get_page_pool(self.workers)
+            futures = [pool.submit(_extract_page_range, file_content, start, min(start + step, page_count),
+                                   self.ocr_dpi)
+                       for start in range(0, page_count, step)]
+            return [result for future in futures for result in future.result()]
+        finally:
+            if spooled is not None:
+                os.remove(spooled)
+
+    def _ocr(self, rasters: List[np.ndarray]) -> List[str]:
+        """OCR page rasters in batches with the shared OCR engine.
+
+        Args:
+            rasters (List[np.ndarray]): Grayscale page rasters.
+
+        Returns:
+            List[str]: Recognized text of each raster.
+        """
+        return self.engine.recognize(rasters)
@@ -0,0 +1,164 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Set
+from services.collection_service import CollectionService
+from services.document_service import DocumentService, SUPPORTED_EXTENSIONS
+from services.ingest_worker import init_extraction_worker, extract_file
+from services.rag_service import RAGService, encode_documents
+from services.redis_service import RedisService
+from utils.config import DEFAULT_COLLECTION
+from utils.logger import setup_logging
+
+logger = setup_logging()
+
+class BulkIngestor:
+    """Offline bulk ingestion of a directory or manifest of documents.
+
+    Files are streamed to a pool of extraction processes. Extracted documents
+    are collected into batches; each batch is embedded with one encode call,
+    tagged with entities in one nlp.pipe pass,
+    written to Redis through pipelines and added to the index in one add.
+    Paths of committed batches are appended to a checkpoint file, so a
+    restarted run skips them.
+
+    Attributes:
+        document_service (DocumentService): Service storing processed batches.
+        rag_service (RAGService): Service holding the embedding model and index.
+        workers (int): Number of extraction processes.
+        batch_size (int): Documents per commit batch.
+        checkpoint_path (str): File listing paths that were already ingested.
+    """
+    def __init__(self, document_service: DocumentService, rag_service: RAGService, workers: int,
+                 batch_size: int, checkpoint_path: str):
+        """Initialize BulkIngestor.
+
+        Args:
+            document_service (DocumentService): Service storing processed batches.
+            rag_service (RAGService): Service holding the embedding model and index.
+            workers (int): Number of extraction processes.
+            batch_size (int): Documents per commit batch.
+            checkpoint_path (str): File listing paths that were already ingested.
+        """
+        self.document_service = document_service
+        self.rag_service = rag_service
+        self.workers = workers
+        self.batch_size = batch_size
+        self.checkpoint_path = checkpoint_path
+        self.ingested = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _load_checkpoint(self) -> Set[str]:
+        if not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    @staticmethod
+    def iter_paths(source: str) -> Iterator[str]:
+        """Yield supported file paths from a directory tree or a manifest file.
+
+        Args:
+            source (str): Directory to walk, or text file with one path per line.
+
+        Yields:
+            str: Path of each supported file.
+        """
+        if os.path.isdir(source):
+            for root, _, names in os.walk(source):
+                for name in sorted(names):
+                    if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            with open(source) as f:
+                for line in f:
+                    path = line.strip()
+                    if path and path.lower().endswith(SUPPORTED_EXTENSIONS):
+                        yield path
+
+    def run(self, source: str):
+        """Ingest every supported file from a source, resuming from the checkpoint.
+
+        Args:
+            source (str): Directory to walk, or text file with one path per line.
+        """
+        done = self._load_checkpoint()
+        started = time.monotonic()
+        batch = []
+        with open(self.checkpoint_path, "a") as checkpoint, \
+                ProcessPoolExecutor(max_workers=self.workers, initializer=init_extraction_worker,
+                                    mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending = set()
+            for path in self.iter_paths(source):
+                if path in done:
+                    self.skipped += 1
+                    continue
+                pending.add(executor.submit(extract_file, path))
+                if len(pending) >= self.workers * 4:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    batch.extend(self._collect(finished))
+                if len(batch) >= self.batch_size:
+                    self._commit(batch, checkpoint, started)
+                    batch = []
+            batch.extend(self._collect(pending))
+            self._commit(batch, checkpoint, started)
+        logger.info(f"Bulk ingest finished: {self.ingested} ingested, {self.skipped} skipped, {self.failed} failed")
+
+    def _collect(self, futures) -> List[dict]:
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Extraction failed: {str(e)}")
+        return results
+
+    def _commit(self, batch: List[dict], checkpoint, started: float):
+        if not batch:
+            return
+        fresh = {}
+        for item in batch:
+            if not self.rag_service.has_document(item["content_id"]):
+                fresh.setdefault(item["content_id"], item)
+        encoded = encode_documents(self.rag_service.model, [item["pages"] for item in fresh.values()],
+                                   self.rag_service.chunk_size, self.rag_service.chunk_overlap,
+                                   self.rag_service.batch_size)
+        entities = self.document_service.ner_service.annotate_documents([passages for passages, _ in encoded])
+        self.document_service.store_processed_batch([
+            (item["filename"], item["content_id"], item["pages"], passages, vectors, spans)
+            for item, (passages, vectors), spans in zip(fresh.values(), encoded, entities)])
+        if self.document_service.set_aliases({item["filename"]: item["content_id"] for item in batch}):
+            self.document_service.redis_service.bump_index_version()
+        checkpoint.writelines(item["path"] + "\n" for item in batch)
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+        self.ingested += len(batch)
+        elapsed = time.monotonic() - started
+        logger.info(f"Ingested {self.ingested} documents ({self.ingested / elapsed:.1f} docs/sec), "
+                    f"index size: {self.rag_service.ntotal}")
+
+def main():
+    """Parse command line arguments and run a bulk ingest."""
+    parser = argparse.ArgumentParser(description="Bulk ingest PDF and image documents.")
+    parser.add_argument("source", help="Directory to ingest, or manifest file with one path per line")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction processes")
+    parser.add_argument("--batch-size", type=int, default=256, help="Documents per commit batch")
+    parser.add_argument("--checkpoint", default="data/ingest.checkpoint", help="Checkpoint file for resuming")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="Collection to ingest into, created if needed")
+    args = parser.parse_args()
+
+    redis_service = RedisService()
+    collections = CollectionService(redis_service=redis_service, strategies={})
+    try:
+        collection = collections.get(args.collection, create=True)
+        BulkIngestor(collection.document_service, collection.rag_service, args.workers, args.batch_size,
+                     args.checkpoint).run(args.source)
+    finally:
+        collections.close()
+
+if __name__ == "__main__":
+    main()
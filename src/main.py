@@ -1,42 +1,64 @@
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status, Request
+import asyncio
+import json
+import math
+import time
+from typing import AsyncIterator, List, Optional
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from models.schema import Login, QuestionRequest
 from services.qa_service import QAService
-from services.document_service import DocumentService
-from services.rag_service import RAGService
+from services.collection_service import Collection, CollectionService, CollectionNotFoundError, CollectionLimitError
+from services.document_service import SUPPORTED_EXTENSIONS, build_strategies
+from services.executor import PriorityExecutor, OverloadedError, DeadlineExceededError
+from services.job_service import JobService, QueueFullError
+from services.model_registry import ModelRegistry, model_registry
 from services.redis_service import RedisService
 from utils.security import create_access_token, verify_token
+from utils.config import (MODEL_PRELOAD, MAX_FILE_BYTES, MAX_REQUEST_BYTES, PROFILING_ENABLED, PROFILE_INTERVAL_MS,
+                          INDEX_DIR, SPOOL_DIR, INFERENCE_WORKERS, ASK_DEADLINE_MS, DEFAULT_COLLECTION)
+from utils.metrics import metrics, observe_stage, stage_timer
+from utils.profiler import SamplingProfiler
 from utils.sanitizer import sanitize_input
+from utils.spool import spool_multipart, UploadTooLargeError
 
+UPLOAD_REQUEST_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["files"],
+    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}}}}}}
 
 class RouteHandler:
     """Handles routing configuration for the FastAPI application.
 
     Manages the definition and setup of API endpoints for authentication,
-    file upload, and question answering.
+    file upload, and question answering. Uploads, deletions and questions
+    name the collections they act on; the default collection is used otherwise.
 
     Attributes:
-        document_service (DocumentService): Service for document processing.
+        collection_service (CollectionService): Service for named collections.
         qa_service (QAService): Service for question answering.
+        job_service (JobService): Service for asynchronous ingestion jobs.
         api_server (APIServer): Reference to the API server instance.
         app (FastAPI): FastAPI application instance.
         oauth2_scheme (OAuth2PasswordBearer): OAuth2 scheme for token-based auth.
 
     """
-    def __init__(self, document_service: DocumentService, qa_service: QAService, api_server: "APIServer"):
+    def __init__(self, collection_service: CollectionService, qa_service: QAService, job_service: JobService,
+                 api_server: "APIServer"):
         """Initialize RouteHandler with required services and server.
 
         Args:
-            document_service (DocumentService): Document processing service.
+            collection_service (CollectionService): Named collections service.
             qa_service (QAService): Question answering service.
+            job_service (JobService): Ingestion job service.
             api_server (APIServer): API server instance.
         """
-        self.document_service = document_service
+        self.collection_service = collection_service
         self.qa_service = qa_service
+        self.job_service = job_service
         self.api_server = api_server
         self.app = api_server.app
         self.oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -56,9 +78,53 @@ class RouteHandler:
             HTTPException: If token verification fails.
         """
         return verify_token(token)
+
+    async def _resolve(self, names: List[str], create: bool = False) -> List[Collection]:
+        """Open and pin collections off the event loop; the caller passes them to CollectionService.unpin.
+
+        Args:
+            names (List[str]): Collection names.
+            create (bool): Whether to create collections that do not exist.
+
+        Returns:
+            List[Collection]: Collection of each name, in order.
+
+        Raises:
+            HTTPException: 400 for an invalid name, 404 for an unknown collection, 409 if
+                creating a collection would exceed the collection limit.
+        """
+        try:
+            return await run_in_threadpool(self.collection_service.resolve, names, create, True)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except CollectionNotFoundError as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+        except CollectionLimitError as e:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     
+    async def _stream_results(self, job_ids: List[str], include_text: bool,
+                              max_text_chars: Optional[int]) -> AsyncIterator[str]:
+        """Yield one NDJSON line per job, in the order the jobs finish.
+
+        Args:
+            job_ids (List[str]): Jobs of one upload request.
+            include_text (bool): Whether to add the extracted text to each line.
+            max_text_chars (Optional[int]): Truncate the extracted text to this many characters.
+
+        Yields:
+            str: JSON-encoded job status followed by a newline.
+        """
+        for finished in asyncio.as_completed([asyncio.wrap_future(self.job_service.wait(job_id))
+                                              for job_id in job_ids]):
+            job = self.job_service.get(await finished)
+            if include_text and job["status"] == "done":
+                collection = self.job_service.collection(job["job_id"])
+                text = await collection.redis_service.aget_document(job["content_id"])
+                job["extracted_text"] = text[:max_text_chars] if max_text_chars is not None else text
+            yield json.dumps(job) + "\n"
+
     def configure_routes(self) -> None:
-        """Configure FastAPI routes for login, upload files and qa"""
+        """Configure routes for login, readiness, metrics, uploads, jobs, documents, collections, qa and stats"""
 
         @self.app.post("/token")
         async def login(request: Login):
@@ -68,55 +134,331 @@ class RouteHandler:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, 
                                 detail="Invalid credentials")
 
-        @self.app.post("/upload")
+        @self.app.get("/ready")
+        async def ready():
+            registry = self.api_server.registry
+            sync_errors = self.collection_service.sync_errors()
+            ready = registry.is_ready(self.api_server.required_models) and not sync_errors
+            body = {"ready": ready, "models": registry.status(), "index_sync_errors": sync_errors}
+            if not ready:
+                return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+            return body
+
+        @self.app.get("/metrics")
+        async def export_metrics():
+            return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+        @self.app.post("/upload", status_code=status.HTTP_202_ACCEPTED, openapi_extra=UPLOAD_REQUEST_BODY)
         @self.api_server.limiter.limit("5/minute")
-        async def upload_files(request: Request, files: List[UploadFile] = File(...), token: str = Depends(self.oauth2_scheme)):
+        async def upload_files(request: Request, stream: bool = False, include_text: bool = False,
+                               max_text_chars: Optional[int] = None, collection: str = DEFAULT_COLLECTION,
+                               token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            target = (await self._resolve([collection], create=True))[0]
+            try:
+                try:
+                    with stage_timer("upload_read"):
+                        spooled = await spool_multipart(request, "files", self.job_service.spool_dir, MAX_FILE_BYTES,
+                                                        MAX_REQUEST_BYTES, SUPPORTED_EXTENSIONS)
+                except UploadTooLargeError as e:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+                except ValueError as e:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+                if not spooled:
+                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No files uploaded")
+                try:
+                    jobs = await run_in_threadpool(self.job_service.submit_many, spooled, target)
+                except QueueFullError as e:
+                    raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                                        headers={"Retry-After": "5"})
+            finally:
+                self.collection_service.unpin([target])
+            if not stream:
+                return {"jobs": [self.job_service.get(job_id) for job_id in jobs]}
+            return StreamingResponse(self._stream_results(jobs, include_text, max_text_chars),
+                                     media_type="application/x-ndjson")
+
+        @self.app.get("/jobs/{job_id}")
+        async def job_status(job_id: str, token: str = Depends(self.oauth2_scheme)):
             verify_token(token)
-            results = []
-            for file in files:
-                if file.filename is None:
-                    continue
-                elif not file.filename.lower().endswith((".pdf", ".jpg", ".jpeg", ".png")):
-                    raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
-                                        detail="Unsupported file type")
-                content = await file.read()
-                result = self.document_service.process_document(file.filename, content)
-                results.append({"filename": file.filename, "extracted_text": result})
-            return {"results": results}
+            job = self.job_service.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+            return job
+
+        @self.app.get("/jobs/{job_id}/result")
+        async def job_result(job_id: str, token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            job = self.job_service.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+            if job["status"] == "failed":
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=job["error"])
+            if job["status"] != "done":
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job['status']}")
+            collection = self.job_service.collection(job_id)
+            text = await collection.redis_service.aget_document(job["content_id"])
+            return {"collection": collection.name, "filename": job["filename"], "content_id": job["content_id"],
+                    "extracted_text": text}
+
+        @self.app.delete("/documents/{doc_id}")
+        async def delete_document(doc_id: str, collection: str = DEFAULT_COLLECTION,
+                                  token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            target = (await self._resolve([collection]))[0]
+            try:
+                result = await run_in_threadpool(self.job_service.delete, doc_id, target)
+            finally:
+                self.collection_service.unpin([target])
+            if result is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+            return result
+
+        @self.app.get("/collections")
+        async def list_collections(token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            return {"collections": await run_in_threadpool(self.collection_service.names)}
+
+        @self.app.delete("/collections/{name}")
+        async def drop_collection(name: str, token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            try:
+                dropped = await run_in_threadpool(self.collection_service.drop, name)
+            except ValueError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            if not dropped:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Collection not found")
+            return {"collection": name, "dropped": True}
 
         @self.app.post("/ask")
         @self.api_server.limiter.limit("10/minute")
-        async def ask_question(request: Request, request_body: QuestionRequest, token: str = Depends(self.oauth2_scheme)):
+        async def ask_question(request: Request, response: Response, request_body: QuestionRequest,
+                               token: str = Depends(self.oauth2_scheme)):
             verify_token(token)
             sanitized_question = sanitize_input(request_body.question)
-            answer, entities = self.qa_service.answer_question(sanitized_question)
-            return {"question": sanitized_question, "answer": answer, "entities": entities}
+            collections = await self._resolve(request_body.collections)
+            timeout = ASK_DEADLINE_MS / 1000
+            future = None
+            try:
+                future = self.qa_service.submit_question(sanitized_question, nprobe=request_body.nprobe,
+                                                         ef_search=request_body.ef_search, top_k=request_body.top_k,
+                                                         max_answers=request_body.max_answers,
+                                                         early_exit_threshold=request_body.early_exit_threshold,
+                                                         mode=request_body.mode, labels=request_body.entity_labels,
+                                                         deadline=time.monotonic() + timeout,
+                                                         collections=collections)
+            except OverloadedError as e:
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e),
+                                    headers={"Retry-After": str(math.ceil(e.retry_after))})
+            finally:
+                if future is None:
+                    self.collection_service.unpin(collections)
+            future.add_done_callback(lambda _: self.collection_service.unpin(collections))
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+            except (asyncio.TimeoutError, DeadlineExceededError):
+                future.cancel()
+                retry_after = math.ceil(self.qa_service.batcher.retry_after())
+                raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                    detail="Question could not be answered within the deadline",
+                                    headers={"Retry-After": str(retry_after)})
+            observe_stage("ask_queue", future.queue_wait)
+            observe_stage("ask_compute", future.compute)
+            response.headers["Server-Timing"] = (f"queue;dur={future.queue_wait * 1000:.1f}, "
+                                                 f"compute;dur={future.compute * 1000:.1f}")
+            return {"question": sanitized_question, **result}
+
+        @self.app.get("/index/stats")
+        async def index_stats(collection: str = DEFAULT_COLLECTION, token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            target = (await self._resolve([collection]))[0]
+            try:
+                return {"collection": target.name, **target.rag_service.index_stats()}
+            finally:
+                self.collection_service.unpin([target])
+
+        @self.app.get("/cache/stats")
+        async def cache_stats(token: str = Depends(self.oauth2_scheme)):
+            verify_token(token)
+            return self.qa_service.answer_cache.stats()
+
+class UploadLimitMiddleware:
+    """ASGI middleware that caps the body size of requests to one path.
+
+    A malformed or too large Content-Length is rejected before the body is
+    read. The body is counted as it is received as well, so a chunked
+    request without Content-Length, or one sending more than it declared,
+    fails with 413 at the first chunk over the limit instead of being
+    buffered in full.
+
+    Attributes:
+        app (ASGIApp): Wrapped application.
+        path (str): Request path the limit applies to.
+        max_bytes (int): Largest accepted body in bytes.
+    """
+    def __init__(self, app, path: str, max_bytes: int):
+        """Initialize UploadLimitMiddleware.
+
+        Args:
+            app (ASGIApp): Wrapped application.
+            path (str): Request path the limit applies to.
+            max_bytes (int): Largest accepted body in bytes.
+        """
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+        too_large = f"Request exceeds the limit of {self.max_bytes} bytes"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None:
+            try:
+                declared = int(content_length)
+            except ValueError:
+                declared = -1
+            if declared < 0:
+                response = JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
+                                        content={"detail": "Invalid Content-Length header"})
+                return await response(scope, receive, send)
+            if declared > self.max_bytes:
+                response = JSONResponse(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        content={"detail": too_large})
+                return await response(scope, receive, send)
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=too_large)
+            return message
+
+        await self.app(scope, receive_limited, send)
 
 class APIServer:
     """Main server class for setting up the FastAPI application.
 
-    Configures services, routes, and rate limiting for the API.
+    Configures services, routes, and rate limiting for the API. Models are
+    not loaded while the app is constructed; depending on preload they are
+    loaded in the background at startup, before startup completes, or on
+    first use. /ready reports 503 until the models /ask needs are loaded, and
+    while an open collection's index cannot sync with the change stream.
 
     Attributes:
         app (FastAPI): FastAPI application instance.
         limiter (Limiter): Rate limiter instance.
+        registry (ModelRegistry): Shared model registry of this process.
+        required_models (tuple): Models that must be loaded before the server is ready.
         redis_service (RedisService): Redis connection service.
-        rag_service (RAGService): Retrieval-Augmented Generation service.
-        document_service (DocumentService): Document processing service.
+        collection_service (CollectionService): Named collections, each with its own index.
         qa_service (QAService): Question answering service.
+        job_service (JobService): Asynchronous ingestion job service.
+        executor (PriorityExecutor): Threads running /ask batches ahead of ingestion commits.
         route_handler (RouteHandler): Route configuration handler.
 
     """
-    def __init__(self):
-        """Initialize APIServer with all required services and configurations."""
+    required_models = ("embedder", "qa", "ner")
+
+    def __init__(self, registry: ModelRegistry = model_registry, preload: str = MODEL_PRELOAD,
+                 redis_service: Optional[RedisService] = None, index_dir: str = INDEX_DIR, spool_dir: str = SPOOL_DIR):
+        """Initialize APIServer with all required services and configurations.
+
+        Args:
+            registry (ModelRegistry): Model registry shared by all services.
+            preload (str): 'background' to load models in parallel after startup,
+                'eager' to load them before startup completes, 'lazy' to load on first use.
+            redis_service (Optional[RedisService]): Redis service to use; defaults to one
+                connected to REDIS_HOST.
+            index_dir (str): Root directory for the index snapshots of all collections, shared by
+                all workers and replicas.
+            spool_dir (str): Directory for spooled upload content.
+        """
         self.app = FastAPI()
         self.limiter = Limiter(key_func=get_remote_address)
-        self.redis_service = RedisService()
-        self.rag_service = RAGService(redis_service=self.redis_service)
-        self.document_service = DocumentService(redis_service=self.redis_service, rag_service=self.rag_service)
-        self.qa_service = QAService(rag_service=self.rag_service)
-        self.route_handler = RouteHandler(self.document_service, self.qa_service, self)
+        self.registry = registry
+        self.redis_service = redis_service if redis_service is not None else RedisService()
+        self.collection_service = CollectionService(redis_service=self.redis_service, index_dir=index_dir,
+                                                    registry=registry, strategies=build_strategies(registry))
+        self.executor = PriorityExecutor(INFERENCE_WORKERS, name="inference")
+        self.qa_service = QAService(collections=self.collection_service, registry=registry, executor=self.executor)
+        self.job_service = JobService(collections=self.collection_service, spool_dir=spool_dir,
+                                      executor=self.executor)
+        self.route_handler = RouteHandler(self.collection_service, self.qa_service, self.job_service, self)
         self._setup_limiter()
+        self._setup_upload_limit()
+        self._setup_metrics()
+        if PROFILING_ENABLED:
+            self._setup_profiler()
+        if preload != "lazy":
+            self.app.add_event_handler("startup", lambda: registry.preload(self.required_models,
+                                                                           background=preload == "background"))
+        self.app.add_event_handler("shutdown", self.job_service.close)
+        self.app.add_event_handler("shutdown", self.executor.shutdown)
+        self.app.add_event_handler("shutdown", self.collection_service.close)
+        self.app.add_event_handler("shutdown", self.redis_service.aclose)
+        self.app.add_event_handler("shutdown", self.redis_service.close)
+
+    def _setup_upload_limit(self):
+        """Cap the body size of uploads, declared or not, at MAX_REQUEST_BYTES."""
+        self.app.add_middleware(UploadLimitMiddleware, path="/upload", max_bytes=MAX_REQUEST_BYTES)
+
+    def _setup_metrics(self):
+        """Time every request and register the gauges read at scrape time."""
+        requests = metrics.histogram("dis_request_duration_seconds", "Duration of HTTP requests in seconds.")
+
+        @self.app.middleware("http")
+        async def time_request(request: Request, call_next):
+            started = time.perf_counter()
+            response = await call_next(request)
+            route = request.scope.get("route")
+            requests.observe(time.perf_counter() - started, method=request.method,
+                             path=route.path if route is not None else "unmatched", status=response.status_code)
+            return response
+
+        def per_collection(value):
+            return lambda: {(("collection", collection.name),): value(collection.rag_service)
+                            for collection in self.collection_service.opened()}
+
+        metrics.gauge("dis_index_vectors", "Vectors in the FAISS index of each open collection.",
+                      per_collection(lambda rag: rag.ntotal))
+        metrics.gauge("dis_index_tombstones", "Removed passages whose vectors await compaction.",
+                      per_collection(lambda rag: rag.index_stats()["tombstones"]))
+        metrics.gauge("dis_index_estimated_bytes", "Estimated memory used by the FAISS index.",
+                      per_collection(lambda rag: rag.index_stats()["estimated_bytes"]))
+        metrics.gauge("dis_lexical_passages", "Passages in the BM25 index.",
+                      per_collection(lambda rag: rag.lexical.size))
+        metrics.gauge("dis_ingest_queue_depth", "Ingestion jobs queued or running.", self.job_service.pending)
+        metrics.gauge("dis_qa_queue_depth", "Questions waiting for the QA batcher.",
+                      self.qa_service.batcher.pending)
+        metrics.gauge("dis_inference_busy_workers", "Inference threads running a batch or commit.",
+                      self.executor.busy)
+        metrics.gauge("dis_inference_queue_depth", "Batches and commits waiting for an inference thread.",
+                      self.executor.queued)
+        answer_cache = self.qa_service.answer_cache
+        metrics.gauge("dis_answer_cache_hit_ratio", "Share of answer cache lookups that hit either tier.",
+                      lambda: answer_cache.stats()["hit_rate"])
+
+    def _setup_profiler(self):
+        """Profile requests that carry an 'X-Profile: 1' header.
+
+        The response body is replaced by the folded stacks of all threads
+        sampled while the request ran, including the QA batcher and the
+        threadpool; the original status is returned in 'X-Profile-Status'.
+        """
+        @self.app.middleware("http")
+        async def profile_request(request: Request, call_next):
+            if request.headers.get("x-profile", "").lower() not in ("1", "true", "yes"):
+                return await call_next(request)
+            with SamplingProfiler(PROFILE_INTERVAL_MS / 1000) as profiler:
+                response = await call_next(request)
+                async for _ in response.body_iterator:
+                    pass
+            return PlainTextResponse(profiler.folded(), headers={"X-Profile-Status": str(response.status_code),
+                                                                 "X-Profile-Samples": str(profiler.samples)})
 
     def _setup_limiter(self):
         """Set up limiter and exception handler for rate limiting."""
@@ -0,0 +1,95 @@
+import argparse
+import os
+from services.collection_service import CollectionService
+from services.index_store import SNAPSHOT_FILE_RE
+from services.redis_service import RedisService
+from utils.config import DEFAULT_COLLECTION, INDEX_DIR
+from utils.logger import setup_logging
+
+logger = setup_logging()
+
+LEGACY_KEY_PATTERNS = ("doc:*", "entities:*", "alias:*", "filenames:*", "cache:*", "index:*")
+LEGACY_FILES = ("CURRENT",)
+
+def migrate_keys(redis_service: RedisService, prefix: str, batch_size: int = 500) -> int:
+    """Move the unprefixed keys of the pre-collection layout under a collection's key prefix.
+
+    Keys are renamed with RENAMENX, so a key already present under the
+    prefix is never overwritten; such keys are left in place and logged.
+
+    Args:
+        redis_service (RedisService): Unprefixed Redis service.
+        prefix (str): Key prefix of the collection generation to move the keys into.
+        batch_size (int): Keys scanned and renamed per round trip.
+
+    Returns:
+        int: Number of keys moved.
+    """
+    client = redis_service.client
+    moved = 0
+    for pattern in LEGACY_KEY_PATTERNS:
+        keys = list(client.scan_iter(match=pattern, count=batch_size))
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            pipe = client.pipeline(transaction=False)
+            for key in batch:
+                pipe.renamenx(key, prefix.encode() + key)
+            for key, renamed in zip(batch, pipe.execute()):
+                if renamed:
+                    moved += 1
+                else:
+                    logger.warning(f"Skipped {key.decode()}: {prefix}{key.decode()} already exists")
+    return moved
+
+def migrate_snapshots(index_dir: str, directory: str) -> int:
+    """Move the snapshot files of the pre-collection layout into a collection's index directory.
+
+    Args:
+        index_dir (str): Root directory of the index snapshots.
+        directory (str): Index directory of the collection generation.
+
+    Returns:
+        int: Number of files and segment directories moved.
+
+    Raises:
+        RuntimeError: If the collection directory already holds a snapshot.
+    """
+    names = [name for name in os.listdir(index_dir) if SNAPSHOT_FILE_RE.fullmatch(name) or name in LEGACY_FILES]
+    if not names:
+        return 0
+    if os.path.exists(os.path.join(directory, "CURRENT")):
+        raise RuntimeError(f"{directory} already holds a snapshot; not moving the one in {index_dir}")
+    os.makedirs(directory, exist_ok=True)
+    for name in names:
+        os.replace(os.path.join(index_dir, name), os.path.join(directory, name))
+    return len(names)
+
+def main():
+    """Move documents indexed before collections existed into the default collection.
+
+    Run once, with every worker stopped, when upgrading a deployment that
+    stored documents under the unprefixed keys and in DIS_INDEX_DIR itself.
+    """
+    parser = argparse.ArgumentParser(description="Move pre-collection data into the default collection.")
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="Collection to move the data into")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="Root directory of the index snapshots")
+    args = parser.parse_args()
+
+    redis_service = RedisService()
+    collections = CollectionService(redis_service=redis_service, index_dir=args.index_dir,
+                                    default=args.collection, strategies={}, sync_block_ms=0)
+    try:
+        generation = redis_service.client.hget(collections.names_key, args.collection)
+        if generation is None:
+            parser.error(f"Collection {args.collection} was dropped; there is nothing to move the data into")
+        generation = int(generation)
+        prefix = collections.prefix(args.collection, generation)
+        files = migrate_snapshots(args.index_dir, collections.directory(args.collection, generation))
+        keys = migrate_keys(redis_service, prefix)
+        logger.info(f"Moved {keys} keys and {files} snapshot files into collection {args.collection} "
+                    f"(generation {generation})")
+    finally:
+        collections.close()
+
+if __name__ == "__main__":
+    main()
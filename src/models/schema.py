@@ -1,8 +1,19 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from utils.config import QA_TOP_K, QA_MAX_ANSWERS, DEFAULT_COLLECTION, ASK_MAX_COLLECTIONS
 
 class Login(BaseModel):
     username: str
     password: str
 
 class QuestionRequest(BaseModel):
-    question: str
\ No newline at end of file
+    question: str
+    nprobe: Optional[int] = Field(default=None, ge=1)
+    ef_search: Optional[int] = Field(default=None, ge=1)
+    top_k: int = Field(default=QA_TOP_K, ge=1, le=50)
+    max_answers: int = Field(default=QA_MAX_ANSWERS, ge=1, le=20)
+    early_exit_threshold: Optional[float] = Field(default=None, gt=0, le=1)
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+    entity_labels: Optional[List[str]] = None
+    collections: List[str] = Field(default_factory=lambda: [DEFAULT_COLLECTION], min_length=1,
+                                   max_length=ASK_MAX_COLLECTIONS)
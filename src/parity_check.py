@@ -0,0 +1,23 @@
+import argparse
+import json
+import sys
+from services.inference_backend import BACKENDS, check_parity
+
+def main():
+    """Compare an inference backend against fp32 PyTorch and fail if quality drops."""
+    parser = argparse.ArgumentParser(description="Check embedding and QA parity of an inference backend.")
+    parser.add_argument("--embed-backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--qa-backend", choices=BACKENDS, default="int8")
+    parser.add_argument("--min-cosine", type=float, default=0.99,
+                        help="Lowest acceptable cosine similarity to fp32 embeddings")
+    parser.add_argument("--min-f1", type=float, default=0.9, help="Lowest acceptable mean answer F1 against fp32")
+    args = parser.parse_args()
+
+    report = check_parity(args.embed_backend, args.qa_backend)
+    passed = report["embedding"]["min_cosine"] >= args.min_cosine and report["qa"]["mean_f1"] >= args.min_f1
+    report["passed"] = passed
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if passed else 1)
+
+if __name__ == "__main__":
+    main()
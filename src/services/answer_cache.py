@@ -0,0 +1,141 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from utils.config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL
+from utils.metrics import metrics, stage_timer
+from .redis_service import RedisService
+
+class AnswerCache:
+    """Two-tier cache of answers keyed by question and index version.
+
+    The first tier is an in-process LRU, the second a Redis key per answer
+    with a TTL, shared by all workers. Keys include the index version that
+    DocumentService bumps on every ingest, for each collection the question
+    searched, so answers computed against an older corpus are never returned.
+
+    Attributes:
+        redis_service (RedisService): Redis connection service for the shared tier.
+        max_entries (int): Capacity of the in-process LRU; 0 disables it.
+        ttl (int): Seconds answers live in Redis; 0 disables the shared tier.
+        local_hits (int): Lookups answered by the in-process LRU.
+        redis_hits (int): Lookups answered by Redis.
+        misses (int): Lookups answered by neither tier.
+    """
+    def __init__(self, redis_service: RedisService, max_entries: int = ANSWER_CACHE_SIZE,
+                 ttl: int = ANSWER_CACHE_TTL):
+        """Initialize AnswerCache.
+
+        Args:
+            redis_service (RedisService): Redis connection service.
+            max_entries (int): Capacity of the in-process LRU; 0 disables it.
+            ttl (int): Seconds answers live in Redis; 0 disables the shared tier.
+        """
+        self.redis_service = redis_service
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question: str, version, *params) -> str:
+        """Build the cache key of a question.
+
+        The question is lowercased, whitespace is collapsed and trailing
+        punctuation is dropped, so trivial variations share an entry.
+
+        Args:
+            question (str): Sanitized question.
+            version: Current index version, or a JSON-serializable list of the
+                versions of every collection the question searches.
+            *params: Request parameters that change the answer (e.g. nprobe).
+
+        Returns:
+            str: Cache key.
+        """
+        normalized = re.sub(r"\s+", " ", question.lower()).strip().rstrip("?.! ")
+        digest = hashlib.sha1(json.dumps([normalized, version, *params]).encode()).hexdigest()
+        return f"answer:{digest}"
+
+    def get_many(self, keys: List[str]) -> List[Optional[dict]]:
+        """Look up several answers, fetching local misses from Redis with one MGET.
+
+        Args:
+            keys (List[str]): Keys from key().
+
+        Returns:
+            List[Optional[dict]]: Cached value for each key, or None on a miss.
+        """
+        lookups = metrics.counter("dis_answer_cache_lookups_total", "Answer cache lookups by result.")
+        values = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for position, key in enumerate(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    values[position] = self._entries[key]
+                    self.local_hits += 1
+                else:
+                    missing.append(position)
+        if missing and self.ttl:
+            with stage_timer("redis_get"):
+                raw_values = self.redis_service.client.mget([keys[position] for position in missing])
+            for position, raw in zip(missing, raw_values):
+                if raw is not None:
+                    values[position] = json.loads(raw)
+                    self._remember(keys[position], values[position])
+        redis_hits = sum(1 for position in missing if values[position] is not None)
+        with self._lock:
+            self.misses += len(missing) - redis_hits
+            self.redis_hits += redis_hits
+        lookups.inc(len(keys) - len(missing), result="local_hit")
+        lookups.inc(redis_hits, result="redis_hit")
+        lookups.inc(len(missing) - redis_hits, result="miss")
+        return values
+
+    def set_many(self, entries: dict):
+        """Store several answers in both tiers.
+
+        Args:
+            entries (dict): JSON-serializable values keyed by key().
+        """
+        if not entries:
+            return
+        for key, value in entries.items():
+            self._remember(key, value)
+        if self.ttl:
+            pipe = self.redis_service.client.pipeline(transaction=False)
+            for key, value in entries.items():
+                pipe.set(key, json.dumps(value), ex=self.ttl)
+            with stage_timer("redis_set"):
+                pipe.execute()
+
+    def _remember(self, key: str, value: dict):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Report hit and miss counters.
+
+        Returns:
+            dict: 'local_hits', 'redis_hits', 'misses', 'hit_rate' and 'size'.
+        """
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+                "size": len(self._entries)
+            }
@@ -0,0 +1,158 @@
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional
+from utils.logger import setup_logging
+from .executor import (PriorityExecutor, TimedFuture, OverloadedError, DeadlineExceededError,
+                       PRIORITY_INTERACTIVE)
+
+logger = setup_logging()
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a single worker thread.
+
+    The worker takes the first waiting item, then keeps collecting until
+    max_batch_size items are gathered or max_wait_ms has passed since the
+    first one, calls batch_fn once with all of them and resolves each
+    caller's future with its own result.
+
+    With an executor, batches run on its threads at the given priority and
+    up to concurrency batches run at once; while all are busy, new items
+    wait and join the next batch. With max_pending, submit rejects items
+    once that many are waiting. Items whose deadline passed before their
+    batch started fail with DeadlineExceededError instead of running.
+
+    Attributes:
+        batch_fn (Callable[[List[Any]], List[Any]]): Processes a batch, returning one result per item.
+        max_batch_size (int): Largest batch passed to batch_fn.
+        max_wait (float): Seconds to wait for more items after the first one.
+        max_pending (int): Waiting items at which submit rejects new ones; 0 for no limit.
+        executor (Optional[PriorityExecutor]): Runs the batches; None runs them on the batcher thread.
+        priority (int): Priority of the batches on the executor.
+        concurrency (int): Batches running at once on the executor.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int, max_wait_ms: float,
+                 name: str = "micro-batcher", max_pending: int = 0, executor: Optional[PriorityExecutor] = None,
+                 priority: int = PRIORITY_INTERACTIVE, concurrency: int = 1):
+        """Initialize MicroBatcher and start its worker thread.
+
+        Args:
+            batch_fn (Callable[[List[Any]], List[Any]]): Batch processing function.
+            max_batch_size (int): Largest batch passed to batch_fn.
+            max_wait_ms (float): Milliseconds to wait for more items after the first one.
+            name (str): Worker thread name.
+            max_pending (int): Waiting items at which submit rejects new ones; 0 for no limit.
+            executor (Optional[PriorityExecutor]): Runs the batches; None runs them on the batcher thread.
+            priority (int): Priority of the batches on the executor.
+            concurrency (int): Batches running at once on the executor.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.executor = executor
+        self.priority = priority
+        self.concurrency = max(1, concurrency)
+        self._slots = threading.Semaphore(self.concurrency)
+        self._batch_seconds = 0.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any, deadline: Optional[float] = None) -> TimedFuture:
+        """Queue an item for the next batch.
+
+        Args:
+            item (Any): Input for batch_fn.
+            deadline (Optional[float]): time.monotonic() after which the item is not started.
+
+        Returns:
+            TimedFuture: Resolves to the result for this item, with its queue wait and batch compute time.
+
+        Raises:
+            OverloadedError: If max_pending items are already waiting.
+        """
+        if self.max_pending and self._queue.qsize() >= self.max_pending:
+            raise OverloadedError("Too many requests waiting", self.retry_after())
+        future = TimedFuture()
+        self._queue.put((item, future, deadline))
+        return future
+
+    def pending(self) -> int:
+        """Count items waiting for a batch.
+
+        Returns:
+            int: Approximate number of queued items.
+        """
+        return self._queue.qsize()
+
+    def retry_after(self) -> float:
+        """Estimate the seconds until the waiting items are processed.
+
+        Returns:
+            float: Waiting batches times the recent batch duration, divided by concurrency; at least 1.
+        """
+        batches = math.ceil(self._queue.qsize() / self.max_batch_size)
+        return max(1.0, batches * self._batch_seconds / self.concurrency)
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            self._slots.acquire()
+            batch = self._collect()
+            if self.executor is None:
+                self._process(batch)
+                self._slots.release()
+                continue
+            try:
+                self.executor.submit(self._process, batch, priority=self.priority).add_done_callback(
+                    lambda done, batch=batch: self._finished(batch, done))
+            except Exception as e:
+                self._slots.release()
+                for _, future, _ in batch:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(e)
+
+    def _finished(self, batch: list, done: TimedFuture):
+        self._slots.release()
+        if done.cancelled():
+            for _, future, _ in batch:
+                future.cancel()
+
+    def _process(self, batch: list):
+        started = time.monotonic()
+        runnable = []
+        for item, future, deadline in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            future.queue_wait = started - future.submitted
+            if deadline is not None and started > deadline:
+                future.set_exception(DeadlineExceededError("Deadline passed before the batch started"))
+            else:
+                runnable.append((item, future))
+        if not runnable:
+            return
+        try:
+            results = self.batch_fn([item for item, _ in runnable])
+            elapsed = time.monotonic() - started
+            self._batch_seconds = elapsed if not self._batch_seconds else 0.8 * self._batch_seconds + 0.2 * elapsed
+            for (_, future), result in zip(runnable, results):
+                future.compute = elapsed
+                future.set_result(result)
+        except Exception as e:
+            logger.error(f"Batch of {len(runnable)} failed: {str(e)}")
+            for _, future in runnable:
+                future.set_exception(e)
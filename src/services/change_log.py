@@ -0,0 +1,206 @@
+import json
+import time
+import uuid
+from typing import List, Optional, Tuple
+import numpy as np
+import redis
+from utils.config import INDEX_LEADER_LEASE_MS
+from utils.logger import setup_logging
+from .redis_service import RedisService
+
+logger = setup_logging()
+
+def stream_position(entry_id: str) -> Tuple[int, int]:
+    """Turn a Redis stream id into a tuple that orders like the stream.
+
+    Args:
+        entry_id (str): Stream id such as '1700000000000-3'.
+
+    Returns:
+        Tuple[int, int]: Millisecond time and sequence number.
+    """
+    milliseconds, _, sequence = entry_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+class ChangeLog:
+    """Redis stream of index changes shared by all workers and replicas.
+
+    Every change to the index is an entry of the stream 'index:changes': an
+    'add' with the passage metadata, passage texts and float32 vectors of one
+    or more documents, or a 'remove' of a document id. Entry ids are the
+    version cursor of a replica: a replica that applied every entry up to a
+    cursor, in stream order, holds the same passages as any other replica at
+    that cursor, because vector ids are assigned in apply order.
+
+    One process at a time holds the leader lease 'index:leader'. The leader
+    writes snapshots, publishes the newest one under 'index:snapshot' and
+    trims the entries it covers from the stream. The pointer only names the
+    snapshot; its files are in the index directory all replicas share, so
+    Redis never holds index data beyond the untrimmed entries.
+
+    All keys carry the key prefix of the Redis service, so each
+    collection has its own stream, lease and snapshot pointer.
+
+    Attributes:
+        redis_service (RedisService): Redis connection service.
+        key (str): Stream key.
+        leader_key (str): Key of the leader lease.
+        snapshot_key (str): Key of the published snapshot.
+        lease_ms (int): Milliseconds a leader lease lasts without renewal.
+        token (str): Identifies this process as lease holder.
+    """
+    def __init__(self, redis_service: RedisService, key: str = "index:changes",
+                 lease_ms: int = INDEX_LEADER_LEASE_MS):
+        """Initialize ChangeLog.
+
+        Args:
+            redis_service (RedisService): Redis connection service.
+            key (str): Stream key, without the Redis service's prefix.
+            lease_ms (int): Milliseconds a leader lease lasts without renewal.
+        """
+        self.redis_service = redis_service
+        self.key = redis_service.key(key)
+        self.leader_key = redis_service.key("index:leader")
+        self.snapshot_key = redis_service.key("index:snapshot")
+        self.lease_ms = lease_ms
+        self.token = uuid.uuid4().hex
+        self._renewed = 0.0
+
+    @property
+    def client(self) -> redis.Redis:
+        """redis.Redis: Synchronous client of the Redis service."""
+        return self.redis_service.client
+
+    @property
+    def is_leader(self) -> bool:
+        """bool: True while the lease acquired or renewed by hold_leadership has not expired."""
+        return self._renewed > 0 and time.monotonic() - self._renewed < self.lease_ms / 1000
+
+    def append_add(self, meta: List[dict], texts: List[str], vectors: np.ndarray) -> str:
+        """Append added passages.
+
+        Args:
+            meta (List[dict]): Metadata of each passage, including its 'doc_id'.
+            texts (List[str]): Text of each passage, for the lexical index.
+            vectors (np.ndarray): float32 embeddings, one row per passage.
+
+        Returns:
+            str: Stream id of the entry.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        entry_id = self.client.xadd(self.key, {"op": "add", "meta": json.dumps(meta), "texts": json.dumps(texts),
+                                               "dim": vectors.shape[1], "vectors": vectors.tobytes()})
+        return entry_id.decode()
+
+    def append_remove(self, doc_id: str) -> str:
+        """Append the removal of a document.
+
+        Args:
+            doc_id (str): Document id (content hash).
+
+        Returns:
+            str: Stream id of the entry.
+        """
+        return self.client.xadd(self.key, {"op": "remove", "doc_id": doc_id}).decode()
+
+    @staticmethod
+    def _decode(fields: dict) -> dict:
+        if fields[b"op"] == b"remove":
+            return {"op": "remove", "doc_id": fields[b"doc_id"].decode()}
+        meta = json.loads(fields[b"meta"])
+        vectors = np.frombuffer(fields[b"vectors"], dtype=np.float32).reshape(len(meta), int(fields[b"dim"]))
+        return {"op": "add", "meta": meta, "texts": json.loads(fields[b"texts"]), "vectors": vectors}
+
+    def read(self, cursor: str, count: int = 64, block_ms: Optional[int] = None) -> Tuple[List[Tuple[str, dict]],
+                                                                                          Optional[dict]]:
+        """Read the entries after a cursor, and the snapshot published when they were read.
+
+        The snapshot is fetched after the entries, so if the leader trimmed
+        entries the cursor had not reached, the returned snapshot shows it.
+
+        Args:
+            cursor (str): Stream id of the last applied entry, '0-0' for none.
+            count (int): Maximum number of entries.
+            block_ms (Optional[int]): Wait up to this long for new entries; None returns at once.
+
+        Returns:
+            Tuple[List[Tuple[str, dict]], Optional[dict]]: Stream id and decoded change of
+                each entry, and the latest snapshot as in latest_snapshot.
+        """
+        if block_ms is None:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.xread({self.key: cursor}, count=count)
+            pipe.get(self.snapshot_key)
+            streams, raw_snapshot = pipe.execute()
+        else:
+            streams = self.client.xread({self.key: cursor}, count=count, block=block_ms)
+            raw_snapshot = self.client.get(self.snapshot_key)
+        entries = [(entry_id.decode(), self._decode(fields)) for _, items in streams or [] for entry_id, fields in items]
+        return entries, json.loads(raw_snapshot) if raw_snapshot else None
+
+    def latest_snapshot(self) -> Optional[dict]:
+        """Get the snapshot published by the leader.
+
+        Returns:
+            Optional[dict]: 'seq', 'cursor' and 'next_id' of the snapshot, or None if none was published.
+        """
+        raw = self.client.get(self.snapshot_key)
+        return json.loads(raw) if raw else None
+
+    def publish_snapshot(self, seq: int, cursor: str, next_id: int):
+        """Announce a new snapshot and trim the stream entries it covers.
+
+        Only the snapshot's sequence number is published: its manifest and
+        segments are in the index directory shared by all replicas.
+
+        Args:
+            seq (int): Sequence number of the snapshot manifest.
+            cursor (str): Stream id of the last entry the snapshot includes.
+            next_id (int): Vector id the first entry after the cursor starts at.
+        """
+        self.client.set(self.snapshot_key, json.dumps({"seq": seq, "cursor": cursor, "next_id": next_id}))
+        if cursor != "0-0":
+            self.client.xtrim(self.key, minid=cursor)
+
+    def hold_leadership(self) -> bool:
+        """Acquire or renew the leader lease.
+
+        Renewals are skipped while less than a third of the lease has passed.
+
+        Returns:
+            bool: True if this process holds the lease.
+        """
+        now = time.monotonic()
+        if now - self._renewed < self.lease_ms / 3000:
+            return True
+        if self.client.set(self.leader_key, self.token, nx=True, px=self.lease_ms):
+            self._renewed = now
+            logger.info("Acquired index leader lease")
+            return True
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.leader_key)
+                if pipe.get(self.leader_key) != self.token.encode():
+                    self._renewed = 0.0
+                    return False
+                pipe.multi()
+                pipe.pexpire(self.leader_key, self.lease_ms)
+                pipe.execute()
+            except redis.WatchError:
+                self._renewed = 0.0
+                return False
+        self._renewed = now
+        return True
+
+    def release_leadership(self):
+        """Give up the leader lease if this process holds it."""
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.leader_key)
+                if pipe.get(self.leader_key) == self.token.encode():
+                    pipe.multi()
+                    pipe.delete(self.leader_key)
+                    pipe.execute()
+            except redis.WatchError:
+                pass
+        self._renewed = 0.0
@@ -0,0 +1,575 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from utils.config import (INDEX_DIR, DEFAULT_COLLECTION, COLLECTION_SEARCH_WORKERS, RETRIEVAL_TOP_K, MAX_COLLECTIONS,
+                          MAX_OPEN_COLLECTIONS, COLLECTION_IDLE_SECONDS, INDEX_SYNC_BLOCK_MS)
+from utils.logger import setup_logging
+from .document_service import DocumentService
+from .model_registry import ModelRegistry, model_registry
+from .rag_service import RAGService
+from .redis_service import RedisService
+
+logger = setup_logging()
+
+COLLECTION_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,63}")
+# KEYS: names hash, generations hash. ARGV: name, max collections. Returns {generation, created}: the live
+# generation of the name, or a new one if the name is free and the limit allows it; {-1, 0} at the limit.
+CREATE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current then
+    return {tonumber(current), 0}
+end
+if redis.call('HLEN', KEYS[1]) >= tonumber(ARGV[2]) then
+    return {-1, 0}
+end
+local generation = redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+redis.call('HSET', KEYS[1], ARGV[1], generation)
+return {generation, 1}
+"""
+
+class CollectionNotFoundError(LookupError):
+    """Raised when a request names a collection that does not exist."""
+
+class CollectionLimitError(RuntimeError):
+    """Raised when creating a collection would exceed the maximum number of collections."""
+
+class Collection:
+    """Index, documents and Redis keys of one named collection.
+
+    Attributes:
+        name (str): Collection name.
+        generation (int): Incarnation of the name; a collection dropped and created
+            again gets a new generation, with new keys and a new index directory.
+        redis_service (RedisService): Redis service scoped to the collection's key prefix.
+        rag_service (RAGService): Index of the collection.
+        document_service (DocumentService): Stores documents into the collection.
+        last_used (float): time.monotonic() of the last lookup of the collection.
+        pins (int): Requests and jobs using the collection; a pinned collection is not closed.
+        closing (Optional[Tuple[bool, bool]]): Whether to snapshot and whether to purge the
+            collection once it is closed, or None while it stays open.
+    """
+    def __init__(self, name: str, generation: int, redis_service: RedisService, rag_service: RAGService,
+                 document_service: DocumentService):
+        """Initialize Collection.
+
+        Args:
+            name (str): Collection name.
+            generation (int): Incarnation of the name.
+            redis_service (RedisService): Redis service scoped to the collection's key prefix.
+            rag_service (RAGService): Index of the collection.
+            document_service (DocumentService): Stores documents into the collection.
+        """
+        self.name = name
+        self.generation = generation
+        self.redis_service = redis_service
+        self.rag_service = rag_service
+        self.document_service = document_service
+        self.last_used = time.monotonic()
+        self.pins = 0
+        self.closing = None
+
+class CollectionService:
+    """Named collections, each with its own index, index directory and Redis key prefix.
+
+    The Redis hash 'collections' maps the name of every live collection to
+    its generation. Generation g of a collection keeps its keys under
+    'col:<name>:<g>:' and its snapshots under '<index_dir>/collections/<name>/<g>'.
+    The default collection is registered at generation 0 and scoped the same
+    way; data indexed before collections existed is moved into it by
+    migrate_default_collection.py.
+
+    Dropping a collection deletes its field from the hash in one transaction,
+    which is O(1) however many documents it holds: no worker finds it on its
+    next lookup, and creating it again starts a new generation with fresh keys
+    and an empty directory. The old keys and snapshot files are deleted
+    afterwards on a background thread, once the collection is no longer
+    pinned in this process.
+
+    At most max_collections collections exist at a time; creating one more
+    raises CollectionLimitError.
+
+    Collections are opened on the first request that names them. At most
+    max_open stay open: opening one more closes the least recently used, and
+    collections not looked up for idle_seconds are closed too; the default
+    collection stays open. Collections are pinned by the requests and jobs
+    using them: pinned collections are skipped by both, and a collection
+    dropped or replaced while pinned is closed when its last pin is released,
+    so a running search or commit never sees its index closed. Each open collection runs the snapshot thread of
+    its RAGService, but the change streams of all of them are watched by one
+    sync thread with a single blocking XREAD, so the process holds one Redis
+    connection for waiting however many collections are open. A query
+    over several collections embeds its questions once, searches the
+    collections in parallel on search_workers threads and merges their
+    passages by score, so every search only scans the vectors of the
+    collections it names.
+
+    Attributes:
+        redis_service (RedisService): Unprefixed Redis service the collections are scoped from.
+        index_dir (str): Root directory of the index snapshots.
+        registry (ModelRegistry): Registry providing the shared models.
+        default (str): Name of the default collection.
+        strategies (Optional[dict]): Extraction strategies shared by the document services.
+        max_collections (int): Maximum number of collections.
+        max_open (int): Maximum number of collections this process keeps open.
+        idle_seconds (float): Collections not looked up for this long are closed; 0 keeps them open.
+        sync_block_ms (int): Milliseconds the sync thread waits on the change streams; 0 disables it.
+        rag_options (dict): Keyword arguments passed to each RAGService.
+        sync_error (Optional[str]): Why the last read of the change streams failed, None if it succeeded.
+    """
+    names_key = "collections"
+    generations_key = "collections:generation"
+
+    def __init__(self, redis_service: RedisService, index_dir: str = INDEX_DIR,
+                 registry: ModelRegistry = model_registry, default: str = DEFAULT_COLLECTION,
+                 search_workers: int = COLLECTION_SEARCH_WORKERS, strategies: Optional[dict] = None,
+                 max_collections: int = MAX_COLLECTIONS, max_open: int = MAX_OPEN_COLLECTIONS,
+                 idle_seconds: float = COLLECTION_IDLE_SECONDS, sync_block_ms: int = INDEX_SYNC_BLOCK_MS,
+                 **rag_options):
+        """Initialize CollectionService and register the default collection.
+
+        Args:
+            redis_service (RedisService): Unprefixed Redis service.
+            index_dir (str): Root directory of the index snapshots, shared by all workers and replicas.
+            registry (ModelRegistry): Registry providing the shared models.
+            default (str): Name of the default collection.
+            search_workers (int): Threads searching the collections of a query in parallel.
+            strategies (Optional[dict]): Extraction strategies for the document services; None
+                lets each build its own.
+            max_collections (int): Maximum number of collections.
+            max_open (int): Maximum number of collections this process keeps open.
+            idle_seconds (float): Collections not looked up for this long are closed; 0 keeps them open.
+            sync_block_ms (int): Milliseconds the sync thread waits on the change streams; 0 disables
+                it, so searches only sync first if sync_on_read is set and idle collections stay open.
+            **rag_options: Keyword arguments passed to each RAGService, e.g. snapshot_interval.
+        """
+        self.validate(default)
+        self.redis_service = redis_service
+        self.index_dir = index_dir
+        self.registry = registry
+        self.default = default
+        self.strategies = strategies
+        self.max_collections = max_collections
+        self.max_open = max(1, max_open)
+        self.idle_seconds = idle_seconds
+        self.sync_block_ms = sync_block_ms
+        self.rag_options = dict(rag_options, sync_block_ms=0)
+        self.sync_error = None
+        self._collections = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._search_pool = ThreadPoolExecutor(max_workers=max(1, search_workers),
+                                               thread_name_prefix="collection-search")
+        self._cleaner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collection-cleanup")
+        self._create_script = redis_service.client.register_script(CREATE_SCRIPT)
+        self._register_default()
+        self._sync_thread = None
+        if sync_block_ms > 0:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="collection-sync", daemon=True)
+            self._sync_thread.start()
+
+    @staticmethod
+    def validate(name: str):
+        """Check a collection name.
+
+        Names are 1 to 64 letters, digits, '_', '.' or '-', starting with a
+        letter or digit, so they are safe in Redis key patterns and paths.
+
+        Args:
+            name (str): Collection name.
+
+        Raises:
+            ValueError: If the name is invalid.
+        """
+        if not COLLECTION_NAME_RE.fullmatch(name):
+            raise ValueError(f"Invalid collection name: {name!r}")
+
+    def _register_default(self):
+        """Register the default collection at generation 0, unless it was created or dropped before."""
+        client = self.redis_service.client
+        if client.hexists(self.generations_key, self.default):
+            return
+        pipe = client.pipeline()
+        pipe.hsetnx(self.generations_key, self.default, 0)
+        pipe.hsetnx(self.names_key, self.default, 0)
+        pipe.execute()
+
+    def prefix(self, name: str, generation: int) -> str:
+        """Return the Redis key prefix of a collection generation."""
+        return f"col:{name}:{generation}:"
+
+    def directory(self, name: str, generation: int) -> str:
+        """Return the index directory of a collection generation."""
+        return os.path.join(self.index_dir, "collections", name, str(generation))
+
+    def names(self) -> List[str]:
+        """Return the names of all live collections, sorted."""
+        return sorted(name.decode() for name in self.redis_service.client.hkeys(self.names_key))
+
+    def opened(self) -> List[Collection]:
+        """Return the collections this process has open, least recently used first."""
+        with self._lock:
+            return list(self._collections.values())
+
+    def sync_errors(self) -> Dict[str, str]:
+        """Return why the index of each open collection that cannot sync failed to.
+
+        Returns:
+            Dict[str, str]: Error of each collection whose last sync, or the last
+                read of the change streams, failed.
+        """
+        errors = {}
+        for collection in self.opened():
+            error = collection.rag_service.sync_error or self.sync_error
+            if error:
+                errors[collection.name] = error
+        return errors
+
+    def get(self, name: str, create: bool = False, pin: bool = False) -> Collection:
+        """Open a collection.
+
+        Args:
+            name (str): Collection name.
+            create (bool): Whether to create the collection if it does not exist.
+            pin (bool): Whether to pin the collection until it is passed to unpin.
+
+        Returns:
+            Collection: The collection.
+
+        Raises:
+            ValueError: If the name is invalid.
+            CollectionNotFoundError: If the collection does not exist and create is False.
+        """
+        return self.resolve([name], create, pin)[0]
+
+    def resolve(self, names: List[str], create: bool = False, pin: bool = False) -> List[Collection]:
+        """Open several collections, looking up their generations in one round trip.
+
+        Open collections whose generation is outdated, because they were
+        dropped by another worker, are closed and replaced.
+
+        Args:
+            names (List[str]): Collection names.
+            create (bool): Whether to create collections that do not exist.
+            pin (bool): Whether to pin the collections until they are passed to unpin.
+
+        Returns:
+            List[Collection]: Collection of each name, in order.
+
+        Raises:
+            ValueError: If a name is invalid.
+            CollectionNotFoundError: If a collection does not exist and create is False.
+            CollectionLimitError: If creating a collection would exceed max_collections.
+        """
+        for name in names:
+            self.validate(name)
+        generations = self.redis_service.client.hmget(self.names_key, names) if names else []
+        collections = []
+        try:
+            for name, generation in zip(names, generations):
+                if generation is None:
+                    self._forget(name)
+                    if not create:
+                        raise CollectionNotFoundError(f"Collection not found: {name}")
+                    generation = self._create(name)
+                collections.append(self._open(name, int(generation), pin))
+        except BaseException:
+            if pin:
+                self.unpin(collections)
+            raise
+        return collections
+
+    def pin(self, collections: List[Collection]):
+        """Pin collections that are already pinned once more, e.g. for jobs outliving the request that opened them.
+
+        Args:
+            collections (List[Collection]): Pinned collections; one repeated n times is pinned n times.
+        """
+        with self._lock:
+            for collection in collections:
+                collection.pins += 1
+
+    def unpin(self, collections: List[Collection]):
+        """Release one pin of each collection, closing those that were dropped or replaced meanwhile.
+
+        Args:
+            collections (List[Collection]): Collections returned by a pinning resolve or get, or passed to pin.
+        """
+        with self._lock:
+            for collection in collections:
+                collection.pins -= 1
+                if not collection.pins and collection.closing is not None and not self._stop.is_set():
+                    self._cleaner.submit(self._close, collection)
+
+    def is_live(self, collection: Collection) -> bool:
+        """Return whether a collection generation has not been dropped.
+
+        Args:
+            collection (Collection): Collection to check.
+
+        Returns:
+            bool: True if the name still maps to the collection's generation.
+        """
+        generation = self.redis_service.client.hget(self.names_key, collection.name)
+        return generation is not None and int(generation) == collection.generation
+
+    def _create(self, name: str) -> int:
+        """Register a new generation of a collection, or return the one a concurrent create registered.
+
+        The limit check and the registration run in one Lua script, so
+        concurrent creates cannot exceed max_collections together.
+
+        Raises:
+            CollectionLimitError: If max_collections collections exist.
+        """
+        generation, created = self._create_script(keys=[self.names_key, self.generations_key],
+                                                  args=[name, self.max_collections])
+        if generation < 0:
+            raise CollectionLimitError(f"Cannot create collection {name}: "
+                                       f"the limit of {self.max_collections} collections is reached")
+        if created:
+            logger.info(f"Created collection {name} (generation {generation})")
+        return generation
+
+    def _open(self, name: str, generation: int, pin: bool = False) -> Collection:
+        """Return the open collection of a generation, loading its index if needed.
+
+        Opening a collection beyond max_open closes the least recently used
+        one that is not pinned.
+        """
+        with self._lock:
+            current = self._collections.get(name)
+            if current is not None and current.generation == generation:
+                current.last_used = time.monotonic()
+                current.pins += pin
+                self._collections.move_to_end(name)
+                return current
+        redis_service = self.redis_service.scoped(self.prefix(name, generation))
+        rag_service = RAGService(redis_service=redis_service, index_dir=self.directory(name, generation),
+                                 registry=self.registry, **self.rag_options)
+        fresh = Collection(name, generation, redis_service, rag_service,
+                           DocumentService(redis_service=redis_service, rag_service=rag_service,
+                                           strategies=self.strategies))
+        with self._lock:
+            current = self._collections.get(name)
+            if current is not None and current.generation >= generation:
+                collection, unused = current, fresh
+            else:
+                collection, unused = fresh, current
+                self._collections[name] = fresh
+            collection.last_used = time.monotonic()
+            collection.pins += pin
+            self._collections.move_to_end(name)
+            overflow = max(0, len(self._collections) - self.max_open)
+            candidates = [other for other, candidate in list(self._collections.items())[:-1]
+                          if other != self.default and not candidate.pins]
+            evicted = [self._collections.pop(other) for other in candidates[:overflow]]
+            if unused is not None:
+                self._retire(unused, snapshot=False)
+            for other in evicted:
+                self._retire(other, snapshot=True)
+        for other in evicted:
+            logger.info(f"Closing collection {other.name}: more than {self.max_open} collections open")
+        return collection
+
+    def _close_idle(self):
+        """Close the unpinned collections other than the default one that were not looked up for idle_seconds."""
+        if not self.idle_seconds:
+            return
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [collection for name, collection in self._collections.items()
+                    if name != self.default and not collection.pins and collection.last_used < cutoff]
+            for collection in idle:
+                del self._collections[collection.name]
+                self._retire(collection, snapshot=True)
+        for collection in idle:
+            logger.info(f"Closing collection {collection.name}: idle for {self.idle_seconds:.0f}s")
+
+    def _sync_loop(self):
+        """Wait for changes to any open collection with one XREAD and sync the collections that changed.
+
+        XREAD only returns one entry per stream, to tell which collections to
+        sync. The snapshot pointers are checked after every wait, so replicas
+        also follow snapshots published while their stream was quiet.
+        """
+        client = self.redis_service.client
+        while not self._stop.is_set():
+            try:
+                self._close_idle()
+                collections = self.opened()
+                if not collections:
+                    self._stop.wait(self.sync_block_ms / 1000)
+                    continue
+                logs = {collection.rag_service.change_log.key: collection for collection in collections}
+                streams = client.xread({key: collection.rag_service.cursor for key, collection in logs.items()},
+                                       count=1, block=self.sync_block_ms)
+                pipe = client.pipeline(transaction=False)
+                for collection in collections:
+                    pipe.get(collection.rag_service.change_log.snapshot_key)
+                pointers = pipe.execute()
+                self.sync_error = None
+            except Exception as e:
+                self.sync_error = f"{type(e).__name__}: {str(e)}"
+                logger.error(f"Reading the collection change streams failed: {str(e)}")
+                self._stop.wait(1.0)
+                continue
+            changed = {logs[key.decode()].name for key, _ in streams or []}
+            for collection, pointer in zip(collections, pointers):
+                newer = pointer is not None and json.loads(pointer)["seq"] > collection.rag_service.snapshot_seq
+                if collection.name not in changed and not newer:
+                    continue
+                try:
+                    collection.rag_service.sync()
+                except Exception as e:
+                    logger.error(f"Index sync of collection {collection.name} failed: {str(e)}")
+
+    def _forget(self, name: str, generation: Optional[int] = None, purge: bool = False) -> bool:
+        """Close the open collection of a name, if it has the given generation or any when None.
+
+        Returns:
+            bool: True if a collection was closed, or will be once it is unpinned.
+        """
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None or (generation is not None and collection.generation != generation):
+                return False
+            del self._collections[name]
+            self._retire(collection, snapshot=False, purge=purge)
+        return True
+
+    def _retire(self, collection: Collection, snapshot: bool, purge: bool = False):
+        """Close a collection removed from the open ones, now or when its last pin is released.
+
+        Must be called with _lock held.
+        """
+        collection.closing = (snapshot, purge)
+        if not collection.pins:
+            self._cleaner.submit(self._close, collection)
+
+    def _close(self, collection: Collection):
+        snapshot, purge = collection.closing
+        try:
+            collection.rag_service.close(snapshot)
+        except Exception as e:
+            logger.error(f"Closing collection {collection.name} failed: {str(e)}")
+        if purge:
+            self._purge(collection.name, collection.generation)
+
+    def drop(self, name: str) -> bool:
+        """Drop a collection in O(1) and delete its data in the background.
+
+        Args:
+            name (str): Collection name.
+
+        Returns:
+            bool: True if the collection existed.
+
+        Raises:
+            ValueError: If the name is invalid.
+        """
+        self.validate(name)
+        pipe = self.redis_service.client.pipeline()
+        pipe.hget(self.names_key, name)
+        pipe.hdel(self.names_key, name)
+        generation, removed = pipe.execute()
+        if not removed:
+            return False
+        generation = int(generation)
+        if not self._forget(name, generation, purge=True):
+            self._cleaner.submit(self._purge, name, generation)
+        logger.info(f"Dropped collection {name} (generation {generation})")
+        return True
+
+    def _purge(self, name: str, generation: int):
+        """Delete the Redis keys and snapshot files of a dropped collection generation."""
+        try:
+            deleted = self.redis_service.delete_matching(self.prefix(name, generation) + "*")
+            shutil.rmtree(self.directory(name, generation), ignore_errors=True)
+            logger.info(f"Deleted {deleted} keys of dropped collection {name} (generation {generation})")
+        except Exception as e:
+            logger.error(f"Cleanup of dropped collection {name} failed: {str(e)}")
+
+    def index_versions(self, collections: List[Collection]) -> List[int]:
+        """Get the corpus version of several collections in one round trip.
+
+        Args:
+            collections (List[Collection]): Collections to look up.
+
+        Returns:
+            List[int]: Index version of each collection, as in RedisService.get_index_version.
+        """
+        pipe = self.redis_service.client.pipeline(transaction=False)
+        for collection in collections:
+            pipe.get(collection.redis_service.key("index:version"))
+        return [int(version or 0) for version in pipe.execute()]
+
+    def retrieve_passages_batch(self, collections: List[Collection], questions: List[str],
+                                k: int = RETRIEVAL_TOP_K, nprobe: Optional[int] = None,
+                                ef_search: Optional[int] = None, mode: Optional[str] = None,
+                                labels: Optional[List[str]] = None) -> List[List[dict]]:
+        """Retrieve the most relevant passages for several questions from several collections.
+
+        Each collection returns its own top k per question and the merged
+        top k is taken by score. Vector scores are cosine similarities and
+        compare across collections; lexical and hybrid scores are rank-based,
+        so those merge by rank.
+
+        Args:
+            collections (List[Collection]): Collections to search.
+            questions (List[str]): Questions to find passages for.
+            k (int): Maximum number of passages per question.
+            nprobe (Optional[int]): IVF lists to visit.
+            ef_search (Optional[int]): HNSW search queue size.
+            mode (Optional[str]): 'vector', 'lexical' or 'hybrid'. Defaults to each collection's mode.
+            labels (Optional[List[str]]): Only return passages containing an entity with one of these labels.
+
+        Returns:
+            List[List[dict]]: Passages for each question, as in RAGService.retrieve_passages,
+                with the name of their 'collection' added.
+        """
+        if len(collections) == 1:
+            return self._retrieve(collections[0], questions, k, nprobe, ef_search, mode, labels, None)
+        embeddings = None
+        if (mode or collections[0].rag_service.retrieval_mode) != "lexical" and any(
+                collection.rag_service.ntotal for collection in collections):
+            embeddings = collections[0].rag_service.encode_queries(questions)
+        shards = list(self._search_pool.map(
+            lambda collection: self._retrieve(collection, questions, k, nprobe, ef_search, mode, labels, embeddings),
+            collections))
+        merged = []
+        for row in zip(*shards):
+            passages = sorted((passage for passages in row for passage in passages),
+                              key=lambda passage: passage["score"], reverse=True)
+            merged.append(passages[:k])
+        return merged
+
+    @staticmethod
+    def _retrieve(collection: Collection, questions: List[str], k: int, nprobe: Optional[int],
+                  ef_search: Optional[int], mode: Optional[str], labels: Optional[List[str]],
+                  embeddings: Optional[np.ndarray]) -> List[List[dict]]:
+        results = collection.rag_service.retrieve_passages_batch(questions, k, nprobe, ef_search, mode, labels,
+                                                                 embeddings)
+        for passages in results:
+            for passage in passages:
+                passage["collection"] = collection.name
+        return results
+
+    def close(self):
+        """Stop the sync and search threads, finish pending cleanups and close every open collection."""
+        self._stop.set()
+        if self._sync_thread is not None:
+            self._sync_thread.join()
+        self._search_pool.shutdown(wait=True)
+        with self._lock:
+            collections, self._collections = list(self._collections.values()), {}
+            for collection in collections:
+                collection.closing = (True, False)
+                self._cleaner.submit(self._close, collection)
+        self._cleaner.shutdown(wait=True)
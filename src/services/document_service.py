@@ -1,39 +1,137 @@
+import hashlib
+from typing import List, Optional, Tuple
+import numpy as np
+from extraction.extraction_strategy import ExtractionStrategy
 from extraction.pdf_extraction import PDFExtractionStrategy
 from extraction.image_extraction import ImageExtractionStrategy
+from extraction.ocr_engine import OcrEngine
+from utils.config import PDF_WORKERS
+from utils.logger import setup_logging
+from utils.metrics import metrics
+from .model_registry import ModelRegistry, model_registry
+from .ner_service import NERService
 from .redis_service import RedisService
 from .rag_service import RAGService
 
+logger = setup_logging()
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SUPPORTED_EXTENSIONS = (".pdf",) + IMAGE_EXTENSIONS
+
+def build_strategies(registry: ModelRegistry = model_registry, pdf_workers: int = PDF_WORKERS) -> dict:
+    """Create the mapping of file extensions to extraction strategies.
+
+    All image extensions share one strategy, and the image and the PDF
+    strategy share one OCR engine whose reader comes from the registry, so
+    the OCR models are loaded once per process.
+
+    Args:
+        registry (ModelRegistry): Registry providing shared models.
+        pdf_workers (int): Processes used for page-parallel PDF extraction; 1 extracts in-process.
+
+    Returns:
+        dict: Extraction strategy for each supported extension.
+    """
+    engine = OcrEngine(registry)
+    image_strategy = ImageExtractionStrategy(registry, engine=engine)
+    return {
+        ".pdf": PDFExtractionStrategy(registry, workers=pdf_workers, engine=engine),
+        ".jpg": image_strategy,
+        ".jpeg": image_strategy,
+        ".png": image_strategy
+    }
+
+def select_strategy(strategies: dict, filename: str) -> ExtractionStrategy:
+    """Pick the extraction strategy for a filename by its extension.
+
+    Args:
+        strategies (dict): Mapping from build_strategies.
+        filename (str): Name of the uploaded file.
+
+    Returns:
+        ExtractionStrategy: Strategy for the file type.
+
+    Raises:
+        ValueError: If the file type is not supported.
+    """
+    extension = filename.lower()[filename.rfind("."):]
+    strategy = strategies.get(extension)
+    if not strategy:
+        raise ValueError("Unsupported file type")
+    return strategy
+
+def content_hash(content: bytes) -> str:
+    """Compute the content id of an upload.
+
+    Args:
+        content (bytes): Raw bytes of the file.
+
+    Returns:
+        str: Hex SHA-256 digest of the content.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Compute the content id of a file on disk without reading it into memory at once.
+
+    Args:
+        path (str): Path of the file.
+        chunk_size (int): Bytes read per step.
+
+    Returns:
+        str: Hex SHA-256 digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class DocumentService:
     """Service for processing and extracting text from uploaded documents.
 
     Manages the extraction of text from PDF and image files using specific strategies
     and stores the results in Redis and FAISS indices.
 
+    Documents are content-addressed: the SHA-256 of the upload is the document
+    id, and filenames are aliases to it. Uploading bytes that are already
+    indexed only updates the alias; bytes whose extraction is still cached in
+    Redis skip OCR, parsing and embedding. Every change to the index bumps the
+    index version, which invalidates cached answers.
+
+    Uploading a filename again with different content is an upsert: once no
+    filename points at the old content anymore, its passages are removed
+    from the index and its data from Redis, as with delete_document.
+
+    Named entities are extracted from the passages while ingesting and stored
+    with the document; passages carry their entity labels into the index.
+
     Attributes:
         redis_service (RedisService): Service for Redis operations.
         rag_service (RAGService): Service for retrieval-augmented generation.
         strategies (dict): Mapping of file extensions to extraction strategies.
+        ner_service (NERService): Service for named entity recognition.
     """
-    def __init__(self, redis_service: RedisService ,rag_service: RAGService):
+    def __init__(self, redis_service: RedisService ,rag_service: RAGService, strategies: Optional[dict] = None):
         """Initialize DocumentService with Redis and RAG services.
 
         Args:
             redis_service (RedisService): Redis connection service.
             rag_service (RAGService): RAG service instance.
+            strategies (Optional[dict]): Extraction strategies by extension. Defaults to
+                build_strategies(); callers that extract elsewhere can pass an empty dict.
         """
         self.redis_service = redis_service
         self.rag_service = rag_service
-        self.strategies = {
-            ".pdf": PDFExtractionStrategy(),
-            ".jpg": ImageExtractionStrategy(),
-            ".jpeg": ImageExtractionStrategy(),
-            ".png": ImageExtractionStrategy()
-        }
+        self.strategies = build_strategies() if strategies is None else strategies
+        self.ner_service = NERService(rag_service.registry)
 
     def process_document(self, filename: str, content: bytes) -> str:
         """Process a document and extract its text.
 
-        Uses the appropriate strategy based on file extension and stores the text.
+        Uses the appropriate strategy based on file extension, stores the text
+        and indexes it passage by passage. Known content is served from the
+        extraction cache instead.
 
         Args:
             filename (str): Name of the uploaded file.
@@ -42,11 +140,139 @@ class DocumentService:
         Returns:
             str: Extracted text from the document.
         """
-        extension = filename.lower()[filename.rfind("."):]
-        strategy = self.strategies.get(extension)
-        if not strategy:
-            raise ValueError("Unsupported file type")
-        text = strategy.extract_text(content)
-        self.redis_service.store_document(filename, text)
-        self.rag_service.store_embedding(filename, text)
+        content_id = content_hash(content)
+        if self.store_cached(filename, content_id):
+            return self.redis_service.get_document(content_id)
+        pages = select_strategy(self.strategies, filename).extract_pages(content)
+        passages, vectors = self.rag_service.encode_pages(pages)
+        entities = self.ner_service.annotate_documents([passages])[0]
+        return self.store_processed(filename, content_id, pages, passages, vectors, entities=entities)
+
+    def store_cached(self, filename: str, content_id: str) -> bool:
+        """Register an upload whose content was seen before, without processing it.
+
+        Args:
+            filename (str): Name of the uploaded file.
+            content_id (str): Content hash of the upload.
+
+        Returns:
+            bool: True if the content was already indexed or cached, False if it
+                still has to be extracted and embedded.
+        """
+        lookups = metrics.counter("dis_extraction_cache_lookups_total",
+                                  "Uploads checked against indexed and cached extractions.")
+        if self.rag_service.has_document(content_id):
+            if self.set_aliases({filename: content_id}):
+                self.redis_service.bump_index_version()
+            lookups.inc(result="indexed")
+            return True
+        cached = self.redis_service.get_cached_extraction(content_id)
+        if cached is None:
+            lookups.inc(result="miss")
+            return False
+        lookups.inc(result="cached")
+        pages, passages, vectors = cached
+        self.store_processed(filename, content_id, pages, passages, vectors, cache=False)
+        return True
+
+    def store_processed(self, filename: str, content_id: str, pages: List[str], passages: List[dict],
+                        vectors: np.ndarray, cache: bool = True, entities: Optional[list] = None) -> str:
+        """Store a document that was extracted and embedded elsewhere.
+
+        Used for results coming back from ingestion workers, so the API process
+        only does the Redis writes and the index add.
+
+        Args:
+            filename (str): Name of the uploaded file.
+            content_id (str): Content hash of the upload.
+            pages (List[str]): Extracted text of each page.
+            passages (List[dict]): Passages from chunk_pages.
+            vectors (np.ndarray): Embeddings, one row per passage.
+            cache (bool): Whether to cache the extraction results.
+            entities (Optional[list]): Entity spans from NERService.annotate_documents;
+                None keeps the stored ones.
+
+        Returns:
+            str: Extracted text of the document.
+        """
+        text = "".join(pages)
+        self.redis_service.store_document(content_id, text)
+        if entities is not None:
+            self.redis_service.store_entities({content_id: entities})
+        if cache:
+            self.redis_service.cache_extraction(content_id, pages, passages, vectors)
+        self.rag_service.add_passages(content_id, filename, passages, vectors)
+        self.set_aliases({filename: content_id})
+        self.redis_service.bump_index_version()
         return text
+
+    def store_processed_batch(self, documents: List[Tuple[str, str, List[str], List[dict], np.ndarray, list]]):
+        """Store several processed documents with pipelined Redis writes and one index add.
+
+        Args:
+            documents (List[Tuple[str, str, List[str], List[dict], np.ndarray, list]]): Filename,
+                content id, pages, passages, embeddings and entity spans of each document.
+        """
+        if not documents:
+            return
+        self.redis_service.store_documents({content_id: "".join(pages)
+                                            for _, content_id, pages, _, _, _ in documents})
+        self.redis_service.store_entities({content_id: entities for _, content_id, _, _, _, entities in documents})
+        self.redis_service.cache_extractions([(content_id, pages, passages, vectors)
+                                              for _, content_id, pages, passages, vectors, _ in documents])
+        self.rag_service.add_documents([(content_id, filename, passages, vectors)
+                                        for filename, content_id, _, passages, vectors, _ in documents])
+        self.set_aliases({filename: content_id for filename, content_id, _, _, _, _ in documents})
+        self.redis_service.bump_index_version()
+
+    def set_aliases(self, aliases: dict) -> List[str]:
+        """Point filenames at content ids and delete the content no filename points to anymore.
+
+        Args:
+            aliases (dict): Content id keyed by filename.
+
+        Returns:
+            List[str]: Content ids that were deleted. The caller bumps the index version.
+        """
+        orphaned = [content_id for content_id in self.redis_service.set_aliases(aliases)
+                    if content_id not in aliases.values()]
+        for content_id in orphaned:
+            passages = self.rag_service.remove_document(content_id)
+            self.redis_service.delete_document(content_id)
+            logger.info(f"Replaced document {content_id} ({passages} passages removed)")
+        return orphaned
+
+    def delete_document(self, doc_id: str) -> Optional[dict]:
+        """Delete a document from the index and Redis.
+
+        Args:
+            doc_id (str): Content id of the document, or a filename pointing at it.
+
+        Returns:
+            Optional[dict]: 'doc_id', the removed 'filenames' and the number of removed
+                'passages', or None if the document is unknown.
+        """
+        content_id = doc_id
+        if not self.rag_service.has_document(doc_id):
+            content_id = self.redis_service.resolve_alias(doc_id) or doc_id
+        passages = self.rag_service.remove_document(content_id)
+        filenames = self.redis_service.delete_document(content_id)
+        if not passages and not filenames:
+            return None
+        self.redis_service.bump_index_version()
+        logger.info(f"Deleted document {content_id} ({passages} passages, filenames {filenames})")
+        return {"doc_id": content_id, "filenames": filenames, "passages": passages}
+
+    def get_text(self, filename: str) -> Optional[str]:
+        """Get the extracted text of a document by the filename it was uploaded under.
+
+        Args:
+            filename (str): Name of the uploaded file.
+
+        Returns:
+            Optional[str]: Extracted text, or None if the filename is unknown.
+        """
+        content_id = self.redis_service.resolve_alias(filename)
+        if content_id is None:
+            return None
+        return self.redis_service.get_document(content_id)
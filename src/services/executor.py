@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+class OverloadedError(RuntimeError):
+    """Raised when work is rejected because its queue is full.
+
+    Attributes:
+        retry_after (float): Seconds after which a retry is likely to be admitted.
+    """
+    def __init__(self, message: str, retry_after: float):
+        """Initialize OverloadedError.
+
+        Args:
+            message (str): Error message.
+            retry_after (float): Seconds after which a retry is likely to be admitted.
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class DeadlineExceededError(TimeoutError):
+    """Raised for work whose deadline passed before it could start."""
+
+class TimedFuture(Future):
+    """Future that records how long its work waited and ran.
+
+    Attributes:
+        submitted (float): time.monotonic() when the work was submitted.
+        queue_wait (Optional[float]): Seconds between submission and start, None until started.
+        compute (Optional[float]): Seconds the work ran, None until finished.
+    """
+    def __init__(self):
+        super().__init__()
+        self.submitted = time.monotonic()
+        self.queue_wait = None
+        self.compute = None
+
+class PriorityExecutor:
+    """Fixed pool of threads that runs callables in priority order.
+
+    Lower priority values run first, so PRIORITY_INTERACTIVE work such as
+    /ask batches overtakes queued PRIORITY_BATCH work such as ingestion
+    commits; equal priorities run in submission order. Running work is not
+    preempted, so the pool size bounds how much inference the process runs
+    at once. Work that cannot start before its deadline fails with
+    DeadlineExceededError without running.
+
+    Attributes:
+        workers (int): Number of threads.
+    """
+    def __init__(self, workers: int, name: str = "priority-executor"):
+        """Initialize PriorityExecutor and start its threads.
+
+        Args:
+            workers (int): Number of threads.
+            name (str): Thread name prefix.
+        """
+        self.workers = max(1, workers)
+        self._heap = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._busy = 0
+        self._closed = False
+        self._threads = [threading.Thread(target=self._run, name=f"{name}-{number}", daemon=True)
+                         for number in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args, priority: int = PRIORITY_BATCH,
+               deadline: Optional[float] = None, **kwargs) -> TimedFuture:
+        """Queue a call.
+
+        Args:
+            fn (Callable[..., Any]): Function to run.
+            *args: Positional arguments for fn.
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BATCH; lower runs first.
+            deadline (Optional[float]): time.monotonic() after which the call is not started.
+            **kwargs: Keyword arguments for fn.
+
+        Returns:
+            TimedFuture: Resolves to the result of fn.
+
+        Raises:
+            RuntimeError: If the executor was shut down.
+        """
+        future = TimedFuture()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Executor is shut down")
+            heapq.heappush(self._heap, (priority, next(self._order), deadline, future, fn, args, kwargs))
+            self._condition.notify()
+        return future
+
+    def queued(self) -> int:
+        """Return the number of calls waiting for a thread."""
+        with self._condition:
+            return len(self._heap)
+
+    def busy(self) -> int:
+        """Return the number of threads running a call."""
+        with self._condition:
+            return self._busy
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap and not self._closed:
+                    self._condition.wait()
+                if not self._heap:
+                    return
+                _, _, deadline, future, fn, args, kwargs = heapq.heappop(self._heap)
+                self._busy += 1
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                started = time.monotonic()
+                future.queue_wait = started - future.submitted
+                if deadline is not None and started > deadline:
+                    future.set_exception(DeadlineExceededError("Deadline passed before the work started"))
+                    continue
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.compute = time.monotonic() - started
+                    future.set_exception(e)
+                else:
+                    future.compute = time.monotonic() - started
+                    future.set_result(result)
+            finally:
+                with self._condition:
+                    self._busy -= 1
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting work, cancel queued calls and optionally wait for running ones.
+
+        Args:
+            wait (bool): Whether to wait for the threads to finish.
+        """
+        with self._condition:
+            self._closed = True
+            queued, self._heap = self._heap, []
+            self._condition.notify_all()
+        for item in queued:
+            item[3].cancel()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,158 @@
+import math
+from typing import Optional, Tuple
+import faiss
+import numpy as np
+from utils.config import HNSW_M, PQ_M, DEFAULT_NPROBE, DEFAULT_EF_SEARCH
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8")
+
+def index_spec(index_type: str, ntotal: int) -> str:
+    """Translate an index type name into a FAISS index_factory string.
+
+    The number of IVF lists grows with the corpus (about 4 * sqrt(ntotal)).
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        ntotal (int): Number of vectors the index is built for.
+
+    Returns:
+        str: FAISS factory string.
+
+    Raises:
+        ValueError: If the index type is unknown.
+    """
+    nlist = max(1, min(65536, int(4 * math.sqrt(max(ntotal, 1)))))
+    specs = {
+        "flat": "Flat",
+        "hnsw": f"HNSW{HNSW_M}",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "ivf_pq": f"IVF{nlist},PQ{PQ_M}",
+        "sq8": "SQ8"
+    }
+    if index_type not in specs:
+        raise ValueError(f"Unknown index type: {index_type}")
+    return specs[index_type]
+
+def build_index(index_type: str, dim: int, ntotal: int) -> faiss.IndexIDMap2:
+    """Create an empty, untrained ID-mapped index with default search parameters applied.
+
+    Vectors are added with add_with_ids, so their ids stay stable when the
+    index is rebuilt without some of them.
+
+    Args:
+        index_type (str): One of INDEX_TYPES.
+        dim (int): Vector dimension.
+        ntotal (int): Number of vectors the index is built for.
+
+    Returns:
+        faiss.IndexIDMap2: New index using the L2 metric.
+    """
+    index = faiss.index_factory(dim, index_spec(index_type, ntotal), faiss.METRIC_L2)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = DEFAULT_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+    return faiss.IndexIDMap2(index)
+
+def base_index(index: faiss.Index) -> faiss.Index:
+    """Return the index inside an ID map, or the index itself if it is not wrapped.
+
+    Args:
+        index (faiss.Index): Possibly ID-mapped index.
+
+    Returns:
+        faiss.Index: Index holding the vectors.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+def index_ids(index: faiss.Index) -> np.ndarray:
+    """Get the ids of the vectors of an index in storage order.
+
+    Args:
+        index (faiss.Index): ID-mapped index, or a plain index whose ids are positions.
+
+    Returns:
+        np.ndarray: int64 ids.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+def reconstruct_range(index: faiss.Index, start: int, end: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode the vectors stored at positions [start, end) with their ids.
+
+    Flat, HNSW and IVF-Flat indexes return the original vectors; SQ8 and
+    IVF-PQ return their quantized approximations.
+
+    Args:
+        index (faiss.Index): ID-mapped or plain index.
+        start (int): First storage position.
+        end (int): Storage position after the last one.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: int64 ids and float32 vectors of shape (end - start, d).
+    """
+    if end <= start:
+        return np.empty(0, dtype=np.int64), np.empty((0, index.d), dtype=np.float32)
+    return index_ids(index)[start:end], base_index(index).reconstruct_n(start, end - start)
+
+def search_parameters(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      selector: Optional[faiss.IDSelector] = None) -> Optional[faiss.SearchParameters]:
+    """Build per-query search parameters for an index.
+
+    Parameters that do not apply to the index type are ignored, so callers
+    can pass both knobs regardless of which index is live. ID-mapped indexes
+    pass the parameters on to the index inside, translating the selector.
+
+    Args:
+        index (faiss.Index): Index that will be searched.
+        nprobe (Optional[int]): Number of IVF lists to visit.
+        ef_search (Optional[int]): HNSW search queue size.
+        selector (Optional[faiss.IDSelector]): Restricts the search to these vector
+            ids. The caller must keep it alive until the search returns.
+
+    Returns:
+        Optional[faiss.SearchParameters]: Parameters, or None to use the index defaults.
+    """
+    index = base_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        if nprobe is None and selector is None:
+            return None
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe if nprobe is not None else index.nprobe
+    elif isinstance(index, faiss.IndexHNSW):
+        if ef_search is None and selector is None:
+            return None
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search if ef_search is not None else index.hnsw.efSearch
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+def bytes_per_vector(index: faiss.Index) -> float:
+    """Estimate the resident memory used per stored vector.
+
+    Counts the vector codes plus per-vector structure overhead: 8-byte ids for
+    IVF lists, the level-0 neighbor links for HNSW, and the id array and
+    reverse hash map entry (about 24 bytes) of an ID map.
+
+    Args:
+        index (faiss.Index): Index to inspect.
+
+    Returns:
+        float: Estimated bytes per vector.
+    """
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return bytes_per_vector(base_index(index)) + (24 if isinstance(index, faiss.IndexIDMap2) else 8)
+    if isinstance(index, faiss.IndexHNSW):
+        storage = faiss.downcast_index(index.storage)
+        return float(storage.code_size + index.hnsw.nb_neighbors(0) * 4)
+    if isinstance(index, faiss.IndexIVF):
+        return float(index.code_size + 8)
+    return float(getattr(index, "code_size", index.d * 4))
@@ -0,0 +1,381 @@
+import json
+import os
+import re
+import shutil
+from typing import Iterable, Iterator, List, Optional, Tuple
+import faiss
+import numpy as np
+from utils.logger import setup_logging
+from .lexical_index import LexicalIndex, LexicalSegment
+
+logger = setup_logging()
+
+MANIFEST_RE = re.compile(r"manifest-(\d+)\.json")
+SEGMENT_RE = re.compile(r"\.?segment-(\d+)(\.tmp)?")
+SNAPSHOT_FILE_RE = re.compile(rf"{MANIFEST_RE.pattern}|{SEGMENT_RE.pattern}")
+PASSAGE_DTYPE = np.dtype([("id", "<i8"), ("doc", "<i4"), ("start", "<i8"), ("end", "<i8"), ("page", "<i4")])
+
+def _map(path: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+def _find(values: np.ndarray, value) -> int:
+    """Get the position of a value in a sorted array, -1 if it is not there."""
+    slot = int(np.searchsorted(values, value))
+    return slot if slot < len(values) and values[slot] == value else -1
+
+class Segment:
+    """Immutable part of a snapshot: the vectors, passage metadata and BM25 postings of a set of vector ids.
+
+    A segment is a directory written once by IndexStore.write_segment and
+    never modified. Its arrays are memory-mapped read-only, so the processes
+    sharing the index directory share their pages instead of each holding
+    the passage map and postings in RAM:
+
+    - index.faiss: ID-mapped vectors.
+    - passages.npy: id, document row, offsets and page of each passage, by ascending id.
+    - documents.npy: doc_id, filename, first passage row and passage count of each document, by doc_id.
+    - label_offsets.npy, label_codes.npy: entity labels of each passage, as codes into labels.json.
+    - label_ids_offsets.npy, label_ids.npy: ids of the passages with each label.
+    - lexical_*.npy: BM25 postings (see LexicalSegment).
+    - segment.json: range of vector ids the segment covers.
+
+    Attributes:
+        name (str): Directory name, 'segment-<n>'.
+        index (faiss.Index): ID-mapped vector index.
+        mmapped (bool): Whether the index is memory-mapped.
+        start (int): Lowest vector id covered.
+        end (int): One past the highest vector id covered.
+        lexical (LexicalSegment): BM25 postings of the passages.
+    """
+    def __init__(self, path: str):
+        """Map a segment directory.
+
+        Index types that cannot be memory-mapped are read into RAM instead.
+
+        Args:
+            path (str): Segment directory.
+
+        Raises:
+            FileNotFoundError: If the segment is gone.
+        """
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, "segment.json")) as f:
+            info = json.load(f)
+        self.start, self.end = info["start"], info["end"]
+        index_path = os.path.join(path, "index.faiss")
+        try:
+            self.index, self.mmapped = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), True
+        except RuntimeError:
+            self.index, self.mmapped = faiss.read_index(index_path), False
+        self.passages = _map(path, "passages")
+        self.documents = _map(path, "documents")
+        self.label_offsets, self.label_codes = _map(path, "label_offsets"), _map(path, "label_codes")
+        self.label_ids_offsets, self.label_ids = _map(path, "label_ids_offsets"), _map(path, "label_ids")
+        with open(os.path.join(path, "labels.json")) as f:
+            self.labels = json.load(f)
+        self._label_codes = {label: code for code, label in enumerate(self.labels)}
+        self.lexical = LexicalSegment(path, self.start)
+
+    @property
+    def ntotal(self) -> int:
+        """int: Number of vectors, one per passage."""
+        return self.index.ntotal
+
+    @property
+    def ids(self) -> np.ndarray:
+        """np.ndarray: Vector ids of the passages, ascending."""
+        return self.passages["id"]
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Tell which of several vector ids the segment holds.
+
+        Args:
+            ids (np.ndarray): int64 vector ids.
+
+        Returns:
+            np.ndarray: Boolean mask over ids.
+        """
+        stored = self.ids
+        slots = np.searchsorted(stored, ids)
+        found = slots < len(stored)
+        found[found] = stored[slots[found]] == ids[found]
+        return found
+
+    def _meta(self, row: int) -> dict:
+        passage = self.passages[row]
+        document = self.documents[passage["doc"]]
+        codes = self.label_codes[self.label_offsets[row]:self.label_offsets[row + 1]]
+        return {"doc_id": str(document["doc_id"]), "filename": str(document["filename"]),
+                "start": int(passage["start"]), "end": int(passage["end"]), "page": int(passage["page"]),
+                "labels": [self.labels[code] for code in codes]}
+
+    def meta(self, vector_id: int) -> Optional[dict]:
+        """Get the metadata of a passage.
+
+        Args:
+            vector_id (int): Vector id.
+
+        Returns:
+            Optional[dict]: 'doc_id', 'filename', 'start', 'end', 'page' and 'labels',
+                or None if the segment does not hold the passage.
+        """
+        row = _find(self.ids, vector_id)
+        return self._meta(row) if row >= 0 else None
+
+    def items(self, exclude: Optional[np.ndarray] = None) -> Iterator[Tuple[int, dict]]:
+        """Iterate over the passages in id order.
+
+        Args:
+            exclude (Optional[np.ndarray]): Vector ids to skip.
+
+        Yields:
+            Tuple[int, dict]: Vector id and metadata of each passage.
+        """
+        ids = np.array(self.ids)
+        keep = ~np.isin(ids, exclude) if exclude is not None and len(exclude) else np.ones(len(ids), dtype=bool)
+        for row in np.flatnonzero(keep).tolist():
+            yield int(ids[row]), self._meta(row)
+
+    def document(self, doc_id: str) -> Optional[np.ndarray]:
+        """Get the vector ids of a document's passages.
+
+        Args:
+            doc_id (str): Document id (content hash).
+
+        Returns:
+            Optional[np.ndarray]: int64 vector ids, or None if the segment does not hold the document.
+        """
+        stored = self.documents["doc_id"]
+        slot = int(np.searchsorted(stored, doc_id))
+        if slot >= len(stored) or str(stored[slot]) != doc_id:
+            return None
+        first, count = int(self.documents[slot]["first"]), int(self.documents[slot]["count"])
+        return np.array(self.ids[first:first + count])
+
+    def with_labels(self, labels: Iterable[str]) -> List[np.ndarray]:
+        """Get the vector ids of the passages with each of several entity labels.
+
+        Args:
+            labels (Iterable[str]): Entity labels, e.g. 'DATE' or 'ORG'.
+
+        Returns:
+            List[np.ndarray]: Ascending vector ids for each label the segment has.
+        """
+        codes = [self._label_codes[label] for label in labels if label in self._label_codes]
+        return [np.asarray(self.label_ids[self.label_ids_offsets[code]:self.label_ids_offsets[code + 1]])
+                for code in codes]
+
+    @staticmethod
+    def write_passages(path: str, passages: Iterable[Tuple[int, dict]]):
+        """Write the passage metadata files of a segment.
+
+        Args:
+            path (str): Segment directory.
+            passages (Iterable[Tuple[int, dict]]): Vector id and metadata of each passage, by ascending id.
+        """
+        rows, label_codes, label_offsets = [], [], [0]
+        documents, labels = {}, {}
+        for vector_id, meta in passages:
+            document = documents.get(meta["doc_id"])
+            if document is None:
+                document = documents[meta["doc_id"]] = [len(documents), meta["filename"], len(rows), 0]
+            document[3] += 1
+            rows.append((vector_id, document[0], meta["start"], meta["end"], meta["page"]))
+            label_codes.extend(labels.setdefault(label, len(labels)) for label in meta.get("labels", ()))
+            label_offsets.append(len(label_codes))
+        order = sorted(documents)
+        rank = np.empty(len(order), dtype=np.int32)
+        for position, doc_id in enumerate(order):
+            rank[documents[doc_id][0]] = position
+        table = np.array(rows, dtype=PASSAGE_DTYPE)
+        table["doc"] = rank[table["doc"]] if len(table) else table["doc"]
+        doc_width = max((len(doc_id) for doc_id in order), default=1)
+        name_width = max((len(documents[doc_id][1]) for doc_id in order), default=1)
+        document_table = np.array([(doc_id, documents[doc_id][1], documents[doc_id][2], documents[doc_id][3])
+                                   for doc_id in order],
+                                  dtype=[("doc_id", f"<U{doc_width}"), ("filename", f"<U{name_width}"),
+                                         ("first", "<i8"), ("count", "<i8")])
+        label_offsets = np.array(label_offsets, dtype=np.int64)
+        label_codes = np.array(label_codes, dtype=np.int32)
+        label_ids = np.repeat(table["id"], np.diff(label_offsets))
+        order = np.lexsort((label_ids, label_codes))
+        label_ids_offsets = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(label_codes, minlength=len(labels)), out=label_ids_offsets[1:])
+        arrays = {"passages": table, "documents": document_table, "label_offsets": label_offsets,
+                  "label_codes": label_codes, "label_ids_offsets": label_ids_offsets, "label_ids": label_ids[order]}
+        for name, values in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), values)
+        with open(os.path.join(path, "labels.json"), "w") as f:
+            json.dump(list(labels), f)
+
+class IndexStore:
+    """On-disk persistence of the index as immutable segments and numbered manifests.
+
+    A snapshot is a manifest (manifest-<seq>.json) naming the segments that
+    hold its passages, the change stream cursor it includes, the next vector
+    id and the ids of removed passages still in its segments. A CURRENT file
+    names the newest manifest and is replaced atomically, so a crash at any
+    point leaves a loadable state behind.
+
+    Snapshots are written incrementally: a regular snapshot adds one segment
+    with the passages applied since the previous one and lists the existing
+    segments again, so the vectors already on disk are neither read nor
+    rewritten. Segments are only rewritten when the leader merges the newest
+    ones or rebuilds the index.
+
+    The directory is shared by all workers and replicas (on several nodes,
+    through a shared volume): replicas open the manifest a published snapshot
+    names and memory-map its segments, so the processes share their pages.
+    The segments of the two newest manifests are kept for replicas still
+    switching to the older one.
+
+    Attributes:
+        directory (str): Directory holding manifests and segments.
+    """
+    def __init__(self, directory: str):
+        """Initialize IndexStore for a directory, creating it if needed.
+
+        Args:
+            directory (str): Directory holding manifests and segments.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_current(self) -> int:
+        try:
+            with open(self._path("CURRENT")) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def read_manifest(self, seq: Optional[int] = None) -> Optional[dict]:
+        """Read the manifest of a snapshot.
+
+        Args:
+            seq (Optional[int]): Snapshot sequence number. Defaults to the one named by CURRENT.
+
+        Returns:
+            Optional[dict]: 'seq', 'segments' (directory names, by ascending ids), 'cursor',
+                'next_id' and 'removed' (vector ids), or None if no snapshot exists.
+
+        Raises:
+            FileNotFoundError: If the manifest is gone.
+        """
+        seq = self._read_current() if seq is None else seq
+        if not seq:
+            return None
+        with open(self._path(f"manifest-{seq}.json")) as f:
+            return {**json.load(f), "seq": seq}
+
+    def open_segment(self, name: str) -> Segment:
+        """Map a segment of the directory.
+
+        Args:
+            name (str): Segment directory name from a manifest.
+
+        Returns:
+            Segment: The mapped segment.
+
+        Raises:
+            FileNotFoundError: If the segment is gone.
+        """
+        return Segment(self._path(name))
+
+    def _next_segment(self) -> int:
+        numbers = [int(match.group(1)) for match in map(SEGMENT_RE.fullmatch, os.listdir(self.directory)) if match]
+        return max(numbers, default=0) + 1
+
+    def write_segment(self, index: faiss.Index, passages: Iterable[Tuple[int, dict]], start: int, end: int,
+                      lexical: LexicalIndex, replaces: Iterable[Segment] = (),
+                      removed: Iterable[int] = ()) -> Segment:
+        """Write a new segment and map it.
+
+        The files are written into a temporary directory that is renamed once
+        complete, so a segment is never seen half-written.
+
+        Args:
+            index (faiss.Index): ID-mapped vectors of the passages.
+            passages (Iterable[Tuple[int, dict]]): Vector id and metadata of each passage, by ascending id.
+            start (int): Lowest vector id the segment covers.
+            end (int): One past the highest vector id it covers.
+            lexical (LexicalIndex): BM25 index holding the passages, in memory or in the replaced segments.
+            replaces (Iterable[Segment]): Segments whose passages the new one takes over.
+            removed (Iterable[int]): Ids of removed passages to leave out of the BM25 postings.
+
+        Returns:
+            Segment: The new segment.
+        """
+        name = f"segment-{self._next_segment()}"
+        temporary = self._path(f".{name}.tmp")
+        os.makedirs(temporary)
+        try:
+            faiss.write_index(index, os.path.join(temporary, "index.faiss"))
+            Segment.write_passages(temporary, passages)
+            lexical.write(temporary, start, end, [segment.lexical for segment in replaces], removed)
+            with open(os.path.join(temporary, "segment.json"), "w") as f:
+                json.dump({"start": start, "end": end}, f)
+            os.rename(temporary, self._path(name))
+        except BaseException:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        logger.info(f"Wrote index segment {name} with {index.ntotal} vectors")
+        return self.open_segment(name)
+
+    def publish(self, segments: List[str], cursor: str, next_id: int, removed: List[int],
+                previous: int) -> Optional[int]:
+        """Write a manifest and make it the newest snapshot.
+
+        Manifests older than the previous one, and segments neither of the two
+        newest manifests names, are removed once the CURRENT pointer has been
+        replaced.
+
+        Args:
+            segments (List[str]): Segment names, by ascending ids.
+            cursor (str): Change stream id of the last entry the snapshot includes.
+            next_id (int): Vector id the entry after the cursor continues at.
+            removed (List[int]): Ids of removed passages still in the segments.
+            previous (int): Sequence number of the snapshot the new one was made from.
+
+        Returns:
+            Optional[int]: Sequence number of the new snapshot, or None if another
+                snapshot was written after previous.
+        """
+        if self._read_current() != previous:
+            return None
+        seq = previous + 1
+        with open(self._path(f"manifest-{seq}.json.tmp"), "w") as f:
+            json.dump({"segments": segments, "cursor": cursor, "next_id": next_id, "removed": removed}, f)
+        os.replace(self._path(f"manifest-{seq}.json.tmp"), self._path(f"manifest-{seq}.json"))
+        self._set_current(seq)
+        self._prune(seq)
+        logger.info(f"Wrote index snapshot {seq} with {len(segments)} segments")
+        return seq
+
+    def _set_current(self, seq: int):
+        with open(self._path("CURRENT.tmp"), "w") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._path("CURRENT.tmp"), self._path("CURRENT"))
+
+    def _prune(self, seq: int):
+        """Remove manifests older than the one before seq and the segments no kept manifest names."""
+        kept = set()
+        for keep in (seq - 1, seq):
+            try:
+                kept.update(self.read_manifest(keep)["segments"] if keep else ())
+            except FileNotFoundError:
+                pass
+        newest = max((int(SEGMENT_RE.fullmatch(name).group(1)) for name in kept), default=0)
+        for name in os.listdir(self.directory):
+            manifest, segment = MANIFEST_RE.fullmatch(name), SEGMENT_RE.fullmatch(name)
+            try:
+                if manifest and int(manifest.group(1)) < seq - 1:
+                    os.remove(self._path(name))
+                elif segment and name not in kept and int(segment.group(1)) <= newest:
+                    shutil.rmtree(self._path(name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,148 @@
+import time
+from collections import Counter
+from typing import List, Tuple
+import numpy as np
+from utils.logger import setup_logging
+
+logger = setup_logging()
+
+EMBED_MODEL = "all-MiniLM-L6-v2"
+QA_MODEL = "distilbert-base-cased-distilled-squad"
+BACKENDS = ("torch", "int8", "onnx")
+
+EVAL_SET: List[Tuple[str, str]] = [
+    ("Jane Doe worked as a Finance Manager at Acme Corp from 03/2017 to 05/2021, "
+     "where she led a team of six analysts and owned the annual budget.",
+     "What was her job title at Acme Corp?"),
+    ("Education: Bachelor of Science in Accounting, University of Texas, 2012. "
+     "Certified Public Accountant since 2014.",
+     "Where did the candidate study?"),
+    ("Skills include Python, SQL, Tableau and financial modeling. "
+     "Languages: English (native), Spanish (fluent).",
+     "Which languages does the candidate speak?"),
+    ("Senior Software Engineer, Globex, 2019 - present. Designed a payments platform "
+     "processing 2 million transactions per day using Go and PostgreSQL.",
+     "How many transactions per day does the platform process?"),
+    ("Registered Nurse with 8 years of experience in intensive care units at "
+     "St. Mary's Hospital in Chicago, Illinois.",
+     "How many years of experience does the nurse have?"),
+    ("Project Manager at Initech from January 2015 to December 2018. Delivered 14 "
+     "ERP rollouts on time and under budget.",
+     "When did the candidate start at Initech?"),
+    ("Certifications: PMP (2016), AWS Certified Solutions Architect (2020), "
+     "Six Sigma Green Belt (2013).",
+     "Which AWS certification does the candidate hold?"),
+    ("Sales Associate at Target, 2010 - 2013. Promoted to Store Manager at Target "
+     "in Denver in 2014, managing 45 employees.",
+     "How many employees did the store manager manage?")
+]
+
+def _quantize_dynamic(model):
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def load_embedder(backend: str = "torch"):
+    """Load the sentence embedding model with the given inference backend.
+
+    Args:
+        backend (str): 'torch' for fp32 PyTorch, 'int8' for dynamically quantized
+            linear layers, 'onnx' for an exported ONNX Runtime graph.
+
+    Returns:
+        SentenceTransformer: Embedding model.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(EMBED_MODEL)
+    if backend == "int8":
+        model = SentenceTransformer(EMBED_MODEL)
+        model[0].auto_model = _quantize_dynamic(model[0].auto_model)
+        return model
+    if backend == "onnx":
+        return SentenceTransformer(EMBED_MODEL, backend="onnx")
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def load_qa(backend: str = "torch"):
+    """Load the extractive question-answering pipeline with the given inference backend.
+
+    Args:
+        backend (str): 'torch', 'int8' or 'onnx', as in load_embedder. The ONNX
+            backend needs the optional 'optimum[onnxruntime]' package.
+
+    Returns:
+        pipeline: Question-answering pipeline from transformers.
+
+    Raises:
+        ValueError: If the backend is unknown.
+    """
+    from transformers import AutoModelForQuestionAnswering, AutoTokenizer, pipeline
+    if backend == "torch":
+        return pipeline("question-answering", model=QA_MODEL)
+    tokenizer = AutoTokenizer.from_pretrained(QA_MODEL)
+    if backend == "int8":
+        model = _quantize_dynamic(AutoModelForQuestionAnswering.from_pretrained(QA_MODEL))
+    elif backend == "onnx":
+        from optimum.onnxruntime import ORTModelForQuestionAnswering
+        model = ORTModelForQuestionAnswering.from_pretrained(QA_MODEL, export=True)
+    else:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    return pipeline("question-answering", model=model, tokenizer=tokenizer)
+
+def _token_f1(prediction: str, reference: str) -> float:
+    predicted, expected = prediction.lower().split(), reference.lower().split()
+    common = sum((Counter(predicted) & Counter(expected)).values())
+    if not predicted or not expected or not common:
+        return float(predicted == expected)
+    precision, recall = common / len(predicted), common / len(expected)
+    return 2 * precision * recall / (precision + recall)
+
+def check_parity(embed_backend: str, qa_backend: str) -> dict:
+    """Compare a backend pair against fp32 PyTorch on the fixed evaluation set.
+
+    Embeddings of every context and question are compared by cosine
+    similarity; answers by exact match and token F1 against the fp32 answer.
+
+    Args:
+        embed_backend (str): Backend of the embedding model under test.
+        qa_backend (str): Backend of the QA pipeline under test.
+
+    Returns:
+        dict: 'embedding' with min/mean cosine and speedup, 'qa' with exact
+            match, mean F1 and speedup, and the per-question 'answers'.
+    """
+    texts = [text for pair in EVAL_SET for text in pair]
+    contexts = [context for context, _ in EVAL_SET]
+    questions = [question for _, question in EVAL_SET]
+
+    def run_embedder(backend):
+        model = load_embedder(backend)
+        model.encode(texts[:2], normalize_embeddings=True)
+        started = time.perf_counter()
+        embeddings = model.encode(texts, normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32), time.perf_counter() - started
+
+    def run_qa(backend):
+        qa = load_qa(backend)
+        qa(question=questions[0], context=contexts[0])
+        started = time.perf_counter()
+        outputs = qa(question=questions, context=contexts)
+        return [output["answer"] for output in outputs], time.perf_counter() - started
+
+    reference_embeddings, reference_embed_time = run_embedder("torch")
+    embeddings, embed_time = run_embedder(embed_backend)
+    cosines = np.sum(reference_embeddings * embeddings, axis=1)
+    reference_answers, reference_qa_time = run_qa("torch")
+    answers, qa_time = run_qa(qa_backend)
+    f1_scores = [_token_f1(answer, reference) for answer, reference in zip(answers, reference_answers)]
+    return {
+        "embedding": {"backend": embed_backend, "min_cosine": float(cosines.min()),
+                      "mean_cosine": float(cosines.mean()), "speedup": reference_embed_time / embed_time},
+        "qa": {"backend": qa_backend,
+               "exact_match": sum(a == r for a, r in zip(answers, reference_answers)) / len(answers),
+               "mean_f1": float(np.mean(f1_scores)), "speedup": reference_qa_time / qa_time},
+        "answers": [{"question": q, "reference": r, "answer": a}
+                    for q, r, a in zip(questions, reference_answers, answers)]
+    }
@@ -0,0 +1,104 @@
+import os
+import time
+from typing import List, Tuple
+from utils.config import INGEST_NICE
+from utils.logger import setup_logging
+from .document_service import build_strategies, select_strategy, file_hash
+from .model_registry import model_registry
+from .ner_service import NERService
+from .rag_service import encode_documents
+
+logger = setup_logging()
+
+_strategies = None
+
+def init_worker():
+    """Set up extraction strategies and start loading the embedding, OCR and NER models in the background.
+
+    The process runs at INGEST_NICE niceness, so the API process answering /ask gets the CPU first.
+    PDFs are extracted in-process: the ingest workers already run files in
+    parallel, and a page pool in every worker would multiply the processes.
+    """
+    global _strategies
+    if INGEST_NICE > 0:
+        try:
+            os.nice(INGEST_NICE)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Could not lower ingestion worker priority: {str(e)}")
+    _strategies = build_strategies(model_registry, pdf_workers=1)
+    model_registry.preload(["embedder", "ocr", "ner"])
+
+def init_extraction_worker():
+    """Set up extraction strategies once per worker process, without the embedding model.
+
+    PDFs are extracted in-process, as in init_worker.
+    """
+    global _strategies
+    _strategies = build_strategies(model_registry, pdf_workers=1)
+
+def extract_file(path: str) -> dict:
+    """Read, hash and extract a file inside a worker process.
+
+    Args:
+        path (str): Path of the file; its basename is used as the filename.
+
+    Returns:
+        dict: 'path', 'filename', 'content_id' and 'pages'.
+    """
+    filename = os.path.basename(path)
+    pages = select_strategy(_strategies, filename).extract_pages(path)
+    return {"path": path, "filename": filename, "content_id": file_hash(path), "pages": pages}
+
+def process_files(uploads: List[Tuple[str, str]]) -> dict:
+    """Extract and embed several spooled uploads inside a worker process.
+
+    Files handled by the same strategy are extracted together, so images of
+    one upload share OCR batches, and all passages are embedded in one call
+    and tagged with entities in one nlp.pipe pass.
+    If a shared batch fails, its files are retried one by one so a single bad
+    file does not fail the others.
+
+    Args:
+        uploads (List[Tuple[str, str]]): Original filename and spooled path of each upload.
+
+    Returns:
+        dict: 'results', for each upload 'filename', 'pages', 'passages', 'vectors' and 'entities'
+            for DocumentService.store_processed, or 'filename' and 'error' if it failed; and
+            'timings', seconds spent in each stage, for the metrics of the API process.
+    """
+    timings = {}
+    results = [{"filename": filename} for filename, _ in uploads]
+    groups = {}
+    for position, (filename, _) in enumerate(uploads):
+        try:
+            strategy = select_strategy(_strategies, filename)
+        except ValueError as e:
+            results[position]["error"] = str(e)
+            continue
+        groups.setdefault(id(strategy), (strategy, []))[1].append(position)
+    for strategy, positions in groups.values():
+        started = time.perf_counter()
+        try:
+            extracted = strategy.extract_pages_batch([uploads[position][1] for position in positions])
+        except Exception:
+            extracted = []
+            for position in positions:
+                try:
+                    extracted.append(strategy.extract_pages(uploads[position][1]))
+                except Exception as e:
+                    results[position]["error"] = str(e)
+                    extracted.append(None)
+        for position, pages in zip(positions, extracted):
+            if pages is not None:
+                results[position]["pages"] = pages
+        timings[f"extract_{strategy.name}"] = time.perf_counter() - started
+    extracted = [result for result in results if "error" not in result]
+    started = time.perf_counter()
+    encoded = encode_documents(model_registry.get("embedder"), [result["pages"] for result in extracted])
+    timings["embed"] = time.perf_counter() - started
+    started = time.perf_counter()
+    entities = NERService(model_registry).annotate_documents([passages for passages, _ in encoded])
+    timings["ner"] = time.perf_counter() - started
+    for result, (passages, vectors), spans in zip(extracted, encoded, entities):
+        result.update(passages=passages, vectors=vectors, entities=spans)
+    return {"results": results, "timings": timings}
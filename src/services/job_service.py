@@ -0,0 +1,346 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Tuple
+from utils.config import INGEST_WORKERS, INGEST_QUEUE_DEPTH, SPOOL_DIR, JOB_TTL, OCR_BATCH_SIZE
+from utils.logger import setup_logging
+from utils.metrics import observe_stage
+from .collection_service import Collection, CollectionNotFoundError, CollectionService
+from .document_service import IMAGE_EXTENSIONS
+from .executor import PriorityExecutor, PRIORITY_BATCH
+from .ingest_worker import init_worker, process_files
+
+logger = setup_logging()
+
+class QueueFullError(RuntimeError):
+    """Raised when the ingestion queue has no room for another job."""
+
+class JobService:
+    """Service for asynchronous document ingestion.
+
+    Uploads arrive spooled to disk and are queued, each for the collection
+    it was uploaded to. A pool of worker processes runs
+    extraction and embedding, so the API process never runs model inference
+    for uploads. Finished results are handed to a single commit thread that
+    writes them to Redis and the FAISS index. Given a PriorityExecutor, the
+    commit thread runs each commit on it at batch priority, so queued /ask
+    batches go first; commits still happen one at a time, in order.
+
+    Job status moves from 'queued' to 'running' to 'done' or 'failed'.
+    Uploads whose content is already indexed or cached are 'done' right away
+    and marked 'deduplicated'. Finished jobs are forgotten after job_ttl seconds.
+    Images submitted together are processed together, so they share OCR batches.
+    Each queued job pins its collection until it is committed, so the
+    collection stays open; a job whose collection was dropped meanwhile fails.
+
+    If a worker process dies (e.g. killed for running out of memory on a bad
+    PDF), the jobs the pool was running or holding fail and a new pool is
+    started for later uploads.
+
+    Attributes:
+        collections (CollectionService): Collections processed documents are stored into.
+        workers (int): Number of extraction and embedding worker processes.
+        max_queue (int): Maximum number of unfinished jobs.
+        spool_dir (str): Directory for spooled upload content.
+        job_ttl (float): Seconds a finished job stays queryable.
+        group_size (int): Maximum number of images processed together by one worker.
+        executor (Optional[PriorityExecutor]): Runs the commits; None runs them on the commit thread.
+        jobs (dict): Job records keyed by job id.
+    """
+    def __init__(self, collections: CollectionService, workers: int = INGEST_WORKERS,
+                 max_queue: int = INGEST_QUEUE_DEPTH, spool_dir: str = SPOOL_DIR, job_ttl: float = JOB_TTL,
+                 group_size: int = OCR_BATCH_SIZE, executor: Optional[PriorityExecutor] = None):
+        """Initialize JobService and start the worker pool.
+
+        Args:
+            collections (CollectionService): Collections processed documents are stored into.
+            workers (int): Number of extraction and embedding worker processes.
+            max_queue (int): Maximum number of unfinished jobs.
+            spool_dir (str): Directory for spooled upload content.
+            job_ttl (float): Seconds a finished job stays queryable.
+            group_size (int): Maximum number of images processed together by one worker.
+            executor (Optional[PriorityExecutor]): Runs the commits; None runs them on the commit thread.
+        """
+        self.collections = collections
+        self.workers = workers
+        self.max_queue = max_queue
+        self.spool_dir = spool_dir
+        self.job_ttl = job_ttl
+        self.group_size = group_size
+        self.executor = executor
+        self.jobs = {}
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._pool_lock = threading.Lock()
+        os.makedirs(spool_dir, exist_ok=True)
+        self._executor = self._start_pool()
+        self._committer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-commit")
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_pool(self, broken: ProcessPoolExecutor):
+        """Start a new worker pool in place of a broken one, unless that already happened."""
+        with self._pool_lock:
+            if self._executor is not broken:
+                return
+            logger.error("An ingestion worker process died; starting a new worker pool")
+            self._executor = self._start_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _process(self, files: List[Tuple[str, str]]) -> Tuple[ProcessPoolExecutor, Future]:
+        """Hand files to the worker pool, replacing the pool first if it is broken.
+
+        Returns:
+            Tuple[ProcessPoolExecutor, Future]: Pool the files were submitted to and the future of process_files.
+        """
+        pool = self._executor
+        try:
+            return pool, pool.submit(process_files, files)
+        except BrokenProcessPool:
+            self._replace_pool(pool)
+            pool = self._executor
+            return pool, pool.submit(process_files, files)
+
+    def pending(self) -> int:
+        """Return the number of jobs that are queued or running."""
+        with self._lock:
+            return self._unfinished()
+
+    def _unfinished(self) -> int:
+        return sum(1 for job in self.jobs.values() if job["status"] in ("queued", "running"))
+
+    def submit(self, filename: str, path: str, content_id: str, collection: Optional[Collection] = None) -> str:
+        """Queue a spooled upload for ingestion.
+
+        The job takes ownership of the spool file and removes it when done.
+
+        Args:
+            filename (str): Name of the uploaded file.
+            path (str): Path of the spooled file content, inside spool_dir.
+            content_id (str): Content hash of the upload.
+            collection (Optional[Collection]): Collection to store the document into, pinned by the
+                caller. Defaults to the default collection.
+
+        Returns:
+            str: Id of the new job.
+
+        Raises:
+            QueueFullError: If max_queue jobs are already unfinished.
+        """
+        return self.submit_many([(filename, path, content_id)], collection)[0]
+
+    def submit_many(self, uploads: List[Tuple[str, str, str]], collection: Optional[Collection] = None) -> List[str]:
+        """Queue the spooled files of one upload for ingestion.
+
+        Each file gets its own job, but images are handed to the workers in
+        groups of up to group_size so they share OCR batches. The queue must
+        have room for every file before anything is stored, so a rejected
+        upload leaves nothing behind, not even its duplicates; these count
+        against the limit even though they complete right away. Room is
+        reserved under the job lock before anything else happens, so
+        concurrent uploads cannot overfill the queue together, and handed
+        back if the upload fails. The jobs take ownership of the spool files
+        and remove them when done; files of an upload that is rejected or
+        fails before its jobs are registered are removed right away.
+
+        Args:
+            uploads (List[Tuple[str, str, str]]): Filename, spooled path inside
+                spool_dir and content hash of each file.
+            collection (Optional[Collection]): Collection to store the documents into, pinned by the
+                caller. Defaults to the default collection.
+
+        Returns:
+            List[str]: Id of each new job, in order.
+
+        Raises:
+            QueueFullError: If the unfinished jobs plus the new ones exceed max_queue.
+        """
+        self._prune()
+        unregistered = {path for _, path, _ in uploads}
+        with self._lock:
+            full = self._unfinished() + self._reserved + len(uploads) > self.max_queue
+            if not full:
+                self._reserved += len(uploads)
+        reserved = 0 if full else len(uploads)
+        pinned = None
+        try:
+            if full:
+                raise QueueFullError("Ingestion queue is full")
+            if collection is None:
+                collection = self.collections.get(self.collections.default, pin=True)
+            else:
+                self.collections.pin([collection])
+            pinned = collection
+            job_ids, fresh = [], []
+            for filename, path, content_id in uploads:
+                job_id = uuid.uuid4().hex
+                job = {"job_id": job_id, "filename": filename, "content_id": content_id, "collection": collection,
+                       "status": "queued", "error": None, "deduplicated": False, "created": time.time(),
+                       "finished": None, "path": path, "future": None, "completed": Future()}
+                job_ids.append(job_id)
+                if self._committer.submit(collection.document_service.store_cached, filename, content_id).result():
+                    job.update(status="done", deduplicated=True, finished=time.time())
+                    job["completed"].set_result(job_id)
+                    with self._lock:
+                        self.jobs[job_id] = job
+                        self._reserved -= 1
+                    reserved -= 1
+                else:
+                    fresh.append(job)
+            images = [job for job in fresh if job["filename"].lower().endswith(IMAGE_EXTENSIONS)]
+            groups = [[job] for job in fresh if not job["filename"].lower().endswith(IMAGE_EXTENSIONS)]
+            groups.extend(images[offset:offset + self.group_size]
+                          for offset in range(0, len(images), self.group_size))
+            for group in groups:
+                with self._lock:
+                    self.jobs.update((job["job_id"], job) for job in group)
+                    self._reserved -= len(group)
+                reserved -= len(group)
+                self.collections.pin([collection] * len(group))
+                try:
+                    pool, future = self._process([(job["filename"], job["path"]) for job in group])
+                except BaseException:
+                    with self._lock:
+                        for job in group:
+                            del self.jobs[job["job_id"]]
+                    self.collections.unpin([collection] * len(group))
+                    raise
+                unregistered.difference_update(job["path"] for job in group)
+                group_ids = [job["job_id"] for job in group]
+                for job in group:
+                    job["future"] = future
+                future.add_done_callback(lambda done, ids=group_ids, pool=pool:
+                                         self._committer.submit(self._commit, ids, done, pool))
+            return job_ids
+        finally:
+            if pinned is not None:
+                self.collections.unpin([pinned])
+            if reserved:
+                with self._lock:
+                    self._reserved -= reserved
+            for path in unregistered:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def delete(self, doc_id: str, collection: Collection) -> Optional[dict]:
+        """Delete a document on the commit thread, so it is ordered with the commits of running jobs.
+
+        Args:
+            doc_id (str): Content id of the document, or a filename pointing at it.
+            collection (Collection): Collection holding the document.
+
+        Returns:
+            Optional[dict]: Result of DocumentService.delete_document, None if the document is unknown.
+        """
+        return self._committer.submit(collection.document_service.delete_document, doc_id).result()
+
+    def wait(self, job_id: str) -> Future:
+        """Get a future that resolves to the job id once the job is done or failed.
+
+        Args:
+            job_id (str): Job id returned by submit.
+
+        Returns:
+            Future: Completion future of the job.
+
+        Raises:
+            KeyError: If the job is unknown.
+        """
+        return self.jobs[job_id]["completed"]
+
+    def collection(self, job_id: str) -> Optional[Collection]:
+        """Get the collection a job stores its document into.
+
+        Args:
+            job_id (str): Job id returned by submit.
+
+        Returns:
+            Optional[Collection]: Collection of the job, or None if the job is unknown.
+        """
+        job = self.jobs.get(job_id)
+        return job["collection"] if job is not None else None
+
+    def _commit(self, job_ids: List[str], future: Future, pool: ProcessPoolExecutor):
+        try:
+            output = future.result()
+            results = output["results"]
+            for stage, seconds in output["timings"].items():
+                observe_stage(stage, seconds)
+        except BrokenProcessPool:
+            self._replace_pool(pool)
+            results = [{"error": "Ingestion worker process died"}] * len(job_ids)
+        except Exception as e:
+            results = [{"error": str(e)}] * len(job_ids)
+        for job_id, result in zip(job_ids, results):
+            if self.executor is None:
+                self._commit_one(job_id, result)
+            else:
+                self.executor.submit(self._commit_one, job_id, result, priority=PRIORITY_BATCH).result()
+
+    def _commit_one(self, job_id: str, result: dict):
+        job = self.jobs[job_id]
+        collection = job["collection"]
+        document_service = collection.document_service
+        try:
+            if "error" in result:
+                raise ValueError(result["error"])
+            if not self.collections.is_live(collection):
+                raise CollectionNotFoundError(f"Collection {collection.name} was dropped")
+            if document_service.store_cached(job["filename"], job["content_id"]):
+                job["deduplicated"] = True
+            else:
+                document_service.store_processed(job["filename"], job["content_id"], result["pages"],
+                                                 result["passages"], result["vectors"], entities=result["entities"])
+            job["status"] = "done"
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} for {job['filename']} failed: {str(e)}")
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished"] = time.time()
+            job["completed"].set_result(job_id)
+            self.collections.unpin([collection])
+            try:
+                os.remove(job["path"])
+            except FileNotFoundError:
+                pass
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self.jobs.items()
+                           if job["finished"] is not None and job["finished"] < cutoff]:
+                del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Get the public status of a job.
+
+        Args:
+            job_id (str): Job id returned by submit.
+
+        Returns:
+            Optional[dict]: 'job_id', 'collection', 'filename', 'content_id', 'status',
+                'deduplicated' and 'error', or None if unknown.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        status = job["status"]
+        if status == "queued" and job["future"] is not None and job["future"].running():
+            status = "running"
+        return {"job_id": job_id, "collection": job["collection"].name, "filename": job["filename"],
+                "content_id": job["content_id"], "status": status, "deduplicated": job["deduplicated"],
+                "error": job["error"]}
+
+    def close(self):
+        """Cancel queued jobs and wait for running ones to be stored."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._committer.shutdown(wait=True)
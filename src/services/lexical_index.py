@@ -0,0 +1,383 @@
+import bisect
+import math
+import os
+import re
+import threading
+from array import array
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+[+#]*")
+STOPWORDS = frozenset(("a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+                       "it", "of", "on", "or", "that", "the", "to", "was", "were", "with"))
+QUESTION_WORDS = frozenset(("what", "who", "whom", "whose", "when", "where", "which", "why", "how", "does", "did",
+                            "do", "is", "are", "was", "were", "can", "could", "should", "list", "describe"))
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase word tokens, dropping stopwords.
+
+    Args:
+        text (str): Text to tokenize.
+
+    Returns:
+        List[str]: Tokens in order of appearance.
+    """
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+def is_keyword_query(text: str, max_tokens: int) -> bool:
+    """Tell whether a query is a keyword lookup rather than a natural-language question.
+
+    Args:
+        text (str): Query text.
+        max_tokens (int): Longest query, in words, that counts as keywords.
+
+    Returns:
+        bool: True for short queries without a question mark or leading question word.
+    """
+    words = TOKEN_RE.findall(text.lower())
+    return bool(words) and len(words) <= max_tokens and "?" not in text and words[0] not in QUESTION_WORDS
+
+LEXICAL_ARRAYS = ("terms", "offsets", "postings", "frequencies", "lengths")
+
+def write_lexical(directory: str, sources: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]], start: int,
+                  lengths: np.ndarray):
+    """Merge postings in CSR layout into the lexical files of a segment directory.
+
+    Postings of passages outside [start, start + len(lengths)) or with
+    length 0 are dropped.
+
+    Args:
+        directory (str): Segment directory.
+        sources (List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]): Terms, term offsets,
+            passage ids and term frequencies of each part to merge.
+        start (int): Lowest passage id of the segment.
+        lengths (np.ndarray): Token count of each passage id from start on; 0 leaves the passage out.
+    """
+    lengths = np.asarray(lengths, dtype=np.uint32)
+    terms = [np.asarray(source[0], dtype=str) for source in sources]
+    vocabulary, inverse = np.unique(np.concatenate(terms) if terms else np.empty(0, dtype=str), return_inverse=True)
+    term_ids, ids, frequencies = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0, np.uint16)]
+    position = 0
+    for (_, offsets, postings, counts), source_terms in zip(sources, terms):
+        term_ids.append(np.repeat(inverse[position:position + len(source_terms)], np.diff(offsets)))
+        position += len(source_terms)
+        ids.append(np.asarray(postings, dtype=np.int64))
+        frequencies.append(np.asarray(counts, dtype=np.uint16))
+    term_ids, ids, frequencies = np.concatenate(term_ids), np.concatenate(ids), np.concatenate(frequencies)
+    keep = (ids >= start) & (ids < start + len(lengths))
+    keep[keep] = lengths[ids[keep] - start] > 0
+    term_ids, ids, frequencies = term_ids[keep], ids[keep], frequencies[keep]
+    order = np.lexsort((ids, term_ids))
+    counts = np.bincount(term_ids, minlength=len(vocabulary))
+    used = counts > 0
+    offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+    np.cumsum(counts[used], out=offsets[1:])
+    arrays = {"terms": vocabulary[used], "offsets": offsets, "postings": ids[order].astype(np.uint32),
+              "frequencies": frequencies[order], "lengths": lengths}
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"lexical_{name}.npy"), values)
+
+class LexicalSegment:
+    """BM25 postings of the passages of one index segment, memory-mapped read-only.
+
+    The files written by write_lexical hold, in CSR layout, the sorted terms,
+    where the postings of each term start, the passage ids (uint32, ascending
+    per term) with their term frequencies (uint16), and the token count of
+    each passage id from start on.
+
+    Attributes:
+        start (int): Lowest passage id covered.
+        end (int): One past the highest passage id covered.
+        lengths (np.ndarray): Token count of each passage id from start on.
+        live (int): Passages with at least one token.
+        total_length (int): Tokens of all passages.
+    """
+    def __init__(self, directory: str, start: int):
+        """Map the lexical files of a segment directory.
+
+        Args:
+            directory (str): Segment directory.
+            start (int): Lowest passage id the segment covers.
+        """
+        arrays = {name: np.load(os.path.join(directory, f"lexical_{name}.npy"), mmap_mode="r")
+                  for name in LEXICAL_ARRAYS}
+        self.terms, self.offsets = arrays["terms"], arrays["offsets"]
+        self.postings, self.frequencies = arrays["postings"], arrays["frequencies"]
+        self.lengths = arrays["lengths"]
+        self.start = start
+        self.end = start + len(self.lengths)
+        self.live = int(np.count_nonzero(self.lengths))
+        self.total_length = int(self.lengths.sum(dtype=np.int64))
+
+    def lookup(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Get the postings of a term.
+
+        Args:
+            term (str): Token from tokenize.
+
+        Returns:
+            Optional[Tuple[np.ndarray, np.ndarray]]: Passage ids and term frequencies, or None if no passage has it.
+        """
+        slot = int(np.searchsorted(self.terms, term))
+        if slot >= len(self.terms) or str(self.terms[slot]) != term:
+            return None
+        begin, end = self.offsets[slot], self.offsets[slot + 1]
+        return self.postings[begin:end], self.frequencies[begin:end]
+
+    def length(self, passage_id: int) -> int:
+        """Get the token count of a passage, 0 if the segment does not hold it."""
+        return int(self.lengths[passage_id - self.start]) if self.start <= passage_id < self.end else 0
+
+    def csr(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]: Terms, offsets, postings and frequencies."""
+        return self.terms, self.offsets, self.postings, self.frequencies
+
+class LexicalIndex:
+    """BM25 inverted index over the passages of the FAISS index.
+
+    Passage ids are FAISS vector ids, so lexical and vector hits refer to
+    the same passages. The passages of snapshot segments are searched in
+    their memory-mapped LexicalSegment; only the passages added since the
+    newest snapshot, with ids from start on, are held in memory. There each
+    term has two append-only arrays, the ids of passages containing it
+    (uint32, ascending) and the term frequencies (uint16). Scores use the
+    statistics of all parts together.
+
+    Removed passages are skipped by search. In memory they get length 0 and
+    their postings stay until compact() rewrites the lists; in a segment
+    they are kept in a removed set until a snapshot rewrites the segment.
+
+    Attributes:
+        k1 (float): BM25 term frequency saturation.
+        b (float): BM25 length normalization.
+        segments (List[LexicalSegment]): Postings of the snapshot segments.
+        start (int): Lowest passage id held in memory.
+        lengths (array): Token count of each passage id from start on; 0 for ids never added or removed.
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Initialize an empty LexicalIndex.
+
+        Args:
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self.segments: List[LexicalSegment] = []
+        self.start = 0
+        self.lengths = array("I")
+        self._terms = {}
+        self._postings: List[array] = []
+        self._frequencies: List[array] = []
+        self._total_length = 0
+        self._live = 0
+        self._removed = set()
+        self._removed_ids = None
+        self._removed_length = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """int: Number of passage ids covered, one past the highest id added."""
+        return self.start + len(self.lengths)
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]):
+        """Index passages under ascending ids, each greater than any id added before.
+
+        Args:
+            ids (Iterable[int]): Passage ids (FAISS vector ids).
+            texts (Iterable[str]): Text of each passage.
+
+        Raises:
+            ValueError: If an id is not greater than the ids already indexed.
+        """
+        with self._lock:
+            for passage_id, text in zip(ids, texts):
+                if passage_id < self.size:
+                    raise ValueError(f"Passage id {passage_id} is already indexed")
+                self.lengths.extend([0] * (passage_id - self.size))
+                counts = {}
+                tokens = tokenize(text)
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, count in counts.items():
+                    term_id = self._terms.get(token)
+                    if term_id is None:
+                        term_id = self._terms[token] = len(self._postings)
+                        self._postings.append(array("I"))
+                        self._frequencies.append(array("H"))
+                    self._postings[term_id].append(passage_id)
+                    self._frequencies[term_id].append(min(count, 0xFFFF))
+                self.lengths.append(len(tokens))
+                self._total_length += len(tokens)
+                self._live += bool(tokens)
+
+    def remove(self, ids: Iterable[int]):
+        """Exclude passages from search.
+
+        Args:
+            ids (Iterable[int]): Passage ids; unknown or already removed ids are ignored.
+        """
+        with self._lock:
+            for passage_id in ids:
+                self._remove(passage_id)
+
+    def _remove(self, passage_id: int):
+        if passage_id >= self.start:
+            position = passage_id - self.start
+            if position < len(self.lengths) and self.lengths[position]:
+                self._total_length -= self.lengths[position]
+                self._live -= 1
+                self.lengths[position] = 0
+            return
+        if passage_id in self._removed:
+            return
+        for segment in self.segments:
+            length = segment.length(passage_id)
+            if length:
+                self._removed.add(passage_id)
+                self._removed_ids = None
+                self._removed_length += length
+                return
+
+    def compact(self):
+        """Drop the in-memory postings of removed passages."""
+        with self._lock:
+            lengths = np.array(self.lengths, dtype=np.uint32)
+            for term_id, postings in enumerate(self._postings):
+                ids = np.array(postings, dtype=np.int64)
+                keep = lengths[ids - self.start] > 0
+                if not keep.all():
+                    self._postings[term_id] = array("I", ids[keep].astype(np.uint32).tobytes())
+                    self._frequencies[term_id] = array("H", np.array(self._frequencies[term_id],
+                                                                     dtype=np.uint16)[keep].tobytes())
+
+    def replace(self, segments: List[LexicalSegment], end: int, removed: Iterable[int] = ()):
+        """Switch to the segments of a new snapshot and drop the in-memory passages they cover.
+
+        Args:
+            segments (List[LexicalSegment]): Postings of the snapshot's segments.
+            end (int): One past the highest passage id the snapshot covers.
+            removed (Iterable[int]): Ids of removed passages in the segments.
+        """
+        with self._lock:
+            if end > self.start:
+                drop = min(end - self.start, len(self.lengths))
+                dropped = np.array(self.lengths[:drop], dtype=np.int64)
+                self._total_length -= int(dropped.sum())
+                self._live -= int(np.count_nonzero(dropped))
+                del self.lengths[:drop]
+                terms, postings, frequencies = {}, [], []
+                for term, term_id in self._terms.items():
+                    cut = bisect.bisect_left(self._postings[term_id], end)
+                    if cut < len(self._postings[term_id]):
+                        terms[term] = len(postings)
+                        postings.append(self._postings[term_id][cut:])
+                        frequencies.append(self._frequencies[term_id][cut:])
+                self._terms, self._postings, self._frequencies = terms, postings, frequencies
+                self.start = end
+            self.segments = list(segments)
+            self._removed, self._removed_ids, self._removed_length = set(), None, 0
+            for passage_id in removed:
+                self._remove(passage_id)
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Find the passages with the highest BM25 score for a query.
+
+        Args:
+            query (str): Query text.
+            k (int): Maximum number of passages to return.
+
+        Returns:
+            List[Tuple[int, float]]: Passage id and BM25 score, best first.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            segments = self.segments
+            count = self._live + sum(segment.live for segment in segments) - len(self._removed)
+            total_length = (self._total_length + sum(segment.total_length for segment in segments)
+                            - self._removed_length)
+            if count <= 0 or total_length <= 0:
+                return []
+            if self._removed_ids is None and self._removed:
+                self._removed_ids = np.array(sorted(self._removed), dtype=np.int64)
+            removed = self._removed_ids if self._removed else None
+            start = self.start
+            matched = {term: [(np.array(self._postings[term_id], dtype=np.int64),
+                               np.array(self._frequencies[term_id], dtype=np.float32))]
+                       for term, term_id in ((term, self._terms.get(term)) for term in terms) if term_id is not None}
+            lengths = np.array(self.lengths, dtype=np.float32)
+        average_length = total_length / count
+        parts = {term: [(ids, frequencies, lengths[ids - start]) for ids, frequencies in found]
+                 for term, found in matched.items()}
+        for segment in segments:
+            for term in terms:
+                found = segment.lookup(term)
+                if found is not None:
+                    ids = found[0].astype(np.int64)
+                    passage_lengths = segment.lengths[ids - segment.start].astype(np.float32)
+                    if removed is not None:
+                        passage_lengths[np.isin(ids, removed)] = 0
+                    parts.setdefault(term, []).append((ids, found[1].astype(np.float32), passage_lengths))
+        if not parts:
+            return []
+        ids, weights = [], []
+        for found in parts.values():
+            postings = np.concatenate([part[0] for part in found])
+            frequencies = np.concatenate([part[1] for part in found])
+            passage_lengths = np.concatenate([part[2] for part in found])
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            live = passage_lengths > 0
+            norm = self.k1 * (1 - self.b + self.b * passage_lengths[live] / average_length)
+            ids.append(postings[live])
+            weights.append(idf * frequencies[live] * (self.k1 + 1) / (frequencies[live] + norm))
+        unique, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        if not len(unique):
+            return []
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(unique[position]), float(scores[position])) for position in top]
+
+    def write(self, directory: str, start: int, end: int, segments: Iterable[LexicalSegment] = (),
+              removed: Iterable[int] = ()):
+        """Write the passages with ids in [start, end) as the lexical files of a new segment.
+
+        Args:
+            directory (str): Segment directory.
+            start (int): Lowest passage id of the new segment.
+            end (int): One past its highest passage id.
+            segments (Iterable[LexicalSegment]): Segments whose passages go into the new one;
+                passages held in memory go in as well.
+            removed (Iterable[int]): Ids of removed passages to leave out.
+        """
+        with self._lock:
+            memory_start = self.start
+            memory_lengths = np.array(self.lengths, dtype=np.uint32)
+            memory = self._csr() if end > memory_start else None
+        lengths = np.zeros(max(0, end - start), dtype=np.uint32)
+        sources = []
+        for segment in segments:
+            low, high = max(segment.start, start), min(segment.end, end)
+            if low < high:
+                lengths[low - start:high - start] = segment.lengths[low - segment.start:high - segment.start]
+            sources.append(segment.csr())
+        if memory is not None:
+            low, high = max(memory_start, start), min(memory_start + len(memory_lengths), end)
+            if low < high:
+                lengths[low - start:high - start] = memory_lengths[low - memory_start:high - memory_start]
+            sources.append(memory)
+        removed = np.fromiter(removed, dtype=np.int64)
+        lengths[removed[(removed >= start) & (removed < end)] - start] = 0
+        write_lexical(directory, sources, start, lengths)
+
+    def _csr(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Copy the in-memory postings into CSR arrays. Called with the lock held."""
+        terms = list(self._terms)
+        postings = [np.array(self._postings[self._terms[term]], dtype=np.uint32) for term in terms]
+        frequencies = [np.array(self._frequencies[self._terms[term]], dtype=np.uint16) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in postings], out=offsets[1:])
+        return (np.array(terms, dtype=str), offsets,
+                np.concatenate(postings) if terms else np.empty(0, dtype=np.uint32),
+                np.concatenate(frequencies) if terms else np.empty(0, dtype=np.uint16))
@@ -0,0 +1,163 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+from utils.config import EMBED_BACKEND, QA_BACKEND
+from utils.logger import setup_logging
+from .inference_backend import BACKENDS, load_embedder, load_qa
+
+logger = setup_logging()
+
+NER_EXCLUDE = ["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "senter"]
+
+def load_ner():
+    """Load the SpaCy 'en_core_web_sm' model, downloading it if not available.
+
+    Only the tokenizer and the entity recognizer are loaded; the recognizer
+    has its own embedding layer, so the shared tok2vec is not needed either.
+    """
+    import spacy
+    try:
+        return spacy.load("en_core_web_sm", exclude=NER_EXCLUDE)
+    except OSError:
+        logger.warning("Model 'en_core_web_sm' not found. Downloading...")
+        spacy.cli.download("en_core_web_sm")
+        return spacy.load("en_core_web_sm", exclude=NER_EXCLUDE)
+
+def load_ocr():
+    """Load the English easyocr reader."""
+    import easyocr
+    return easyocr.Reader(["en"])
+
+class ModelRegistry:
+    """Process-wide registry that loads each model exactly once.
+
+    Models are loaded on first use, or ahead of time in parallel background
+    threads via preload(). Every service and extraction strategy in a process
+    gets its models from the same registry, so each model is held in memory
+    once. Heavy libraries are imported inside the loaders, which keeps
+    importing the application fast.
+
+    Attributes:
+        loaders (dict): Loader function for each model name.
+        embed_backend (str): Inference backend of the embedding model.
+        qa_backend (str): Inference backend of the QA pipeline.
+    """
+    def __init__(self, embed_backend: str = EMBED_BACKEND, qa_backend: str = QA_BACKEND):
+        """Initialize ModelRegistry with the default loaders.
+
+        Args:
+            embed_backend (str): 'torch', 'int8' or 'onnx' for the embedding model.
+            qa_backend (str): 'torch', 'int8' or 'onnx' for the QA pipeline.
+
+        Raises:
+            ValueError: If a backend is unknown.
+        """
+        for backend in (embed_backend, qa_backend):
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown inference backend: {backend}")
+        self.embed_backend = embed_backend
+        self.qa_backend = qa_backend
+        self.loaders = {"embedder": lambda: load_embedder(self.embed_backend),
+                        "qa": lambda: load_qa(self.qa_backend),
+                        "ner": load_ner, "ocr": load_ocr}
+        self._models = {}
+        self._errors = {}
+        self._loading = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        """Register or replace the loader for a model name.
+
+        Args:
+            name (str): Model name.
+            loader (Callable[[], Any]): Function returning the loaded model.
+        """
+        self.loaders[name] = loader
+
+    def get(self, name: str) -> Any:
+        """Get a model, loading it on first use.
+
+        Concurrent callers wait for a single load.
+
+        Args:
+            name (str): Model name.
+
+        Returns:
+            Any: The loaded model.
+
+        Raises:
+            KeyError: If no loader is registered for the name.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self.loaders:
+            raise KeyError(f"Unknown model: {name}")
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            if name not in self._models:
+                self._loading.add(name)
+                try:
+                    logger.info(f"Loading model '{name}'")
+                    self._models[name] = self.loaders[name]()
+                    self._errors.pop(name, None)
+                    logger.info(f"Loaded model '{name}'")
+                except Exception as e:
+                    self._errors[name] = str(e)
+                    logger.error(f"Loading model '{name}' failed: {str(e)}")
+                    raise
+                finally:
+                    self._loading.discard(name)
+        return self._models[name]
+
+    def preload(self, names: Optional[Iterable[str]] = None, background: bool = True):
+        """Load several models in parallel.
+
+        Args:
+            names (Optional[Iterable[str]]): Models to load. Defaults to all registered models.
+            background (bool): Return immediately instead of waiting for the loads.
+        """
+        names = list(names if names is not None else self.loaders)
+        executor = ThreadPoolExecutor(max_workers=max(1, len(names)), thread_name_prefix="model-loader")
+        for name in names:
+            executor.submit(self._preload_one, name)
+        executor.shutdown(wait=not background)
+
+    def _preload_one(self, name: str):
+        try:
+            self.get(name)
+        except Exception:
+            pass
+
+    def is_ready(self, names: Iterable[str]) -> bool:
+        """Check whether all given models are loaded.
+
+        Args:
+            names (Iterable[str]): Model names.
+
+        Returns:
+            bool: True if every model is loaded.
+        """
+        return all(name in self._models for name in names)
+
+    def status(self) -> dict:
+        """Report the load state of every registered model.
+
+        Returns:
+            dict: 'loaded', 'loading', 'failed' or 'not loaded' for each model name.
+        """
+        states = {}
+        for name in self.loaders:
+            if name in self._models:
+                states[name] = "loaded"
+            elif name in self._loading:
+                states[name] = "loading"
+            elif name in self._errors:
+                states[name] = "failed"
+            else:
+                states[name] = "not loaded"
+        return states
+
+model_registry = ModelRegistry()
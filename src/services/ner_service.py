@@ -1,5 +1,8 @@
-import spacy
+from typing import List
+from utils.config import NER_BATCH_SIZE
 from utils.logger import setup_logging
+from utils.metrics import stage_timer
+from .model_registry import ModelRegistry, model_registry
 
 logger = setup_logging()
 
@@ -9,15 +12,32 @@ class NERService:
     Extracts entities (e.g., dates, organizations) from text using a pre-trained
     SpaCy model, with logging for debugging and error handling.
 
+    Entities are extracted at ingestion time: annotate_documents runs the
+    trimmed pipeline over all passages of a batch with nlp.pipe, records the
+    entity labels on each passage and returns entity spans with absolute
+    offsets for storage next to the document. Answers then get their
+    entities by projecting those spans onto the answer offsets.
+
     Attributes:
-        nlp (spacy.Language): SpaCy language model instance for NER.
+        registry (ModelRegistry): Registry providing the shared SpaCy model.
+        batch_size (int): Texts per nlp.pipe batch.
     """
-    def __init__(self):
-        """Initialize NERService by setting up the SpaCy model.
+    def __init__(self, registry: ModelRegistry = model_registry, batch_size: int = NER_BATCH_SIZE):
+        """Initialize NERService.
+
+        The 'en_core_web_sm' model is loaded, or downloaded, by the registry on first use.
 
-        Loads or downloads the 'en_core_web_sm' model for English NER.
+        Args:
+            registry (ModelRegistry): Registry providing the shared SpaCy model.
+            batch_size (int): Texts per nlp.pipe batch.
         """
-        self.setup_model()
+        self.registry = registry
+        self.batch_size = batch_size
+
+    @property
+    def nlp(self):
+        """spacy.Language: SpaCy language model instance for NER."""
+        return self.registry.get("ner")
 
     def extract_entities(self, text: str) -> list:
         """Extract named entities from the input text.
@@ -28,33 +48,71 @@ class NERService:
             text (str): Input text to analyze for entities.
 
         Returns:
-            list: List of dictionaries, each containing 'text' and 'label' of an entity.
+            list: List of dictionaries, each containing 'text', 'label' and the
+                'start'/'end' character offsets of an entity.
 
         Notes:
-            Logs the extraction process and any warnings for empty/invalid input.
+            Logs a warning for empty/invalid input.
         """
-        logger.info(f"Extracting entities from text: '{text[:50]}...'")
         if not text or not isinstance(text, str):
             logger.warning("Empty or invalid text provided for entity extraction")
             return []
-        
-        doc = self.nlp(text)
-        entities = [{"text": ent.text, "label": ent.label_} for ent in doc.ents]
-        logger.info(f"Detected entities: {entities}")
-        return entities
+        return self.extract_batch([text])[0]
+
+    def extract_batch(self, texts: List[str]) -> List[list]:
+        """Extract named entities from several texts with nlp.pipe.
+
+        Args:
+            texts (List[str]): Texts to analyze.
+
+        Returns:
+            List[list]: Entities of each text, as in extract_entities.
+        """
+        nlp = self.nlp
+        with stage_timer("ner"):
+            results = [[{"text": ent.text, "label": ent.label_, "start": ent.start_char, "end": ent.end_char}
+                        for ent in doc.ents]
+                       for doc in nlp.pipe(texts, batch_size=self.batch_size)]
+        logger.debug(f"Extracted {sum(len(entities) for entities in results)} entities from {len(texts)} texts")
+        return results
 
-    def setup_model(self) -> None:
-        """Set up the SpaCy model for NER.
+    def annotate_documents(self, documents: List[List[dict]]) -> List[list]:
+        """Extract the entities of several documents from their passages.
 
-        Loads the 'en_core_web_sm' model, downloading it if not available.
+        Sets 'labels', the sorted entity labels found in the passage, on every
+        passage. Entities seen twice in overlapping passages are kept once.
 
-        Raises:
-            OSError: If model loading or download fails (handled internally with logging).
+        Args:
+            documents (List[List[dict]]): Passages from chunk_pages of each document.
+
+        Returns:
+            List[list]: Entities of each document with offsets into its full text, in order.
+        """
+        passages = [passage for document in documents for passage in document]
+        found = iter(self.extract_batch([passage["text"] for passage in passages]))
+        results = []
+        for document in documents:
+            spans = {}
+            for passage in document:
+                entities = next(found)
+                passage["labels"] = sorted({entity["label"] for entity in entities})
+                for entity in entities:
+                    start, end = passage["start"] + entity["start"], passage["start"] + entity["end"]
+                    spans[(start, end, entity["label"])] = {**entity, "start": start, "end": end}
+            results.append(sorted(spans.values(), key=lambda entity: entity["start"]))
+        return results
+
+    @staticmethod
+    def project(entities: list, start: int, end: int) -> list:
+        """Select the stored entities that overlap a span of the document.
+
+        Args:
+            entities (list): Entities of a document from annotate_documents.
+            start (int): Start offset of the span in the document text.
+            end (int): End offset of the span in the document text.
+
+        Returns:
+            list: Overlapping entities with 'text' and 'label', in document order.
         """
-        try:
-            self.nlp = spacy.load("en_core_web_sm")
-            logger.info("Loaded SpaCy model 'en_core_web_sm' successfully")
-        except OSError:
-            logger.warning("Model 'en_core_web_sm' not found. Downloading...")
-            spacy.cli.download("en_core_web_sm")
-            logger.info("Downloaded and loaded 'en_core_web_sm'")
+        return [{"text": entity["text"], "label": entity["label"]}
+                for entity in entities if entity["start"] < end and entity["end"] > start]
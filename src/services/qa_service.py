@@ -1,47 +1,324 @@
-from typing import Tuple, List
-from transformers import pipeline
+import re
+from typing import Dict, List, Optional
+from utils.config import (QA_BATCH_MAX_SIZE, QA_BATCH_MAX_WAIT_MS, QA_TOP_K, QA_MAX_ANSWERS, QA_SPANS_PER_PASSAGE,
+                          QA_RETRIEVAL_WEIGHT, QA_EARLY_EXIT_WAVE, INFERENCE_WORKERS, ASK_MAX_QUEUE)
 from utils.logger import setup_logging
+from utils.metrics import stage_timer
+from .answer_cache import AnswerCache
+from .batcher import MicroBatcher
+from .collection_service import Collection, CollectionService
+from .executor import PriorityExecutor, TimedFuture, PRIORITY_INTERACTIVE
+from .model_registry import ModelRegistry, model_registry
 from .ner_service import NERService
-from .rag_service import RAGService
 
 logger = setup_logging()
 
+NO_CONTEXT = "No relevant context found"
+
 class QAService:
     """Service for answering questions based on retrieved document context.
 
     Utilizes a QA pipeline and NER to process questions and extract entities.
+    Concurrent questions are micro-batched: each batch gets one embedding
+    call, one multi-query FAISS search per collection and one QA forward
+    pass. Questions name the collections they search; passages of several
+    collections are merged by CollectionService. Answers are cached per
+    normalized question and the versions of its collections; cached
+    questions skip retrieval and QA. Entities of an answer are the entities
+    stored at ingestion that overlap its span, so NER does not run per question.
+
+    The top_k nearest passages of a question, possibly from different
+    documents, are read separately by the QA model. Candidate spans are ranked
+    by a combined score, (1 - retrieval_weight) * QA score + retrieval_weight *
+    passage retrieval score, and the best max_answers are returned with
+    their source. With an early-exit threshold, passages are read in waves of
+    early_exit_wave, most similar first, and a question stops once a span
+    scores at least the threshold.
+
+    Given a PriorityExecutor, batches run on it at interactive priority, ahead
+    of ingestion work, with up to concurrency batches at once. At most
+    max_pending questions wait; more are rejected with OverloadedError.
 
     Attributes:
-        qa_pipeline (pipeline): Question-answering model from transformers.
+        registry (ModelRegistry): Registry providing the shared QA pipeline.
         ner_service (NERService): Service for named entity recognition.
-        rag_service (RAGService): Retrieval-augmented generation service.
+        collections (CollectionService): Collections questions are answered from.
+        batcher (MicroBatcher): Collects concurrent questions into batches.
+        answer_cache (AnswerCache): Two-tier cache of answers.
+        spans_per_passage (int): Candidate spans taken from each passage.
+        retrieval_weight (float): Weight of passage similarity in the combined score.
+        early_exit_wave (int): Passages per question read in each early-exit wave.
     """
-    def __init__(self, rag_service: RAGService):
-        """Initialize QAService with a RAG service.
+    def __init__(self, collections: CollectionService, max_batch_size: int = QA_BATCH_MAX_SIZE,
+                 max_wait_ms: float = QA_BATCH_MAX_WAIT_MS, registry: ModelRegistry = model_registry,
+                 spans_per_passage: int = QA_SPANS_PER_PASSAGE, retrieval_weight: float = QA_RETRIEVAL_WEIGHT,
+                 early_exit_wave: int = QA_EARLY_EXIT_WAVE, executor: Optional[PriorityExecutor] = None,
+                 concurrency: int = INFERENCE_WORKERS, max_pending: int = ASK_MAX_QUEUE):
+        """Initialize QAService with the collections to answer from.
+
+        Args:
+            collections (CollectionService): Collections questions are answered from.
+            max_batch_size (int): Largest number of questions answered together.
+            max_wait_ms (float): Milliseconds to wait for more questions before running a batch.
+            registry (ModelRegistry): Registry providing the shared QA and NER models.
+            spans_per_passage (int): Candidate spans taken from each passage.
+            retrieval_weight (float): Weight of passage similarity in the combined score, 0 to 1.
+            early_exit_wave (int): Passages per question read in each early-exit wave.
+            executor (Optional[PriorityExecutor]): Runs the batches; None runs them on the batcher thread.
+            concurrency (int): Batches running at once on the executor.
+            max_pending (int): Waiting questions at which new ones are rejected; 0 for no limit.
+        """
+        self.registry = registry
+        self.ner_service = NERService(registry)
+        self.collections = collections
+        self.answer_cache = AnswerCache(collections.redis_service)
+        self.spans_per_passage = spans_per_passage
+        self.retrieval_weight = retrieval_weight
+        self.early_exit_wave = early_exit_wave
+        self.batcher = MicroBatcher(self._answer_batch, max_batch_size, max_wait_ms, name="qa-batcher",
+                                    max_pending=max_pending, executor=executor, priority=PRIORITY_INTERACTIVE,
+                                    concurrency=concurrency)
+
+    @property
+    def qa_pipeline(self):
+        """pipeline: Question-answering pipeline from transformers, loaded on first use."""
+        return self.registry.get("qa")
+
+    def submit_question(self, question: str, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                        top_k: int = QA_TOP_K, max_answers: int = QA_MAX_ANSWERS,
+                        early_exit_threshold: Optional[float] = None, mode: Optional[str] = None,
+                        labels: Optional[List[str]] = None, deadline: Optional[float] = None,
+                        collections: Optional[List[Collection]] = None) -> TimedFuture:
+        """Queue a question for the next batch without blocking.
 
         Args:
-            rag_service (RAGService): RAG service instance.
+            question (str): Question to answer.
+            nprobe (Optional[int]): IVF lists to visit during retrieval.
+            ef_search (Optional[int]): HNSW search queue size during retrieval.
+            top_k (int): Passages retrieved and read by the QA model.
+            max_answers (int): Number of ranked answers to return.
+            early_exit_threshold (Optional[float]): Stop reading passages once a span's
+                combined score reaches this value.
+            mode (Optional[str]): Retrieval mode, 'vector', 'lexical' or 'hybrid'.
+                Defaults to the RAG service's mode.
+            labels (Optional[List[str]]): Only read passages containing an entity with one of these labels.
+            deadline (Optional[float]): time.monotonic() after which the question is not started.
+            collections (Optional[List[Collection]]): Collections to search, from
+                CollectionService.resolve. Defaults to the default collection, looked up in Redis.
+
+        Returns:
+            TimedFuture: Resolves to the result dict of answer_question, or fails with
+                DeadlineExceededError if the deadline passed first.
+
+        Raises:
+            OverloadedError: If max_pending questions are already waiting.
         """
-        self.qa_pipeline = pipeline("question-answering", model="distilbert-base-cased-distilled-squad")
-        self.ner_service = NERService()
-        self.rag_service = rag_service
+        if collections is None:
+            collections = [self.collections.get(self.collections.default)]
+        collections = sorted({collection.name: collection for collection in collections}.values(),
+                             key=lambda collection: collection.name)
+        return self.batcher.submit({"question": question, "nprobe": nprobe, "ef_search": ef_search,
+                                    "top_k": top_k, "max_answers": max_answers,
+                                    "early_exit_threshold": early_exit_threshold, "mode": mode,
+                                    "labels": sorted(labels) if labels else None,
+                                    "collections": collections}, deadline)
 
-    def answer_question(self, question: str) -> Tuple[str, List]:
+    def answer_question(self, question: str, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                        top_k: int = QA_TOP_K, max_answers: int = QA_MAX_ANSWERS,
+                        early_exit_threshold: Optional[float] = None, mode: Optional[str] = None,
+                        labels: Optional[List[str]] = None, collections: Optional[List[Collection]] = None) -> dict:
         """Answer a question using retrieved context and extract entities.
 
         Args:
             question (str): Question to answer.
+            nprobe (Optional[int]): IVF lists to visit during retrieval.
+            ef_search (Optional[int]): HNSW search queue size during retrieval.
+            top_k (int): Passages retrieved and read by the QA model.
+            max_answers (int): Number of ranked answers to return.
+            early_exit_threshold (Optional[float]): Stop reading passages once a span's
+                combined score reaches this value.
+            mode (Optional[str]): Retrieval mode, 'vector', 'lexical' or 'hybrid'.
+                Defaults to the RAG service's mode.
+            labels (Optional[List[str]]): Only read passages containing an entity with one of these labels.
+            collections (Optional[List[Collection]]): Collections to search. Defaults to the default collection.
 
         Returns:
-            Tuple[str, List]: Answer text and list of detected entities.
-        """
-        context = self.rag_service.retrieve_context(question)
-        if not context:
-            logger.warning("No context retrieved for question")
-            return "No relevant context found", []
-        logger.info(f"Question: '{question}', Context: '{context[:50]}...'")
-        result = self.qa_pipeline(question=question, context=context)
-        logger.info(f"QA result: {result}")
-        answer = result["answer"]
-        entities = self.ner_service.extract_entities(answer)
-        return answer, entities
+            dict: 'answer' text and 'entities' of the best answer, and 'answers', the
+                best spans with 'score', 'qa_score', 'retrieval_score', 'collection', 'filename',
+                'doc_id', 'page', absolute 'start'/'end' offsets in the document and 'entities'.
+        """
+        return self.submit_question(question, nprobe, ef_search, top_k, max_answers, early_exit_threshold,
+                                    mode, labels, collections=collections).result()
+
+    def _answer_batch(self, items: List[dict]) -> List[dict]:
+        """Answer a batch of questions, serving cached answers where possible.
+
+        Args:
+            items (List[dict]): Items with the keyword arguments of submit_question.
+
+        Returns:
+            List[dict]: Result of each item, as in answer_question.
+        """
+        collections = {(collection.name, collection.generation): collection
+                       for item in items for collection in item["collections"]}
+        versions = dict(zip(collections, self.collections.index_versions(list(collections.values()))))
+        keys = [AnswerCache.key(item["question"],
+                                [[c.name, c.generation, versions[c.name, c.generation]] for c in item["collections"]],
+                                item["nprobe"], item["ef_search"], item["top_k"], item["max_answers"],
+                                item["early_exit_threshold"], item["mode"], item["labels"])
+                for item in items]
+        results = self.answer_cache.get_many(keys)
+        uncached = [position for position, result in enumerate(results) if result is None]
+        if uncached:
+            answers = self._compute_batch([items[position] for position in uncached])
+            for position, answer in zip(uncached, answers):
+                results[position] = answer
+            self.answer_cache.set_many({keys[position]: results[position] for position in uncached
+                                        if results[position]["answers"]})
+        return results
+
+    def _compute_batch(self, items: List[dict]) -> List[dict]:
+        """Answer a batch of questions with batched retrieval and QA inference.
+
+        Questions with different search parameters, modes or collections are retrieved
+        in separate searches; each QA pass covers the passages of every question still
+        being answered.
+
+        Args:
+            items (List[dict]): Items with the keyword arguments of submit_question.
+
+        Returns:
+            List[dict]: Result of each item, as in answer_question.
+        """
+        passages = [[] for _ in items]
+        groups = {}
+        for position, item in enumerate(items):
+            labels = tuple(item["labels"]) if item["labels"] else None
+            names = tuple((collection.name, collection.generation) for collection in item["collections"])
+            groups.setdefault((item["nprobe"], item["ef_search"], item["mode"], labels, names), []).append(position)
+        for (nprobe, ef_search, mode, labels, _), positions in groups.items():
+            retrieved = self.collections.retrieve_passages_batch(items[positions[0]]["collections"],
+                                                                 [items[p]["question"] for p in positions],
+                                                                 k=max(items[p]["top_k"] for p in positions),
+                                                                 nprobe=nprobe, ef_search=ef_search, mode=mode,
+                                                                 labels=list(labels) if labels else None)
+            for position, found in zip(positions, retrieved):
+                passages[position] = found[:items[position]["top_k"]]
+
+        empty = sum(1 for found in passages if not found)
+        if empty:
+            logger.warning(f"No context retrieved for {empty} question(s)")
+        candidates = [[] for _ in items]
+        active = [position for position, found in enumerate(passages) if found]
+        wave = 0
+        while active:
+            pairs = []
+            for position in active:
+                threshold = items[position]["early_exit_threshold"]
+                if threshold is None:
+                    pairs.extend((position, passage) for passage in passages[position])
+                else:
+                    start = wave * self.early_exit_wave
+                    pairs.extend((position, passage)
+                                 for passage in passages[position][start:start + self.early_exit_wave])
+            if not pairs:
+                break
+            for (position, passage), spans in zip(pairs, self._read(items, pairs)):
+                candidates[position].extend(self._score(passage, span) for span in spans)
+            active = [position for position in active
+                      if items[position]["early_exit_threshold"] is not None
+                      and (wave + 1) * self.early_exit_wave < len(passages[position])
+                      and max((c["score"] for c in candidates[position]), default=0.0)
+                      < items[position]["early_exit_threshold"]]
+            wave += 1
+
+        ranked = [self._rank(found, item["max_answers"]) for item, found in zip(items, candidates)]
+        self._attach_entities([answer for answers in ranked for answer in answers],
+                              {collection.name: collection for item in items for collection in item["collections"]})
+        results = []
+        for answers in ranked:
+            if not answers:
+                results.append({"answer": NO_CONTEXT, "entities": [], "answers": []})
+            else:
+                results.append({"answer": answers[0]["answer"], "entities": answers[0]["entities"],
+                                "answers": answers})
+        logger.debug(f"Answered batch of {len(items) - empty} question(s) in {wave} QA pass(es)")
+        return results
+
+    def _attach_entities(self, answers: List[dict], collections: Dict[str, Collection]):
+        """Set 'entities' on answers by projecting the entities stored at ingestion onto their spans.
+
+        Documents ingested without stored entities fall back to running NER on the answer text.
+
+        Args:
+            answers (List[dict]): Scored answers with 'collection', 'doc_id', 'start' and 'end'.
+            collections (Dict[str, Collection]): Collections of the answers, keyed by name.
+        """
+        doc_ids = {}
+        for answer in answers:
+            doc_ids.setdefault(answer["collection"], {})[answer["doc_id"]] = None
+        stored = {}
+        for name, ids in doc_ids.items():
+            ids = list(ids)
+            stored.update(((name, doc_id), entities) for doc_id, entities
+                          in zip(ids, collections[name].redis_service.get_entities(ids)))
+        for answer in answers:
+            entities = stored[answer["collection"], answer["doc_id"]]
+            if entities is None:
+                answer["entities"] = [{"text": entity["text"], "label": entity["label"]}
+                                      for entity in self.ner_service.extract_entities(answer["answer"])]
+            else:
+                answer["entities"] = NERService.project(entities, answer["start"], answer["end"])
+
+    def _read(self, items: List[dict], pairs: List[tuple]) -> List[List[dict]]:
+        """Run one batched QA pass over (question position, passage) pairs.
+
+        Args:
+            items (List[dict]): Items of the batch.
+            pairs (List[tuple]): Question position and passage of each QA input.
+
+        Returns:
+            List[List[dict]]: Candidate spans of each pair, as returned by the pipeline.
+        """
+        qa_pipeline = self.qa_pipeline
+        with stage_timer("qa_inference"):
+            outputs = qa_pipeline(question=[items[position]["question"] for position, _ in pairs],
+                                  context=[passage["text"] for _, passage in pairs],
+                                  top_k=self.spans_per_passage, batch_size=len(pairs))
+        if len(pairs) == 1:
+            outputs = [outputs]
+        return [output if isinstance(output, list) else [output] for output in outputs]
+
+    def _score(self, passage: dict, span: dict) -> dict:
+        return {
+            "answer": span["answer"],
+            "score": (1 - self.retrieval_weight) * float(span["score"]) + self.retrieval_weight * passage["score"],
+            "qa_score": float(span["score"]),
+            "retrieval_score": passage["score"],
+            "collection": passage["collection"],
+            "filename": passage["filename"],
+            "doc_id": passage["doc_id"],
+            "page": passage.get("page"),
+            "start": passage["start"] + span["start"],
+            "end": passage["start"] + span["end"]
+        }
+
+    @staticmethod
+    def _rank(candidates: List[dict], max_answers: int) -> List[dict]:
+        """Keep the best-scoring span of each distinct answer per document.
+
+        Overlapping passages often yield the same span twice.
+
+        Args:
+            candidates (List[dict]): Scored spans.
+            max_answers (int): Number of answers to keep.
+
+        Returns:
+            List[dict]: Best spans, highest combined score first.
+        """
+        best = {}
+        for candidate in sorted(candidates, key=lambda c: c["score"], reverse=True):
+            text = re.sub(r"\s+", " ", candidate["answer"]).strip().lower()
+            if text:
+                best.setdefault((candidate["collection"], candidate["doc_id"], text), candidate)
+        return list(best.values())[:max_answers]
@@ -1,68 +1,1030 @@
+import threading
+import time
+from array import array
+from itertools import chain
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from utils.chunker import chunk_pages
+from utils.config import (CHUNK_SIZE, CHUNK_OVERLAP, EMBED_BATCH_SIZE, RETRIEVAL_TOP_K,
+                          INDEX_DIR, SNAPSHOT_INTERVAL, INDEX_TYPE, INDEX_PROMOTION_THRESHOLD,
+                          INDEX_TRAIN_SAMPLE, RETRIEVAL_MODE, RRF_K, HYBRID_CANDIDATES, KEYWORD_MAX_TOKENS,
+                          COMPACTION_THRESHOLD, COMPACTION_MIN_TOMBSTONES, INDEX_MAX_DELTA, INDEX_MAX_SEGMENTS,
+                          INDEX_SYNC_BLOCK_MS, INDEX_SYNC_ON_READ)
 from utils.logger import setup_logging
+from utils.metrics import stage_timer
+from .index_factory import (build_index, base_index, index_ids, reconstruct_range, search_parameters,
+                            bytes_per_vector)
+from .change_log import ChangeLog, stream_position
+from .index_store import IndexStore, Segment
+from .lexical_index import LexicalIndex, is_keyword_query
+from .model_registry import ModelRegistry, model_registry
 from .redis_service import RedisService
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = setup_logging()
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+SYNC_BATCH = 64
+LEADER_POLL_SECONDS = 5.0
+EMPTY_MANIFEST = {"seq": 0, "segments": [], "cursor": "0-0", "next_id": 0, "removed": []}
+
+def encode_passages(model: "SentenceTransformer", pages: List[str], chunk_size: int = CHUNK_SIZE,
+                    chunk_overlap: int = CHUNK_OVERLAP,
+                    batch_size: int = EMBED_BATCH_SIZE) -> Tuple[List[dict], np.ndarray]:
+    """Split page texts into passages and embed them in batches.
+
+    Kept outside RAGService so ingestion workers can embed without loading an index.
+
+    Args:
+        model (SentenceTransformer): Embedding model.
+        pages (List[str]): Text of each page, in order.
+        chunk_size (int): Maximum passage length in characters.
+        chunk_overlap (int): Characters shared by consecutive passages.
+        batch_size (int): Number of passages encoded per model call.
+
+    Returns:
+        Tuple[List[dict], np.ndarray]: Passages from chunk_pages and a float32
+            array of normalized embeddings, one row per passage.
+    """
+    return encode_documents(model, [pages], chunk_size, chunk_overlap, batch_size)[0]
+
+def encode_documents(model: "SentenceTransformer", documents: List[List[str]], chunk_size: int = CHUNK_SIZE,
+                     chunk_overlap: int = CHUNK_OVERLAP,
+                     batch_size: int = EMBED_BATCH_SIZE) -> List[Tuple[List[dict], np.ndarray]]:
+    """Split several documents into passages and embed all passages in one call.
+
+    Args:
+        model (SentenceTransformer): Embedding model.
+        documents (List[List[str]]): Page texts of each document.
+        chunk_size (int): Maximum passage length in characters.
+        chunk_overlap (int): Characters shared by consecutive passages.
+        batch_size (int): Number of passages encoded per model forward pass.
+
+    Returns:
+        List[Tuple[List[dict], np.ndarray]]: Passages and embeddings for each document.
+    """
+    chunked = [chunk_pages(pages, chunk_size, chunk_overlap) for pages in documents]
+    texts = [passage["text"] for passages in chunked for passage in passages]
+    if texts:
+        embeddings = np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True),
+                                dtype=np.float32)
+    else:
+        embeddings = np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    results = []
+    offset = 0
+    for passages in chunked:
+        results.append((passages, embeddings[offset:offset + len(passages)]))
+        offset += len(passages)
+    return results
+
 class RAGService:
     """Service for retrieval-augmented generation using FAISS and Redis.
 
-    Manages document embeddings and context retrieval for question answering.
+    Manages passage embeddings and context retrieval for question answering.
+    Documents are split into overlapping passages and each passage gets its
+    own vector, so retrieval returns only the relevant parts of a document.
+
+    The index is shared by all workers and replicas through a ChangeLog, a
+    Redis stream that is the single source of truth for passages. Writers
+    append added and removed documents to it, and every RAGService, the
+    writer included, applies the stream in order (sync); vector ids are
+    assigned while applying, so all replicas at the same cursor hold the same
+    ids. sync runs before each search and in a background thread blocked on
+    the stream, so a search sees every passage committed before it started.
+
+    Each replica searches the segments of the latest snapshot, memory-mapped
+    from the index directory all replicas share, and delta, an in-memory flat
+    index of the passages applied since that snapshot, and merges their hits
+    by distance. The passage metadata and BM25 postings of the segments are
+    memory-mapped as well, so a process only holds what delta covers in RAM
+    and the processes of a node share one copy of the rest. The process
+    holding the leader lease writes delta as a new segment every
+    snapshot_interval seconds, or once delta holds max_delta vectors, writes
+    a manifest naming the segments, announces it through Redis and trims the
+    stream; the other replicas map the new segments and drop the part of
+    delta they cover. Once more than max_segments segments follow the first
+    one, the leader merges the newest ones. A replica that cannot follow keeps
+    the reason in sync_error until a sync succeeds again.
+
+    Search starts on exact flat indexes. Once index_threshold passages are
+    live, the leader trains an index of the configured type on a sample and
+    fills it in the background as the single segment of its next snapshot;
+    it does so again once the flat segments written since hold as many
+    vectors as that segment. Searches keep using the old segments until the
+    snapshot is published.
+
+    Vectors are stored under stable ids in ID-mapped indexes. Removing a
+    document leaves tombstones: vectors that searches exclude with an ID
+    selector and whose passages lookups skip. Once tombstones make up
+    compaction_threshold of the index, the leader rebuilds the index from the
+    live vectors the same way as a promotion, sized (and retrained) for the
+    live corpus.
+
+    A BM25 LexicalIndex over the same passages is kept next to the vectors and
+    written into the same segments. In 'hybrid' mode the lexical and vector rankings
+    are merged with reciprocal rank fusion; short keyword-like queries that
+    have lexical hits skip the embedding model and the vector search.
+
+    Passages carry the entity labels found at ingestion. Each segment keeps
+    the vector ids of the passages with each label, and delta an array per
+    label, so retrieval restricted to passages with given labels is an
+    IDSelectorBatch on the FAISS search.
 
     Attributes:
-        model (SentenceTransformer): Model for generating text embeddings.
-        index (faiss.IndexFlatL2): FAISS index for similarity search.
+        registry (ModelRegistry): Registry providing the shared embedding model.
         redis_service (RedisService): Redis connection service.
-        doc_map (dict): Mapping of index positions to filenames.
+        change_log (ChangeLog): Shared stream of index changes.
+        manifest (dict): Manifest of the loaded snapshot, as in IndexStore.read_manifest.
+        segments (List[Segment]): Segments of the loaded snapshot, by ascending vector ids.
+        delta (Optional[faiss.IndexIDMap2]): Flat index of the passages applied since the snapshot.
+        cursor (str): Stream id of the last applied change.
+        doc_map (dict): Mapping of the vector ids in delta to passage metadata
+            ('doc_id', 'filename', 'start', 'end', 'page', 'labels') of live passages.
+        chunk_size (int): Maximum passage length in characters.
+        chunk_overlap (int): Characters shared by consecutive passages.
+        batch_size (int): Number of passages encoded per model call.
+        store (IndexStore): Snapshot persistence.
+        index_type (str): Index type to promote to (see index_factory.INDEX_TYPES).
+        index_threshold (int): Live passage count that triggers promotion from flat search.
+        compaction_threshold (float): Share of tombstones in the index that triggers compaction.
+        max_delta (int): Vectors in delta that trigger a snapshot before the interval is up.
+        max_segments (int): Segments after the first one that trigger a merge of the newest ones.
+        sync_on_read (bool): Whether searches apply pending changes first.
+        lexical (LexicalIndex): BM25 index keyed by vector id.
+        retrieval_mode (str): Default retrieval mode, one of RETRIEVAL_MODES.
+        sync_error (Optional[str]): Why the last sync failed, None if it succeeded.
     """
-    def __init__(self, redis_service: RedisService):
+    def __init__(self, redis_service: RedisService, index_dir: str = INDEX_DIR,
+                 snapshot_interval: float = SNAPSHOT_INTERVAL, index_type: str = INDEX_TYPE,
+                 index_threshold: int = INDEX_PROMOTION_THRESHOLD, registry: ModelRegistry = model_registry,
+                 retrieval_mode: str = RETRIEVAL_MODE, compaction_threshold: float = COMPACTION_THRESHOLD,
+                 max_delta: int = INDEX_MAX_DELTA, max_segments: int = INDEX_MAX_SEGMENTS,
+                 sync_block_ms: int = INDEX_SYNC_BLOCK_MS, sync_on_read: bool = INDEX_SYNC_ON_READ):
         """Initialize RAGService with a Redis service.
 
+        Loads the newest snapshot, applies the changes made since, and starts
+        the sync and snapshot threads.
+
         Args:
             redis_service (RedisService): Redis connection service.
+            index_dir (str): Directory for index snapshots, shared by all workers and replicas.
+            snapshot_interval (float): Seconds between snapshots; 0 disables the snapshot thread.
+            index_type (str): Index type to promote to once index_threshold is reached.
+            index_threshold (int): Live passage count that triggers promotion.
+            registry (ModelRegistry): Registry providing the shared embedding model.
+            retrieval_mode (str): Default retrieval mode: 'vector', 'lexical' or 'hybrid'.
+            compaction_threshold (float): Share of tombstones in the index that triggers compaction.
+            max_delta (int): Vectors in delta that trigger a snapshot before the interval is up.
+            max_segments (int): Segments after the first one that trigger a merge of the newest ones.
+            sync_block_ms (int): Milliseconds the sync thread waits on the stream; 0 disables the thread.
+            sync_on_read (bool): Whether searches apply pending changes first.
+
+        Raises:
+            ValueError: If the retrieval mode is unknown.
         """
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.index = faiss.IndexFlatL2(384)
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+        self.registry = registry
+        self.retrieval_mode = retrieval_mode
         self.redis_service = redis_service
+        self.change_log = ChangeLog(redis_service)
+        self.chunk_size = CHUNK_SIZE
+        self.chunk_overlap = CHUNK_OVERLAP
+        self.batch_size = EMBED_BATCH_SIZE
+        self.index_type = index_type
+        self.index_threshold = index_threshold
+        self.compaction_threshold = compaction_threshold
+        self.max_delta = max_delta
+        self.max_segments = max_segments
+        self.sync_on_read = sync_on_read
+        self.store = IndexStore(index_dir)
+        self._lock = threading.RLock()
+        self.sync_error = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._rebuild_reason = None
+        self._load()
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"Initial index sync failed: {str(e)}")
+        self._threads = []
+        if sync_block_ms > 0:
+            self._threads.append(threading.Thread(target=self._sync_loop, args=(sync_block_ms,),
+                                                  name="index-sync", daemon=True))
+        if snapshot_interval > 0:
+            self._threads.append(threading.Thread(target=self._snapshot_loop, args=(snapshot_interval,),
+                                                  name="index-snapshot", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _load(self, seq: Optional[int] = None):
+        """Replace the local state with a snapshot.
+
+        Args:
+            seq (Optional[int]): Snapshot to load. Defaults to the newest one in the index directory.
+        """
+        manifest = self.store.read_manifest(seq) or dict(EMPTY_MANIFEST)
+        segments = [self.store.open_segment(name) for name in manifest["segments"]]
+        self.manifest, self.segments, self.delta = manifest, segments, None
         self.doc_map = {}
+        self._register_all()
+        self.cursor = self._snapshot_cursor = manifest["cursor"]
+        self._next_id = manifest["next_id"]
+        self._tombstones = set(manifest["removed"])
+        self._exclusion = None
+        self.lexical = LexicalIndex()
+        self.lexical.replace([segment.lexical for segment in segments], self._next_id, self._tombstones)
+        self._live = self.ntotal - len(self._tombstones)
+        if segments:
+            logger.info(f"Loaded index snapshot {manifest['seq']} with {self.ntotal} vectors "
+                        f"in {len(segments)} segments")
+
+    def _register(self, vector_id: int, meta: dict):
+        self._doc_passages.setdefault(meta["doc_id"], array("q")).append(vector_id)
+        for label in meta.get("labels", ()):
+            self._label_positions.setdefault(label, array("q")).append(vector_id)
+
+    def _register_all(self):
+        """Rebuild the per-document and per-label id arrays of delta from doc_map."""
+        self._doc_passages: Dict[str, array] = {}
+        self._label_positions: Dict[str, array] = {}
+        for vector_id in sorted(self.doc_map):
+            self._register(vector_id, self.doc_map[vector_id])
+
+    @property
+    def model(self) -> "SentenceTransformer":
+        """SentenceTransformer: Shared embedding model, loaded on first use."""
+        return self.registry.get("embedder")
+
+    @property
+    def ntotal(self) -> int:
+        """int: Vectors in the segments and delta, tombstones included."""
+        delta = self.delta
+        return sum(segment.ntotal for segment in self.segments) + (delta.ntotal if delta is not None else 0)
+
+    @property
+    def snapshot_seq(self) -> int:
+        """int: Sequence number of the loaded snapshot, 0 if none exists."""
+        return self.manifest["seq"]
+
+    def encode_pages(self, pages: List[str]) -> Tuple[List[dict], np.ndarray]:
+        """Split page texts into passages and embed them with this service's settings.
+
+        Args:
+            pages (List[str]): Text of each page, in order.
+
+        Returns:
+            Tuple[List[dict], np.ndarray]: Passages and their embeddings, as in encode_passages.
+        """
+        return encode_passages(self.model, pages, self.chunk_size, self.chunk_overlap, self.batch_size)
+
+    def encode_queries(self, questions: List[str]) -> np.ndarray:
+        """Embed questions for searching.
+
+        Args:
+            questions (List[str]): Questions to embed.
+
+        Returns:
+            np.ndarray: Normalized float32 embeddings, one row per question.
+        """
+        with stage_timer("embed_query"):
+            embeddings = self.model.encode(questions, batch_size=self.batch_size, normalize_embeddings=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def has_document(self, doc_id: str) -> bool:
+        """Check whether a document's passages are already in the local replica.
+
+        Args:
+            doc_id (str): Document id (content hash).
+
+        Returns:
+            bool: True if the document is indexed.
+        """
+        return self._document_ids(doc_id) is not None
+
+    def _document_ids(self, doc_id: str) -> Optional[np.ndarray]:
+        """Get the vector ids of a document's live passages, None if the document is not indexed."""
+        ids = self._doc_passages.get(doc_id)
+        if ids is not None:
+            return np.array(ids, dtype=np.int64)
+        for segment in reversed(self.segments):
+            ids = segment.document(doc_id)
+            if ids is not None and int(ids[0]) not in self._tombstones:
+                return ids
+        return None
+
+    def _meta(self, vector_id: int) -> Optional[dict]:
+        """Get the metadata of a live passage, None if it was removed."""
+        if vector_id in self._tombstones:
+            return None
+        meta = self.doc_map.get(vector_id)
+        if meta is not None:
+            return meta
+        for segment in self.segments:
+            if segment.start <= vector_id < segment.end:
+                return segment.meta(vector_id)
+        return None
+
+    def add_passages(self, doc_id: str, filename: str, passages: List[dict], vectors: np.ndarray):
+        """Add already embedded passages of a document to the FAISS index.
+
+        Args:
+            doc_id (str): Document id (content hash) the text is stored under in Redis.
+            filename (str): Name the document was uploaded under.
+            passages (List[dict]): Passages from chunk_pages.
+            vectors (np.ndarray): float32 embeddings, one row per passage.
+        """
+        if not passages:
+            logger.warning(f"No text to embed for {filename}")
+            return
+        self.add_documents([(doc_id, filename, passages, vectors)])
+
+    def add_documents(self, documents: List[Tuple[str, str, List[dict], np.ndarray]]):
+        """Add the embedded passages of several documents with a single change log entry.
+
+        Returns once the entry is applied to the local replica. Documents that
+        are already indexed when the entry is applied are skipped.
+
+        Args:
+            documents (List[Tuple[str, str, List[dict], np.ndarray]]): Document id,
+                filename, passages and embeddings of each document.
+        """
+        documents = [document for document in documents if document[2] and not self.has_document(document[0])]
+        meta = [{"doc_id": doc_id, "filename": filename, "start": passage["start"], "end": passage["end"],
+                 "page": passage["page"], "labels": passage.get("labels", [])}
+                for doc_id, filename, passages, _ in documents for passage in passages]
+        if not meta:
+            return
+        vectors = np.concatenate([vectors for _, _, _, vectors in documents])
+        self.change_log.append_add(meta, [passage.get("text", "") for _, _, passages, _ in documents
+                                          for passage in passages], vectors)
+        self.sync()
+        logger.debug(f"Stored {len(meta)} passage embeddings for {len(documents)} document(s), "
+                     f"index size: {self.ntotal}")
+
+    def remove_document(self, doc_id: str) -> int:
+        """Remove the passages of a document from search.
+
+        The passages leave the BM25 index of every replica as it applies the
+        removal; their vectors become tombstones until the next compaction.
+
+        Args:
+            doc_id (str): Document id (content hash).
+
+        Returns:
+            int: Number of passages removed; 0 if the document was not indexed.
+        """
+        self.sync()
+        passages = self._document_ids(doc_id)
+        if passages is None:
+            return 0
+        count = len(passages)
+        self.change_log.append_remove(doc_id)
+        self.sync()
+        logger.debug(f"Removed {count} passages of {doc_id}, {len(self._tombstones)} tombstones")
+        return count
+
+    def sync(self, block_ms: Optional[int] = None) -> int:
+        """Apply the changes appended to the change log since the local cursor.
+
+        Switches to a snapshot published by the leader first: a snapshot
+        behind the cursor only replaces the segments and the part of delta it
+        covers, one ahead of it (the stream was trimmed past the cursor) is
+        reloaded. The outcome is kept in sync_error.
+
+        Args:
+            block_ms (Optional[int]): Wait up to this long for a change if there is none yet.
+
+        Returns:
+            int: Number of changes applied.
+        """
+        try:
+            applied = self._sync(block_ms)
+        except Exception as e:
+            self.sync_error = f"{type(e).__name__}: {str(e)}"
+            raise
+        self.sync_error = None
+        return applied
+
+    def _sync(self, block_ms: Optional[int]) -> int:
+        applied = 0
+        while True:
+            entries, snapshot = self.change_log.read(self.cursor, SYNC_BATCH, block_ms)
+            opened = self._open(snapshot)
+            with self._lock:
+                self._follow(snapshot, opened)
+                for entry_id, change in entries:
+                    if stream_position(entry_id) > stream_position(self.cursor):
+                        self._apply(change)
+                        self.cursor = entry_id
+                        applied += 1
+            if len(entries) < SYNC_BATCH:
+                break
+            block_ms = None
+        if applied and self._snapshot_reason() is not None:
+            self._wake.set()
+        return applied
+
+    def _open(self, snapshot: Optional[dict]) -> Optional[Tuple[dict, List[Segment]]]:
+        """Read the manifest of a newer snapshot behind the cursor and map its segments.
+
+        Segments the loaded snapshot already has are reused, so only the ones
+        written since are mapped.
+
+        Returns:
+            Optional[Tuple[dict, List[Segment]]]: Manifest and segments, or None if there is nothing to switch to.
+        """
+        if (snapshot is None or snapshot["seq"] <= self.snapshot_seq
+                or stream_position(snapshot["cursor"]) > stream_position(self.cursor)):
+            return None
+        manifest = self.store.read_manifest(snapshot["seq"])
+        mapped = {segment.name: segment for segment in self.segments}
+        return manifest, [mapped.get(name) or self.store.open_segment(name) for name in manifest["segments"]]
+
+    def _follow(self, snapshot: Optional[dict], opened: Optional[Tuple[dict, List[Segment]]]):
+        """Switch to a snapshot if it is newer than the loaded one. Called with the lock held."""
+        if snapshot is None or snapshot["seq"] <= self.snapshot_seq:
+            return
+        if stream_position(snapshot["cursor"]) > stream_position(self.cursor):
+            logger.info(f"Reloading index from snapshot {snapshot['seq']} at {snapshot['cursor']}")
+            self._load(snapshot["seq"])
+            return
+        if opened is None or opened[0]["seq"] != snapshot["seq"]:
+            opened = self._open(snapshot)
+        self._switch(*opened)
+        logger.debug(f"Switched to index snapshot {snapshot['seq']}, {self.ntotal} vectors")
+
+    def _switch(self, manifest: dict, segments: List[Segment]):
+        """Search the segments of a snapshot and drop the part of delta they cover. Called with the lock held."""
+        next_id = manifest["next_id"]
+        delta = None
+        if self.delta is not None:
+            ids, vectors = reconstruct_range(self.delta, 0, self.delta.ntotal)
+            newer = ids >= next_id
+            if newer.any():
+                delta = build_index("flat", self.delta.d, int(newer.sum()))
+                delta.add_with_ids(vectors[newer], ids[newer])
+        self.doc_map = {vector_id: meta for vector_id, meta in self.doc_map.items() if vector_id >= next_id}
+        self._register_all()
+        self.manifest, self.segments, self.delta = manifest, segments, delta
+        self._snapshot_cursor = manifest["cursor"]
+        dead = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+        present = self._present(dead, segments, delta)
+        self._tombstones = set(dead[present].tolist())
+        self._exclusion = None
+        self.lexical.replace([segment.lexical for segment in segments], next_id,
+                             dead[present & (dead < next_id)].tolist())
+        if len(self._tombstones) < len(dead):
+            self.lexical.compact()
+        self._live = self.ntotal - len(self._tombstones)
+
+    @staticmethod
+    def _present(ids: np.ndarray, segments: List[Segment], delta: Optional[faiss.Index] = None) -> np.ndarray:
+        """Tell which of several vector ids the segments or delta hold."""
+        present = np.zeros(len(ids), dtype=bool)
+        for segment in segments:
+            present |= segment.contains(ids)
+        if delta is not None:
+            present |= np.isin(ids, index_ids(delta))
+        return present
+
+    def _apply(self, change: dict):
+        """Apply one change log entry to the local replica."""
+        if change["op"] == "remove":
+            ids = self._document_ids(change["doc_id"])
+            if ids is None:
+                return
+            ids = ids.tolist()
+            self._doc_passages.pop(change["doc_id"], None)
+            for vector_id in ids:
+                self.doc_map.pop(vector_id, None)
+            self._tombstones.update(ids)
+            self._live -= len(ids)
+            self._exclusion = None
+            self.lexical.remove(ids)
+            return
+        meta = change["meta"]
+        indexed = {doc_id for doc_id in {item["doc_id"] for item in meta} if self._document_ids(doc_id) is not None}
+        rows = [row for row, item in enumerate(meta) if item["doc_id"] not in indexed]
+        if not rows:
+            return
+        ids = np.arange(self._next_id, self._next_id + len(rows), dtype=np.int64)
+        self._next_id += len(rows)
+        if self.delta is None:
+            self.delta = build_index("flat", change["vectors"].shape[1], len(rows))
+        with stage_timer("faiss_add"):
+            self.delta.add_with_ids(change["vectors"][rows], ids)
+        with stage_timer("lexical_add"):
+            self.lexical.add(ids.tolist(), [change["texts"][row] for row in rows])
+        for vector_id, row in zip(ids.tolist(), rows):
+            self.doc_map[vector_id] = meta[row]
+            self._register(vector_id, meta[row])
+        self._live += len(rows)
+
+    def _snapshot_reason(self) -> Optional[str]:
+        """Tell why the next snapshot is due before the interval is up.
 
-    def store_embedding(self, filename: str, text: str):
-        """Store a text embedding in the FAISS index.
+        Returns:
+            Optional[str]: 'compaction' or 'promotion' if the index should be
+                rebuilt, 'merge' if delta is full, None otherwise.
+        """
+        ntotal = self.ntotal
+        tombstones = len(self._tombstones)
+        segments = self.segments
+        if tombstones >= max(1, COMPACTION_MIN_TOMBSTONES) and tombstones >= self.compaction_threshold * ntotal:
+            return "compaction"
+        if self.index_type != "flat":
+            if not segments or isinstance(base_index(segments[0].index), faiss.IndexFlat):
+                if self._live >= self.index_threshold:
+                    return "promotion"
+            elif sum(segment.ntotal for segment in segments[1:]) >= max(1, segments[0].ntotal):
+                return "promotion"
+        delta = self.delta
+        if delta is not None and delta.ntotal >= self.max_delta:
+            return "merge"
+        return None
+
+    def _merge_start(self, segments: List[Segment]) -> Optional[int]:
+        """Pick the newest segments to merge once more than max_segments follow the first one.
+
+        The run starts with the two newest segments and takes in older ones
+        while each is at most twice the size of the run so far, so segments
+        are rewritten about once per doubling of their size.
+
+        Returns:
+            Optional[int]: Position of the oldest segment to merge, None if no merge is due.
+        """
+        if len(segments) - 1 <= self.max_segments:
+            return None
+        first, total = len(segments) - 1, segments[-1].ntotal
+        while first > 1 and (first == len(segments) - 1 or segments[first - 1].ntotal <= 2 * total):
+            first -= 1
+            total += segments[first].ntotal
+        return first
+
+    def snapshot(self) -> bool:
+        """Write and publish a snapshot if this process is the leader and the index changed.
+
+        Only delta is written, as a new segment; the segments of the loaded
+        snapshot are listed again without being read, unless the newest of
+        them are due for a merge.
+
+        Returns:
+            bool: True if a snapshot was published.
+        """
+        if not self.change_log.hold_leadership():
+            return False
+        self.sync()
+        reason = self._snapshot_reason()
+        if reason in ("compaction", "promotion"):
+            return self._rebuild(reason)
+        with self._lock:
+            if self.cursor == self._snapshot_cursor:
+                return False
+            if not self.segments and self.delta is None:
+                self._snapshot_cursor = self.cursor
+                return False
+            manifest, segments = self.manifest, self.segments
+            tail = reconstruct_range(self.delta, 0, self.delta.ntotal) if self.delta is not None else None
+            doc_map, cursor, next_id = dict(self.doc_map), self.cursor, self._next_id
+            dead = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+        if tail is not None and doc_map:
+            live = np.isin(tail[0], np.fromiter(doc_map, dtype=np.int64, count=len(doc_map)))
+            index = build_index("flat", tail[1].shape[1], int(live.sum()))
+            index.add_with_ids(tail[1][live], tail[0][live])
+            passages = ((vector_id, doc_map[vector_id]) for vector_id in sorted(doc_map))
+            segments = segments + [self.store.write_segment(index, passages, manifest["next_id"], next_id,
+                                                            self.lexical)]
+        first = self._merge_start(segments)
+        if first is not None:
+            merged = segments[first:]
+            index = build_index("flat", merged[0].index.d, sum(segment.ntotal for segment in merged))
+            for segment in merged:
+                ids, vectors = reconstruct_range(segment.index, 0, segment.ntotal)
+                live = ~np.isin(ids, dead)
+                index.add_with_ids(vectors[live], ids[live])
+            passages = chain.from_iterable(segment.items(dead) for segment in merged)
+            segments = segments[:first] + [self.store.write_segment(index, passages, merged[0].start, merged[-1].end,
+                                                                    self.lexical, merged, dead)]
+            logger.info(f"Merged {len(merged)} index segments into one with {index.ntotal} vectors")
+        return self._publish(segments, cursor, next_id, dead, manifest["seq"])
+
+    def _publish(self, segments: List[Segment], cursor: str, next_id: int, dead: np.ndarray, previous: int) -> bool:
+        """Write the manifest of a snapshot, announce it and switch to it.
+
+        Called without the lock: searches and syncs go on while the segments
+        are written and mapped, and the lock is only taken to swap them in.
+        Passages with ids from next_id on stay in delta.
+
+        Args:
+            segments (List[Segment]): Segments holding every passage up to the cursor.
+            cursor (str): Stream id of the last change the snapshot includes.
+            next_id (int): Vector id the change after the cursor continues at.
+            dead (np.ndarray): Tombstones at the cursor.
+            previous (int): Sequence number of the snapshot the segments were taken from.
+
+        Returns:
+            bool: True if the snapshot was published; False if this process lost the leader lease.
+        """
+        if not self.change_log.hold_leadership():
+            logger.warning("Lost the index leader lease; discarding snapshot")
+            return False
+        removed = np.unique(dead[self._present(dead, segments)]).tolist()
+        seq = self.store.publish([segment.name for segment in segments], cursor, next_id, removed, previous)
+        if seq is None:
+            logger.warning("Another process published an index snapshot; discarding snapshot")
+            return False
+        self.change_log.publish_snapshot(seq, cursor, next_id)
+        manifest = self.store.read_manifest(seq)
+        with self._lock:
+            if seq > self.snapshot_seq:
+                self._switch(manifest, segments)
+        return True
+
+    def _rebuild(self, reason: str) -> bool:
+        """Train and fill a new index with the live vectors, then publish it as the only segment of a snapshot.
+
+        The new index has the configured type once the live corpus reaches
+        index_threshold and is flat below it. Reading the segments, training
+        and the bulk add run without the lock. Passages applied meanwhile stay
+        in delta for the next snapshot; passages removed meanwhile stay
+        tombstones in the new segment.
 
         Args:
-            filename (str): Name of the document.
-            text (str): Text content to embed.
+            reason (str): 'promotion' or 'compaction'.
+
+        Returns:
+            bool: True if a snapshot was published.
         """
-        embedding = self.model.encode(text)
-        self.index.add(np.array([embedding]))
-        self.doc_map[self.index.ntotal - 1] = filename
-        logger.info(f"Stored embedding for {filename}, index size: {self.index.ntotal}")
+        with self._lock:
+            manifest, segments, cursor, next_id = self.manifest, self.segments, self.cursor, self._next_id
+            dead = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+            doc_map = dict(self.doc_map)
+            tail = reconstruct_range(self.delta, 0, self.delta.ntotal) if self.delta is not None else None
+        parts = [reconstruct_range(segment.index, 0, segment.ntotal) for segment in segments]
+        if tail is not None:
+            parts.append(tail)
+        if not parts:
+            return False
+        self._rebuild_reason = reason
+        try:
+            ids = np.concatenate([part[0] for part in parts])
+            vectors = np.concatenate([part[1] for part in parts])
+            count = len(ids)
+            live = ~np.isin(ids, dead)
+            ids, vectors = ids[live], vectors[live]
+            del parts
+            index_type = self.index_type if len(ids) >= self.index_threshold else "flat"
+            logger.info(f"Rebuilding index ({reason}) as {index_type} with {len(ids)} of {count} vectors")
+            target = build_index(index_type, vectors.shape[1], len(ids))
+            if not target.is_trained:
+                sample = vectors
+                if len(ids) > INDEX_TRAIN_SAMPLE:
+                    rows = np.random.default_rng(0).choice(len(ids), INDEX_TRAIN_SAMPLE, replace=False)
+                    sample = vectors[rows]
+                target.train(sample)
+            if len(ids):
+                target.add_with_ids(vectors, ids)
+            del vectors
+            passages = chain(chain.from_iterable(segment.items(dead) for segment in segments),
+                             ((vector_id, doc_map[vector_id]) for vector_id in sorted(doc_map)))
+            segment = self.store.write_segment(target, passages, 0, next_id, self.lexical, segments, dead)
+            if not self._publish([segment], cursor, next_id, dead, manifest["seq"]):
+                return False
+            logger.info(f"Rebuilt index as {index_type} with {target.ntotal} vectors")
+            return True
+        finally:
+            self._rebuild_reason = None
+
+    def retrieve_passages(self, question: str, k: int = RETRIEVAL_TOP_K, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None, mode: Optional[str] = None,
+                          labels: Optional[List[str]] = None) -> List[dict]:
+        """Retrieve the passages most relevant to a question.
+
+        Args:
+            question (str): Question to find passages for.
+            k (int): Maximum number of passages to return.
+            nprobe (Optional[int]): IVF lists to visit; higher means better recall, slower search.
+            ef_search (Optional[int]): HNSW search queue size; same trade-off as nprobe.
+            mode (Optional[str]): 'vector', 'lexical' or 'hybrid'. Defaults to retrieval_mode.
+            labels (Optional[List[str]]): Only return passages containing an entity with one of these labels.
+
+        Returns:
+            List[dict]: Passages ordered by relevance, each with 'text', 'doc_id',
+                'filename', 'start', 'end', 'page', 'distance' (None for lexical-only
+                hits) and 'score' (cosine similarity in vector mode, otherwise a
+                rank-based relevance between 0 and 1) keys.
+        """
+        return self.retrieve_passages_batch([question], k, nprobe, ef_search, mode, labels)[0]
+
+    def retrieve_passages_batch(self, questions: List[str], k: int = RETRIEVAL_TOP_K,
+                                nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                                mode: Optional[str] = None, labels: Optional[List[str]] = None,
+                                embeddings: Optional[np.ndarray] = None) -> List[List[dict]]:
+        """Retrieve the most relevant passages for several questions at once.
+
+        Applies pending changes first if sync_on_read is set. Runs one batched
+        encode and one multi-query FAISS search per index (segments and delta) for
+        the questions that need vectors, one BM25 lookup per question for the
+        lexical side, and fetches all matched documents from Redis with a
+        single MGET.
+
+        Args:
+            questions (List[str]): Questions to find passages for.
+            k (int): Maximum number of passages per question.
+            nprobe (Optional[int]): IVF lists to visit.
+            ef_search (Optional[int]): HNSW search queue size.
+            mode (Optional[str]): 'vector', 'lexical' or 'hybrid'. Defaults to retrieval_mode.
+            labels (Optional[List[str]]): Only return passages containing an entity with one of these labels.
+            embeddings (Optional[np.ndarray]): Embeddings of all questions from encode_queries, for
+                callers searching several indexes with the same questions; None embeds them here.
+
+        Returns:
+            List[List[dict]]: Passages for each question, as in retrieve_passages.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+        mode = mode or self.retrieval_mode
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if self.sync_on_read:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Index sync failed, searching the local replica: {str(e)}")
+        candidates = k * HYBRID_CANDIDATES if mode == "hybrid" else k
+        selector = allowed = None
+        if labels:
+            allowed = self._positions_with_labels(labels)
+            if not len(allowed):
+                return [[] for _ in questions]
+            selector = faiss.IDSelectorBatch(allowed)
+        else:
+            exclusion = self._exclusion_selector()
+            selector = exclusion[0] if exclusion is not None else None
+        lexical_hits = []
+        for question in questions:
+            hits = []
+            if mode != "vector":
+                with stage_timer("lexical_search"):
+                    hits = self.lexical.search(question, candidates if allowed is None else candidates * 4)
+                if allowed is not None:
+                    hits = [hit for hit in hits if self._has_position(allowed, hit[0])][:candidates]
+            lexical_hits.append(hits)
+        vector_rows = [row for row, question in enumerate(questions)
+                       if mode == "vector" or (mode == "hybrid" and not (
+                           lexical_hits[row] and is_keyword_query(question, KEYWORD_MAX_TOKENS)))]
+        vector_hits = [[] for _ in questions]
+        if vector_rows and self.ntotal:
+            if embeddings is None:
+                query_embeddings = self.encode_queries([questions[row] for row in vector_rows])
+            else:
+                query_embeddings = np.asarray(embeddings, dtype=np.float32)[vector_rows]
+            with stage_timer("faiss_search"):
+                distances, indices = self._search(query_embeddings, candidates, nprobe, ef_search, selector)
+            for row, row_distances, row_indices in zip(vector_rows, distances, indices):
+                seen = set()
+                for distance, position in zip(row_distances, row_indices):
+                    if position >= 0 and position not in seen:
+                        seen.add(position)
+                        vector_hits[row].append((int(position), float(distance)))
+        elif vector_rows:
+            logger.warning("No valid index found")
+
+        ranked = [self._fuse(vector, lexical, k) for vector, lexical in zip(vector_hits, lexical_hits)]
+        metas = {position: self._meta(position) for row in ranked for position, _, _ in row}
+        doc_ids = list({meta["doc_id"] for meta in metas.values() if meta})
+        documents = dict(zip(doc_ids, self.redis_service.get_documents(doc_ids)))
+
+        results = []
+        for row in ranked:
+            passages = []
+            for position, distance, score in row:
+                meta = metas[position]
+                if meta is None:
+                    continue
+                text = documents[meta["doc_id"]][meta["start"]:meta["end"]]
+                if text:
+                    passages.append({**meta, "text": text, "distance": distance, "score": score})
+            results.append(passages)
+        return results
+
+    def _search(self, queries: np.ndarray, k: int, nprobe: Optional[int], ef_search: Optional[int],
+                selector: Optional[faiss.IDSelector]) -> Tuple[np.ndarray, np.ndarray]:
+        """Search the segments and delta and merge their hits by distance.
+
+        Segments are never modified, so they are searched without the lock;
+        delta grows while changes are applied and is searched under it.
 
-    def retrieve_context(self, question: str) -> str:
+        Args:
+            queries (np.ndarray): float32 query embeddings, one row per query.
+            k (int): Hits to keep per query.
+            nprobe (Optional[int]): IVF lists to visit.
+            ef_search (Optional[int]): HNSW search queue size.
+            selector (Optional[faiss.IDSelector]): Restricts the search to these vector ids.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Distances and vector ids of the nearest hits of
+                each query, nearest first; missing hits have id -1.
+        """
+        def search(index: faiss.Index) -> Tuple[np.ndarray, np.ndarray]:
+            return index.search(queries, k=min(k, index.ntotal),
+                                params=search_parameters(index, nprobe, ef_search, selector))
+
+        results = [search(segment.index) for segment in self.segments if segment.ntotal]
+        with self._lock:
+            if self.delta is not None and self.delta.ntotal:
+                results.append(search(self.delta))
+        if len(results) == 1:
+            return results[0]
+        if not results:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        distances = np.concatenate([distances for distances, _ in results], axis=1)
+        ids = np.concatenate([ids for _, ids in results], axis=1)
+        order = np.argsort(np.where(ids >= 0, distances, np.inf), axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def _positions_with_labels(self, labels: List[str]) -> np.ndarray:
+        """Collect the sorted ids of live passages with any of the given entity labels.
+
+        Args:
+            labels (List[str]): Entity labels, e.g. 'DATE' or 'ORG'.
+
+        Returns:
+            np.ndarray: int64 vector ids.
+        """
+        with self._lock:
+            arrays = [np.array(self._label_positions[label], dtype=np.int64)
+                      for label in labels if label in self._label_positions]
+            segments = self.segments
+            dead = np.fromiter(self._tombstones, dtype=np.int64) if self._tombstones else None
+        for segment in segments:
+            arrays.extend(segment.with_labels(labels))
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        allowed = np.unique(np.concatenate(arrays))
+        return allowed if dead is None else np.setdiff1d(allowed, dead, assume_unique=True)
+
+    def _exclusion_selector(self) -> Optional[Tuple[faiss.IDSelector, faiss.IDSelector]]:
+        """Get a selector that skips tombstones, built once per change of the tombstone set.
+
+        Returns:
+            Optional[Tuple[faiss.IDSelector, faiss.IDSelector]]: The IDSelectorNot and the
+                IDSelectorBatch it wraps, which must stay referenced while it is used;
+                None if there are no tombstones.
+        """
+        with self._lock:
+            if self._exclusion is None and self._tombstones:
+                dead = faiss.IDSelectorBatch(np.fromiter(self._tombstones, dtype=np.int64))
+                self._exclusion = (faiss.IDSelectorNot(dead), dead)
+            return self._exclusion
+
+    @staticmethod
+    def _has_position(allowed: np.ndarray, position: int) -> bool:
+        slot = np.searchsorted(allowed, position)
+        return slot < len(allowed) and allowed[slot] == position
+
+    @staticmethod
+    def _fuse(vector_hits: List[Tuple[int, float]], lexical_hits: List[Tuple[int, float]],
+              k: int) -> List[Tuple[int, Optional[float], float]]:
+        """Merge vector and lexical rankings of one question.
+
+        A single ranking keeps its own order: vector hits score their cosine
+        similarity, lexical hits their BM25 score relative to the best one.
+        Two rankings are merged with reciprocal rank fusion, scaled so a
+        passage ranked first by both scores 1.
+
+        Args:
+            vector_hits (List[Tuple[int, float]]): Index position and L2 distance, nearest first.
+            lexical_hits (List[Tuple[int, float]]): Index position and BM25 score, best first.
+            k (int): Number of passages to keep.
+
+        Returns:
+            List[Tuple[int, Optional[float], float]]: Index position, distance (None if
+                not a vector hit) and relevance score, best first.
+        """
+        if not lexical_hits:
+            return [(position, distance, min(1.0, max(0.0, 1.0 - distance / 2)))
+                    for position, distance in vector_hits[:k]]
+        if not vector_hits:
+            best = lexical_hits[0][1] or 1.0
+            return [(position, None, score / best) for position, score in lexical_hits[:k]]
+        distances = dict(vector_hits)
+        fused = {}
+        for hits in (vector_hits, lexical_hits):
+            for rank, (position, _) in enumerate(hits, start=1):
+                fused[position] = fused.get(position, 0.0) + 1.0 / (RRF_K + rank)
+        top = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        scale = (RRF_K + 1) / 2
+        return [(position, distances.get(position), score * scale) for position, score in top]
+
+    def retrieve_context(self, question: str, k: int = RETRIEVAL_TOP_K, nprobe: Optional[int] = None,
+                         ef_search: Optional[int] = None, mode: Optional[str] = None) -> str:
         """Retrieve relevant context for a question from the index.
 
+        Joins the top-k passages so the QA model reads a few hundred tokens
+        instead of whole documents.
+
         Args:
             question (str): Question to find context for.
+            k (int): Number of passages to include.
+            nprobe (Optional[int]): IVF lists to visit.
+            ef_search (Optional[int]): HNSW search queue size.
+            mode (Optional[str]): 'vector', 'lexical' or 'hybrid'. Defaults to retrieval_mode.
 
         Returns:
             str: Retrieved context text, or empty string if none found.
         """
-        query_embedding = self.model.encode(question)
-        logger.info(f"Query embedding shape: {query_embedding.shape}")
-        _, indices = self.index.search(np.array([query_embedding]), k=1)
-        logger.info(f"Search indices: {indices}")
+        return self.retrieve_contexts([question], k, nprobe, ef_search, mode)[0]
 
-        if indices[0][0] == -1 or indices[0][0] >= self.index.ntotal:
-            logger.warning("No valid index found")
-            return ""
-        
-        index = indices[0][0]
-        filename = self.doc_map.get(index, "")
-        if not filename:
-            logger.warning(f"No filename found for index: {index}")
-            return ""
-        
-        context = self.redis_service.get_document(filename)
-        logger.info(f"Retrieved context for {filename}: {context[:100]}...")
-        return context if context else ""
+    def retrieve_contexts(self, questions: List[str], k: int = RETRIEVAL_TOP_K, nprobe: Optional[int] = None,
+                          ef_search: Optional[int] = None, mode: Optional[str] = None) -> List[str]:
+        """Retrieve context for several questions with one batched search.
+
+        Args:
+            questions (List[str]): Questions to find context for.
+            k (int): Number of passages per question.
+            nprobe (Optional[int]): IVF lists to visit.
+            ef_search (Optional[int]): HNSW search queue size.
+            mode (Optional[str]): 'vector', 'lexical' or 'hybrid'. Defaults to retrieval_mode.
+
+        Returns:
+            List[str]: Context for each question, empty if none found.
+        """
+        batches = self.retrieve_passages_batch(questions, k, nprobe, ef_search, mode)
+        return ["\n".join(passage["text"] for passage in passages) for passages in batches]
+
+    def index_stats(self) -> dict:
+        """Report the index type, size, estimated memory use and replication state.
+
+        Returns:
+            dict: 'type' (of the first segment), 'ntotal', 'segments', 'delta_vectors', 'live_passages',
+                'tombstones', 'bytes_per_vector' (of the first segment), 'estimated_bytes', 'rebuilding'
+                ('promotion', 'compaction' or None), 'lexical_passages', 'snapshot_seq', 'cursor', 'leader'
+                and 'sync_error'.
+        """
+        segments, delta = self.segments, self.delta
+        head = segments[0].index if segments else delta
+        delta_vectors = delta.ntotal if delta is not None else 0
+        return {
+            "type": type(base_index(head)).__name__ if head is not None else "IndexFlat",
+            "ntotal": self.ntotal,
+            "segments": len(segments),
+            "delta_vectors": delta_vectors,
+            "live_passages": self._live,
+            "tombstones": len(self._tombstones),
+            "bytes_per_vector": bytes_per_vector(head) if head is not None else 0.0,
+            "estimated_bytes": int(sum(bytes_per_vector(segment.index) * segment.ntotal for segment in segments)
+                                   + (bytes_per_vector(delta) * delta_vectors if delta is not None else 0)),
+            "rebuilding": self._rebuild_reason,
+            "lexical_passages": self.lexical.size,
+            "snapshot_seq": self.snapshot_seq,
+            "cursor": self.cursor,
+            "leader": self.change_log.is_leader,
+            "sync_error": self.sync_error
+        }
+
+    def _sync_loop(self, block_ms: int):
+        while not self._stop.is_set():
+            try:
+                self.sync(block_ms)
+            except Exception as e:
+                logger.error(f"Index sync failed: {str(e)}")
+                self._stop.wait(1.0)
+
+    def _snapshot_loop(self, interval: float):
+        last = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.wait(min(interval, LEADER_POLL_SECONDS))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if time.monotonic() - last >= interval or self._snapshot_reason() is not None:
+                    self.snapshot()
+                    last = time.monotonic()
+                else:
+                    self.change_log.hold_leadership()
+            except Exception as e:
+                logger.error(f"Periodic index snapshot failed: {str(e)}")
+
+    def close(self, snapshot: bool = True):
+        """Stop the sync and snapshot threads, write a final snapshot if leader and give up the lease.
+
+        Args:
+            snapshot (bool): Whether to write the final snapshot; dropped collections skip it.
+        """
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        try:
+            if snapshot:
+                self.snapshot()
+        finally:
+            self.change_log.release_leadership()
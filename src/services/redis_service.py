@@ -1,43 +1,416 @@
+import json
+import zlib
+from typing import List, Optional, Tuple
+import numpy as np
 import redis
+import redis.asyncio
+from utils.config import (CACHE_TTL, REDIS_HOST, REDIS_PORT, REDIS_MAX_CONNECTIONS, REDIS_COMPRESSION,
+                          REDIS_COMPRESSION_MIN_BYTES)
+from utils.logger import setup_logging
+from utils.metrics import timed
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = setup_logging()
+
+RAW, ZLIB, ZSTD = b"\x00", b"\x01", b"\x02"
 
 class RedisService:
     """Service for managing Redis database operations.
 
     Handles storage and retrieval of document text in a Redis database.
-    Establishes a single Redis client connection with decode_responses enabled.
+    Documents are stored under 'doc:<content id>'; filenames are aliases that
+    point to a content id. Extraction results (pages, passage offsets and
+    embeddings) are cached per content id, with an optional TTL after which
+    they expire. Entity spans found at
+    ingestion are stored under 'entities:<content id>', and the filenames
+    pointing at a content id under 'filenames:<content id>'.
+
+    Every key is prefixed with prefix, so several collections can share one
+    Redis without their keys colliding; scoped returns a service for another
+    prefix on the same connection pools.
+
+    Both the synchronous and the asyncio client draw connections from bounded
+    pools. Document text is stored with a one-byte codec header (RAW, ZLIB
+    or ZSTD) and, when longer than compression_min_bytes, compressed with
+    zstd or zlib.
 
     Attributes:
+        pool (redis.ConnectionPool): Connection pool of the synchronous client.
         client (redis.Redis): Redis client instance for database operations.
+        async_client (redis.asyncio.Redis): Redis client for use inside the event loop.
+        compression (str): 'zstd', 'zlib' or 'none'.
+        compression_min_bytes (int): Texts shorter than this are stored uncompressed.
+        cache_ttl (int): Seconds cached extraction results live; 0 keeps them forever.
+        prefix (str): Prepended to every key this service reads or writes.
     """
-    def __init__(self):
-        """Initialize RedisService with a Redis client connection.
+    def __init__(self, host: str = REDIS_HOST, port: int = REDIS_PORT,
+                 max_connections: int = REDIS_MAX_CONNECTIONS, compression: str = REDIS_COMPRESSION,
+                 compression_min_bytes: int = REDIS_COMPRESSION_MIN_BYTES, cache_ttl: int = CACHE_TTL,
+                 client: Optional[redis.Redis] = None, async_client: Optional[redis.asyncio.Redis] = None,
+                 prefix: str = ""):
+        """Initialize RedisService with pooled synchronous and asyncio clients.
+
+        Clients can be passed in instead, e.g. fakeredis clients sharing one
+        server for benchmarks; host, port and max_connections are then ignored.
+
+        Args:
+            host (str): Redis host. Defaults to the REDIS_HOST env var.
+            port (int): Redis port. Defaults to the REDIS_PORT env var.
+            max_connections (int): Connection limit of each pool.
+            compression (str): 'zstd', 'zlib' or 'none'. zstd falls back to zlib
+                when the zstandard package is not installed.
+            compression_min_bytes (int): Texts shorter than this are stored uncompressed.
+            cache_ttl (int): Seconds cached extraction results live; 0 keeps them forever.
+            client (Optional[redis.Redis]): Synchronous client to use instead of a new pool.
+            async_client (Optional[redis.asyncio.Redis]): Asyncio client to use instead of a new pool.
+            prefix (str): Prepended to every key this service reads or writes.
+        """
+        if client is None:
+            client = redis.Redis(connection_pool=redis.ConnectionPool(host=host, port=port,
+                                                                      max_connections=max_connections))
+        if async_client is None:
+            async_client = redis.asyncio.Redis(
+                connection_pool=redis.asyncio.ConnectionPool(host=host, port=port, max_connections=max_connections))
+        self.pool = client.connection_pool
+        self.client = client
+        self.async_client = async_client
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed; using zlib compression")
+            compression = "zlib"
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+        self.cache_ttl = cache_ttl
+        self.prefix = prefix
+        self._zstd_compressor = zstandard.ZstdCompressor() if compression == "zstd" else None
+        self._zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
 
-        Sets up a connection to the Redis server at host 'redis' and port 6379,
-        with decode_responses=True to return strings instead of bytes.
+    def key(self, name: str) -> str:
+        """Return the Redis key of a name under this service's prefix.
+
+        Args:
+            name (str): Unprefixed key, e.g. 'doc:<content id>'.
+
+        Returns:
+            str: Prefixed key.
         """
-        self.client = redis.Redis(host="redis", port=6379, decode_responses=True)
+        return self.prefix + name
 
-    def store_document(self, filename: str, text: str):
-        """Store document text in Redis.
+    def scoped(self, prefix: str) -> "RedisService":
+        """Create a service for another key prefix that shares this service's clients.
+
+        The scoped service must not be closed; closing this one closes both.
+
+        Args:
+            prefix (str): Key prefix of the new service.
+
+        Returns:
+            RedisService: Service with the same clients and settings and the given prefix.
+        """
+        return RedisService(compression=self.compression, compression_min_bytes=self.compression_min_bytes,
+                            cache_ttl=self.cache_ttl, client=self.client, async_client=self.async_client,
+                            prefix=prefix)
+
+    def delete_matching(self, pattern: str, batch_size: int = 500) -> int:
+        """Delete every key matching a glob pattern, scanning incrementally.
+
+        Keys are removed with UNLINK, so Redis frees their memory in the
+        background and the server is never blocked by one large deletion.
+
+        Args:
+            pattern (str): Glob pattern of full (already prefixed) keys.
+            batch_size (int): Keys scanned and unlinked per round trip.
+
+        Returns:
+            int: Number of keys deleted.
+        """
+        deleted = 0
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                deleted += self.client.unlink(*batch)
+                batch = []
+        if batch:
+            deleted += self.client.unlink(*batch)
+        return deleted
+
+    def _encode(self, text: str) -> bytes:
+        raw = text.encode("utf-8")
+        if len(raw) < self.compression_min_bytes or self.compression == "none":
+            return RAW + raw
+        if self.compression == "zstd":
+            return ZSTD + self._zstd_compressor.compress(raw)
+        return ZLIB + zlib.compress(raw)
 
-        Saves the text content associated with a filename as a key-value pair
-        in the Redis database.
+    def _decode(self, value: Optional[bytes]) -> str:
+        if not value:
+            return ""
+        codec, payload = value[:1], value[1:]
+        if codec == ZSTD:
+            if self._zstd_decompressor is None:
+                raise ValueError("Document is zstd-compressed but zstandard is not installed")
+            return self._zstd_decompressor.decompress(payload).decode("utf-8")
+        if codec == ZLIB:
+            return zlib.decompress(payload).decode("utf-8")
+        if codec == RAW:
+            return payload.decode("utf-8")
+        raise ValueError(f"Unknown document codec header {codec!r}")
+
+    @timed("redis_set")
+    def store_document(self, doc_id: str, text: str):
+        """Store document text in Redis.
 
         Args:
-            filename (str): Name of the document to store as the key.
+            doc_id (str): Content id of the document.
             text (str): Text content to store as the value.
         """
-        self.client.set(filename, text)
+        self.client.set(self.key(f"doc:{doc_id}"), self._encode(text))
 
-    def get_document(self, filename: str) -> str:
+    @timed("redis_get")
+    def get_document(self, doc_id: str) -> str:
         """Retrieve document text from Redis.
 
-        Fetches the text content associated with a filename from the Redis database.
+        Args:
+            doc_id (str): Content id of the document.
+
+        Returns:
+            str: Retrieved text content, or empty string if not found.
+        """
+        return self._decode(self.client.get(self.key(f"doc:{doc_id}")))
+
+    @timed("redis_set")
+    def store_documents(self, documents: dict):
+        """Store several documents in one pipelined round trip.
+
+        Args:
+            documents (dict): Text content keyed by content id.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for doc_id, text in documents.items():
+            pipe.set(self.key(f"doc:{doc_id}"), self._encode(text))
+        pipe.execute()
+
+    @timed("redis_get")
+    def get_documents(self, doc_ids: List[str]) -> List[str]:
+        """Retrieve several documents with a single MGET.
+
+        Args:
+            doc_ids (List[str]): Content ids of the documents.
+
+        Returns:
+            List[str]: Text of each document, empty string for missing ones.
+        """
+        if not doc_ids:
+            return []
+        return [self._decode(value) for value in self.client.mget([self.key(f"doc:{doc_id}") for doc_id in doc_ids])]
+
+    async def aget_document(self, doc_id: str) -> str:
+        """Retrieve document text from Redis without blocking the event loop.
 
         Args:
-            filename (str): Name of the document to retrieve.
+            doc_id (str): Content id of the document.
 
         Returns:
             str: Retrieved text content, or empty string if not found.
         """
-        return self.client.get(filename) or ""
+        return self._decode(await self.async_client.get(self.key(f"doc:{doc_id}")))
+
+    async def aget_documents(self, doc_ids: List[str]) -> List[str]:
+        """Retrieve several documents with a single MGET without blocking the event loop.
+
+        Args:
+            doc_ids (List[str]): Content ids of the documents.
+
+        Returns:
+            List[str]: Text of each document, empty string for missing ones.
+        """
+        if not doc_ids:
+            return []
+        values = await self.async_client.mget([self.key(f"doc:{doc_id}") for doc_id in doc_ids])
+        return [self._decode(value) for value in values]
+
+    @timed("redis_set")
+    def store_entities(self, entities: dict):
+        """Store the entity spans of several documents in one pipelined round trip.
+
+        Args:
+            entities (dict): Entity list (as from NERService.annotate_documents) keyed by content id.
+        """
+        if not entities:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for doc_id, spans in entities.items():
+            pipe.set(self.key(f"entities:{doc_id}"), self._encode(json.dumps(spans)))
+        pipe.execute()
+
+    @timed("redis_get")
+    def get_entities(self, doc_ids: List[str]) -> List[Optional[list]]:
+        """Retrieve the entity spans of several documents with a single MGET.
+
+        Args:
+            doc_ids (List[str]): Content ids of the documents.
+
+        Returns:
+            List[Optional[list]]: Entities of each document, or None if none were stored.
+        """
+        if not doc_ids:
+            return []
+        values = self.client.mget([self.key(f"entities:{doc_id}") for doc_id in doc_ids])
+        return [json.loads(self._decode(value)) if value else None for value in values]
+
+    def set_alias(self, filename: str, content_id: str) -> List[str]:
+        """Point a filename at a content id.
+
+        Args:
+            filename (str): Name the document was uploaded under.
+            content_id (str): Content hash of the document.
+
+        Returns:
+            List[str]: Content ids no filename points to anymore, as in set_aliases.
+        """
+        return self.set_aliases({filename: content_id})
+
+    def set_aliases(self, aliases: dict) -> List[str]:
+        """Point several filenames at content ids in pipelined round trips.
+
+        Each content id keeps the filenames pointing at it in the set
+        'filenames:<content id>', so re-uploading a filename with new content
+        can tell whether the old content is still referenced.
+
+        Args:
+            aliases (dict): Content id keyed by filename.
+
+        Returns:
+            List[str]: Content ids that lost their last filename, because it now
+                points to different content.
+        """
+        pipe = self.client.pipeline(transaction=False)
+        for filename, content_id in aliases.items():
+            pipe.set(self.key(f"alias:{filename}"), content_id, get=True)
+            pipe.sadd(self.key(f"filenames:{content_id}"), filename)
+        previous = pipe.execute()[::2]
+        replaced = {filename: old.decode() for (filename, content_id), old in zip(aliases.items(), previous)
+                    if old is not None and old.decode() != content_id}
+        if not replaced:
+            return []
+        candidates = sorted(set(replaced.values()))
+        pipe = self.client.pipeline(transaction=False)
+        for filename, old in replaced.items():
+            pipe.srem(self.key(f"filenames:{old}"), filename)
+        for old in candidates:
+            pipe.scard(self.key(f"filenames:{old}"))
+        counts = pipe.execute()[len(replaced):]
+        return [old for old, count in zip(candidates, counts) if not count]
+
+    def resolve_alias(self, filename: str) -> Optional[str]:
+        """Look up the content id a filename points to.
+
+        Args:
+            filename (str): Name the document was uploaded under.
+
+        Returns:
+            Optional[str]: Content id, or None if the filename is unknown.
+        """
+        content_id = self.client.get(self.key(f"alias:{filename}"))
+        return content_id.decode() if content_id is not None else None
+
+    def cache_extraction(self, content_id: str, pages: List[str], passages: List[dict], vectors: np.ndarray):
+        """Cache extraction and embedding results for a content id.
+
+        Args:
+            content_id (str): Content hash of the document.
+            pages (List[str]): Extracted text of each page.
+            passages (List[dict]): Passages from chunk_pages; only offsets, pages and entity labels are kept.
+            vectors (np.ndarray): float32 embeddings, one row per passage.
+        """
+        self.cache_extractions([(content_id, pages, passages, vectors)])
+
+    @timed("redis_set")
+    def cache_extractions(self, items: List[Tuple[str, List[str], List[dict], np.ndarray]]):
+        """Cache extraction and embedding results of several documents in one pipelined round trip.
+
+        Args:
+            items (List[Tuple[str, List[str], List[dict], np.ndarray]]): Content id,
+                pages, passages and embeddings of each document.
+        """
+        ttl = self.cache_ttl or None
+        pipe = self.client.pipeline(transaction=False)
+        for content_id, pages, passages, vectors in items:
+            spans = [{"start": p["start"], "end": p["end"], "page": p["page"], "labels": p.get("labels", [])}
+                     for p in passages]
+            pipe.set(self.key(f"cache:{content_id}:pages"), self._encode(json.dumps(pages)), ex=ttl)
+            pipe.set(self.key(f"cache:{content_id}:passages"), json.dumps(spans), ex=ttl)
+            pipe.set(self.key(f"cache:{content_id}:vectors"),
+                     np.ascontiguousarray(vectors, dtype=np.float32).tobytes(), ex=ttl)
+        pipe.execute()
+
+    @timed("redis_get")
+    def get_cached_extraction(self, content_id: str) -> Optional[Tuple[List[str], List[dict], np.ndarray]]:
+        """Fetch cached extraction and embedding results for a content id.
+
+        Args:
+            content_id (str): Content hash of the document.
+
+        Returns:
+            Optional[Tuple[List[str], List[dict], np.ndarray]]: Pages, passages
+                (offsets and text) and embeddings, or None if any part is missing.
+        """
+        raw_pages, raw_passages, raw_vectors = self.client.mget(
+            [self.key(f"cache:{content_id}:{part}") for part in ("pages", "passages", "vectors")])
+        if raw_pages is None or raw_passages is None or raw_vectors is None:
+            return None
+        pages = json.loads(self._decode(raw_pages))
+        text = "".join(pages)
+        passages = [{**span, "text": text[span["start"]:span["end"]]} for span in json.loads(raw_passages)]
+        vectors = np.frombuffer(raw_vectors, dtype=np.float32)
+        vectors = vectors.reshape(len(passages), -1) if passages else vectors.reshape(0, 0)
+        return pages, passages, vectors
+
+    @timed("redis_set")
+    def delete_document(self, content_id: str) -> List[str]:
+        """Delete a document's text, entities, cached extraction and the filenames pointing at it.
+
+        Args:
+            content_id (str): Content hash of the document.
+
+        Returns:
+            List[str]: Filenames that pointed at the document and were removed.
+        """
+        filenames = sorted(filename.decode()
+                           for filename in self.client.smembers(self.key(f"filenames:{content_id}")))
+        current = self.client.mget([self.key(f"alias:{filename}") for filename in filenames]) if filenames else []
+        removed = [filename for filename, value in zip(filenames, current)
+                   if value is not None and value.decode() == content_id]
+        self.client.delete(*[self.key(f"alias:{filename}") for filename in removed],
+                           *[self.key(f"{kind}:{content_id}") for kind in ("doc", "entities", "filenames")],
+                           *[self.key(f"cache:{content_id}:{part}") for part in ("pages", "passages", "vectors")])
+        return removed
+
+    def get_index_version(self) -> int:
+        """Get the corpus version, bumped on every ingest.
+
+        Returns:
+            int: Current version, 0 if nothing was ingested yet.
+        """
+        return int(self.client.get(self.key("index:version")) or 0)
+
+    def bump_index_version(self) -> int:
+        """Increment the corpus version after the index changed.
+
+        Returns:
+            int: New version.
+        """
+        return self.client.incr(self.key("index:version"))
+
+    async def aclose(self):
+        """Close the asyncio client and its pool."""
+        await self.async_client.aclose()
+        await self.async_client.connection_pool.disconnect()
+
+    def close(self):
+        """Disconnect all pooled synchronous connections."""
+        self.pool.disconnect()
@@ -0,0 +1,59 @@
+from typing import List
+
+def page_offsets(pages: List[str]) -> List[int]:
+    """Compute where each page starts in the document text.
+
+    Args:
+        pages (List[str]): Text of each page, in order.
+
+    Returns:
+        List[int]: Offset of each page in "".join(pages).
+    """
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page)
+    return offsets
+
+def chunk_pages(pages: List[str], chunk_size: int, overlap: int) -> List[dict]:
+    """Split page texts into overlapping passages.
+
+    Passages never cross a page boundary. Window edges are moved back to the
+    nearest whitespace so words are not cut in half. Offsets are absolute
+    positions in the document text, i.e. in "".join(pages).
+
+    Args:
+        pages (List[str]): Text of each page, in order.
+        chunk_size (int): Maximum passage length in characters.
+        overlap (int): Number of characters shared by consecutive passages.
+
+    Returns:
+        List[dict]: Passages with 'text', 'start', 'end' and 'page' (1-based) keys.
+
+    Raises:
+        ValueError: If overlap is not smaller than chunk_size.
+    """
+    if overlap >= chunk_size:
+        raise ValueError("Chunk overlap must be smaller than chunk size")
+    passages = []
+    for page_number, (page, page_start) in enumerate(zip(pages, page_offsets(pages)), start=1):
+        position = 0
+        while position < len(page):
+            end = min(position + chunk_size, len(page))
+            if end < len(page):
+                boundary = page.rfind(" ", position + overlap + 1, end)
+                if boundary != -1:
+                    end = boundary
+            text = page[position:end]
+            if text.strip():
+                passages.append({
+                    "text": text,
+                    "start": page_start + position,
+                    "end": page_start + end,
+                    "page": page_number
+                })
+            if end >= len(page):
+                break
+            position = max(end - overlap, position + 1)
+    return passages
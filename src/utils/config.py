@@ -0,0 +1,74 @@
+import os
+
+CHUNK_SIZE = int(os.getenv("DIS_CHUNK_SIZE", "800"))
+CHUNK_OVERLAP = int(os.getenv("DIS_CHUNK_OVERLAP", "200"))
+EMBED_BATCH_SIZE = int(os.getenv("DIS_EMBED_BATCH_SIZE", "64"))
+RETRIEVAL_TOP_K = int(os.getenv("DIS_RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MODE = os.getenv("DIS_RETRIEVAL_MODE", "hybrid")
+RRF_K = int(os.getenv("DIS_RRF_K", "60"))
+HYBRID_CANDIDATES = int(os.getenv("DIS_HYBRID_CANDIDATES", "4"))
+KEYWORD_MAX_TOKENS = int(os.getenv("DIS_KEYWORD_MAX_TOKENS", "4"))
+INDEX_DIR = os.getenv("DIS_INDEX_DIR", "data/index")
+SNAPSHOT_INTERVAL = float(os.getenv("DIS_SNAPSHOT_INTERVAL", "300"))
+INDEX_TYPE = os.getenv("DIS_INDEX_TYPE", "flat")
+INDEX_PROMOTION_THRESHOLD = int(os.getenv("DIS_INDEX_PROMOTION_THRESHOLD", "50000"))
+INDEX_TRAIN_SAMPLE = int(os.getenv("DIS_INDEX_TRAIN_SAMPLE", "65536"))
+COMPACTION_THRESHOLD = float(os.getenv("DIS_COMPACTION_THRESHOLD", "0.2"))
+COMPACTION_MIN_TOMBSTONES = int(os.getenv("DIS_COMPACTION_MIN_TOMBSTONES", "256"))
+INDEX_MAX_DELTA = int(os.getenv("DIS_INDEX_MAX_DELTA", "50000"))
+INDEX_MAX_SEGMENTS = int(os.getenv("DIS_INDEX_MAX_SEGMENTS", "8"))
+INDEX_SYNC_BLOCK_MS = int(os.getenv("DIS_INDEX_SYNC_BLOCK_MS", "1000"))
+INDEX_SYNC_ON_READ = os.getenv("DIS_INDEX_SYNC_ON_READ", "true").lower() in ("1", "true", "yes")
+INDEX_LEADER_LEASE_MS = int(os.getenv("DIS_INDEX_LEADER_LEASE_MS", "15000"))
+DEFAULT_COLLECTION = os.getenv("DIS_DEFAULT_COLLECTION", "default")
+COLLECTION_SEARCH_WORKERS = int(os.getenv("DIS_COLLECTION_SEARCH_WORKERS", "4"))
+ASK_MAX_COLLECTIONS = int(os.getenv("DIS_ASK_MAX_COLLECTIONS", "16"))
+MAX_COLLECTIONS = int(os.getenv("DIS_MAX_COLLECTIONS", "256"))
+MAX_OPEN_COLLECTIONS = int(os.getenv("DIS_MAX_OPEN_COLLECTIONS", "32"))
+COLLECTION_IDLE_SECONDS = float(os.getenv("DIS_COLLECTION_IDLE_SECONDS", "600"))
+HNSW_M = int(os.getenv("DIS_HNSW_M", "32"))
+PQ_M = int(os.getenv("DIS_PQ_M", "48"))
+DEFAULT_NPROBE = int(os.getenv("DIS_DEFAULT_NPROBE", "16"))
+DEFAULT_EF_SEARCH = int(os.getenv("DIS_DEFAULT_EF_SEARCH", "64"))
+INGEST_WORKERS = int(os.getenv("DIS_INGEST_WORKERS", "2"))
+INGEST_QUEUE_DEPTH = int(os.getenv("DIS_INGEST_QUEUE_DEPTH", "64"))
+SPOOL_DIR = os.getenv("DIS_SPOOL_DIR", "data/spool")
+JOB_TTL = float(os.getenv("DIS_JOB_TTL", "3600"))
+QA_BATCH_MAX_SIZE = int(os.getenv("DIS_QA_BATCH_MAX_SIZE", "16"))
+QA_BATCH_MAX_WAIT_MS = float(os.getenv("DIS_QA_BATCH_MAX_WAIT_MS", "5"))
+QA_TOP_K = int(os.getenv("DIS_QA_TOP_K", "5"))
+QA_MAX_ANSWERS = int(os.getenv("DIS_QA_MAX_ANSWERS", "3"))
+QA_SPANS_PER_PASSAGE = int(os.getenv("DIS_QA_SPANS_PER_PASSAGE", "2"))
+QA_RETRIEVAL_WEIGHT = float(os.getenv("DIS_QA_RETRIEVAL_WEIGHT", "0.3"))
+QA_EARLY_EXIT_WAVE = int(os.getenv("DIS_QA_EARLY_EXIT_WAVE", "2"))
+INFERENCE_WORKERS = int(os.getenv("DIS_INFERENCE_WORKERS", "2"))
+ASK_MAX_QUEUE = int(os.getenv("DIS_ASK_MAX_QUEUE", "64"))
+ASK_DEADLINE_MS = float(os.getenv("DIS_ASK_DEADLINE_MS", "10000"))
+INGEST_NICE = int(os.getenv("DIS_INGEST_NICE", "10"))
+CACHE_TTL = int(os.getenv("DIS_CACHE_TTL", str(7 * 24 * 3600)))
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_MAX_CONNECTIONS = int(os.getenv("DIS_REDIS_MAX_CONNECTIONS", "64"))
+REDIS_COMPRESSION = os.getenv("DIS_REDIS_COMPRESSION", "zstd")
+REDIS_COMPRESSION_MIN_BYTES = int(os.getenv("DIS_REDIS_COMPRESSION_MIN_BYTES", "512"))
+ANSWER_CACHE_SIZE = int(os.getenv("DIS_ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = int(os.getenv("DIS_ANSWER_CACHE_TTL", "3600"))
+MODEL_PRELOAD = os.getenv("DIS_MODEL_PRELOAD", "background")
+EMBED_BACKEND = os.getenv("DIS_EMBED_BACKEND", "torch")
+QA_BACKEND = os.getenv("DIS_QA_BACKEND", "torch")
+NER_BATCH_SIZE = int(os.getenv("DIS_NER_BATCH_SIZE", "64"))
+MAX_FILE_BYTES = int(os.getenv("DIS_MAX_FILE_BYTES", str(50 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("DIS_MAX_REQUEST_BYTES", str(200 * 1024 * 1024)))
+PDF_WORKERS = int(os.getenv("DIS_PDF_WORKERS", "4"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("DIS_PDF_PARALLEL_MIN_PAGES", "8"))
+PDF_OCR_DPI = int(os.getenv("DIS_PDF_OCR_DPI", "200"))
+OCR_BATCH_SIZE = int(os.getenv("DIS_OCR_BATCH_SIZE", "8"))
+OCR_TARGET_TEXT_HEIGHT = int(os.getenv("DIS_OCR_TARGET_TEXT_HEIGHT", "32"))
+OCR_PROBE_SIDE = int(os.getenv("DIS_OCR_PROBE_SIDE", "800"))
+OCR_MAX_SIDE = int(os.getenv("DIS_OCR_MAX_SIDE", "2560"))
+OCR_TILE_SIZE = int(os.getenv("DIS_OCR_TILE_SIZE", "2048"))
+OCR_TILE_OVERLAP = int(os.getenv("DIS_OCR_TILE_OVERLAP", "128"))
+OCR_THREADS = int(os.getenv("DIS_OCR_THREADS", "0"))
+OCR_WORKERS = int(os.getenv("DIS_OCR_WORKERS", "0"))
+PROFILING_ENABLED = os.getenv("DIS_PROFILING", "false").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL_MS = float(os.getenv("DIS_PROFILE_INTERVAL_MS", "5"))
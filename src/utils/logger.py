@@ -1,10 +1,17 @@
 import logging
+import os
+import threading
+
+_configured = False
+_lock = threading.Lock()
 
 def setup_logging(log_file="src.log"):
     """Set up logging configuration with file and console output.
 
     Configures logging to write to both a file and the console with a
-    specified format and INFO level.
+    specified format and the level from the DIS_LOG_LEVEL env var (INFO by
+    default). Handlers are installed by the first call only; later calls
+    just return the logger.
 
     Args:
         log_file (str, optional): Path to the log file. Defaults to "src.log".
@@ -12,12 +19,17 @@ def setup_logging(log_file="src.log"):
     Returns:
         logging.Logger: Configured logger instance.
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )    
+    global _configured
+    if not _configured:
+        with _lock:
+            if not _configured:
+                logging.basicConfig(
+                    level=os.getenv("DIS_LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    handlers=[
+                        logging.FileHandler(log_file),
+                        logging.StreamHandler()
+                    ]
+                )
+                _configured = True
     return logging.getLogger(__name__)
@@ -0,0 +1,254 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Tuple, Union
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Histogram:
+    """Thread-safe latency histogram with fixed buckets, one series per label set.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Help text.
+        buckets (tuple): Upper bounds of the buckets in seconds.
+    """
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        """Initialize Histogram.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text.
+            buckets (tuple): Ascending upper bounds of the buckets.
+        """
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Record one observation.
+
+        Args:
+            value (float): Observed value, e.g. seconds.
+            **labels: Label values of the series.
+        """
+        key = tuple(sorted(labels.items()))
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the wall-clock duration of a block.
+
+        Args:
+            **labels: Label values of the series.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines)
+
+class Counter:
+    """Thread-safe monotonically increasing counter, one series per label set.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Help text.
+    """
+    def __init__(self, name: str, help: str):
+        """Initialize Counter.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text.
+        """
+        self.name = name
+        self.help = help
+        self._series: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the counter.
+
+        Args:
+            amount (float): Non-negative increment.
+            **labels: Label values of the series.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = sorted(self._series.items())
+        lines.extend(f"{self.name}{_format_labels(key)} {value}" for key, value in series)
+        return "\n".join(lines)
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time.
+
+    The callback returns a number, or a dict mapping label tuples
+    (e.g. (('tier', 'local'),)) to numbers for several series.
+
+    Attributes:
+        name (str): Metric name.
+        help (str): Help text.
+        callback (Callable): Function returning the current value.
+    """
+    def __init__(self, name: str, help: str, callback: Callable[[], Union[float, dict]]):
+        """Initialize Gauge.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text.
+            callback (Callable[[], Union[float, dict]]): Function returning the current value.
+        """
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        value = self.callback()
+        values = value if isinstance(value, dict) else {(): value}
+        lines.extend(f"{self.name}{_format_labels(key)} {float(number)}" for key, number in sorted(values.items()))
+        return "\n".join(lines)
+
+class MetricsRegistry:
+    """Process-wide collection of metrics rendered in the Prometheus text format.
+
+    Metrics are created on first use by name, so modules can record
+    observations without coordinating registration.
+    """
+    def __init__(self):
+        """Initialize an empty MetricsRegistry."""
+        self._metrics: Dict[str, Union[Histogram, Counter, Gauge]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, cls(name, *args))
+        return metric
+
+    def histogram(self, name: str, help: str = "", buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text, used when the histogram is created.
+            buckets (tuple): Bucket bounds, used when the histogram is created.
+
+        Returns:
+            Histogram: The histogram registered under the name.
+        """
+        return self._get(Histogram, name, help, buckets)
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        """Get or create a counter.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text, used when the counter is created.
+
+        Returns:
+            Counter: The counter registered under the name.
+        """
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str, callback: Callable[[], Union[float, dict]]):
+        """Register or replace a callback gauge.
+
+        Args:
+            name (str): Metric name.
+            help (str): Help text.
+            callback (Callable[[], Union[float, dict]]): Function returning the current value.
+        """
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, callback)
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text ending with a newline.
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        return "\n".join(metric.render() for _, metric in metrics) + "\n"
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = "dis_stage_duration_seconds"
+
+def stage_timer(stage: str):
+    """Time a block as one observation of a pipeline stage.
+
+    Args:
+        stage (str): Stage name, e.g. 'faiss_search'.
+
+    Returns:
+        ContextManager: Context manager recording the block's duration.
+    """
+    return metrics.histogram(STAGE_SECONDS, "Duration of pipeline stages in seconds.").time(stage=stage)
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage duration measured elsewhere, e.g. in a worker process.
+
+    Args:
+        stage (str): Stage name.
+        seconds (float): Duration in seconds.
+    """
+    metrics.histogram(STAGE_SECONDS, "Duration of pipeline stages in seconds.").observe(seconds, stage=stage)
+
+def timed(stage: str) -> Callable:
+    """Decorate a function so each call is observed as a pipeline stage.
+
+    Args:
+        stage (str): Stage name.
+
+    Returns:
+        Callable: Decorator.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
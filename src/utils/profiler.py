@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Optional
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of all threads at a fixed interval.
+
+    Samples every thread of the process, so work handed to the QA batcher
+    or the threadpool is captured, as is work of concurrent requests. The
+    result is in the folded-stack format read by flamegraph.pl and speedscope.
+
+    Attributes:
+        interval (float): Seconds between samples.
+        samples (int): Number of sampling rounds taken.
+    """
+    def __init__(self, interval: float = 0.005):
+        """Initialize SamplingProfiler.
+
+        Args:
+            interval (float): Seconds between samples.
+        """
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "SamplingProfiler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """Render the collected stacks, most frequent first.
+
+        Returns:
+            str: One 'frame;frame;... count' line per distinct stack.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
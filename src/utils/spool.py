@@ -0,0 +1,105 @@
+import hashlib
+import os
+import uuid
+from typing import List, Optional, Tuple
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds its size limit."""
+
+class _SpoolFile:
+    """File part of a multipart body being written to its spool file."""
+    def __init__(self, filename: str, directory: str):
+        self.filename = filename
+        self.path = os.path.join(directory, uuid.uuid4().hex)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.handle = open(self.path, "wb")
+
+async def spool_multipart(request: Request, field: str, directory: str, max_file_bytes: int, max_bytes: int,
+                          extensions: Tuple[str, ...]) -> List[Tuple[str, str, str]]:
+    """Stream the files of a multipart/form-data request into spool files while hashing them.
+
+    The body is parsed as it arrives and each file is written straight to
+    its spool file, so an upload is written to disk once and memory use does
+    not depend on its size. Limits are checked on every chunk, so reading
+    stops at the first chunk over them. Parts of other fields and parts
+    without a filename are skipped. All spool files are removed if the
+    request fails.
+
+    Args:
+        request (Request): Request with a multipart/form-data body.
+        field (str): Form field the files are sent under.
+        directory (str): Spool directory.
+        max_file_bytes (int): Largest accepted file in bytes.
+        max_bytes (int): Largest accepted total of all files in bytes.
+        extensions (Tuple[str, ...]): Accepted lowercase filename extensions.
+
+    Returns:
+        List[Tuple[str, str, str]]: Filename, spool file path and hex SHA-256 of the content of each file, in order.
+
+    Raises:
+        UploadTooLargeError: If a file is larger than max_file_bytes or all files together than max_bytes.
+        ValueError: If the body is not multipart/form-data or a file has an unsupported extension.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise ValueError("Expected a multipart/form-data body")
+    events = []
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": lambda: events.append(("begin", b"")),
+        "on_header_field": lambda data, start, end: events.append(("field", bytes(data[start:end]))),
+        "on_header_value": lambda data, start, end: events.append(("value", bytes(data[start:end]))),
+        "on_header_end": lambda: events.append(("header", b"")),
+        "on_headers_finished": lambda: events.append(("headers", b"")),
+        "on_part_data": lambda data, start, end: events.append(("data", bytes(data[start:end]))),
+        "on_part_end": lambda: events.append(("end", b""))})
+    spooled: List[_SpoolFile] = []
+    current: Optional[_SpoolFile] = None
+    headers, name, value, total = {}, b"", b"", 0
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for kind, data in events:
+                if kind == "begin":
+                    headers, name, value, current = {}, b"", b"", None
+                elif kind == "field":
+                    name += data
+                elif kind == "value":
+                    value += data
+                elif kind == "header":
+                    headers[name.lower()] = value
+                    name, value = b"", b""
+                elif kind == "headers":
+                    _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+                    filename = disposition.get(b"filename")
+                    if disposition.get(b"name") == field.encode() and filename:
+                        filename = filename.decode("utf-8", "replace")
+                        if not filename.lower().endswith(extensions):
+                            raise ValueError(f"Unsupported file type: {filename}")
+                        current = _SpoolFile(filename, directory)
+                        spooled.append(current)
+                elif kind == "data" and current is not None:
+                    current.size += len(data)
+                    total += len(data)
+                    if current.size > max_file_bytes:
+                        raise UploadTooLargeError(f"{current.filename} exceeds the limit of {max_file_bytes} bytes")
+                    if total > max_bytes:
+                        raise UploadTooLargeError(f"Upload exceeds the limit of {max_bytes} bytes")
+                    current.digest.update(data)
+                    await run_in_threadpool(current.handle.write, data)
+                elif kind == "end" and current is not None:
+                    current.handle.close()
+                    current = None
+            events.clear()
+        parser.finalize()
+        if current is not None:
+            raise ValueError("Incomplete multipart body")
+    except BaseException:
+        for spool in spooled:
+            spool.handle.close()
+            os.remove(spool.path)
+        raise
+    return [(spool.filename, spool.path, spool.digest.hexdigest()) for spool in spooled]